@@ -0,0 +1,273 @@
+import argparse
+import os
+import statistics
+from recorder import (Trace, NODE_SENDER, NODE_RECEIVER, NODE_INTERMEDIATE, EVENT_NAMES, DROP_REASONS, EVENT_SEND,
+                      EVENT_RETRANSMIT, EVENT_RECEIVE, EVENT_CORRUPT, EVENT_RTT, EVENT_TIMEOUT, EVENT_DROP,
+                      EVENT_REORDER, TOWARDS_SENDER, TOWARDS_RECEIVER)
+from packet import TYPE_DATA, TYPE_EOT, TYPE_ACK, TYPE_SACK
+
+# Constants
+PACKET_TYPES = ("data", "setup", "eot", "ack", "sack", "parity")  # Names of the packet.TYPE_* numbers
+STALL_RTTS = 4  # Median RTTs without progress of the cumulative ACK that make a stall, by default
+MIN_STALL = 0.01  # Shortest stall reported by default, in seconds
+MAX_STALLS = 10  # Longest stalls explained in the report
+
+
+def load_traces(paths, flow=None):
+    """Read ring files and put the times of their records on one timeline.
+
+    :param paths: Paths of the ring files, at most one per node.
+    :param flow: Only keep the Intermediate's records of this flow, by default all of them.
+    :return: Dict of node name to (Trace, records), with the time of every record in seconds since the
+        earliest trace was created.
+    :raises ValueError: If a file is not a trace or two files are of the same node.
+    """
+    traces = [Trace(path) for path in paths]
+    origin = min(trace.wall_start for trace in traces)
+    nodes = {}
+    for trace in traces:
+        if trace.node in nodes:
+            raise ValueError(f"{trace.path} and {nodes[trace.node][0].path} are both traces of the {trace.node}")
+        offset = trace.offset(origin)
+        records = [(time + offset, *record) for time, *record in trace.records
+                   if flow is None or trace.node != NODE_INTERMEDIATE or record[2] == flow]
+        nodes[trace.node] = (trace, records)
+    return nodes
+
+
+def count_events(records):
+    """Count the records of every event and packet type.
+
+    :param records: Records of one node.
+    :return: Dict of (event name, packet type name) to count.
+    """
+    counts = {}
+    for _, event, packet_type, *_ in records:
+        key = (EVENT_NAMES[event], PACKET_TYPES[packet_type] if packet_type < len(PACKET_TYPES) else "unknown")
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def sequence_series(nodes):
+    """Data packet and ACK events of every node, the points of a sequence/time plot.
+
+    :param nodes: As returned by load_traces.
+    :return: Sorted list of (seconds, node, event name, packet type name, sequence number).
+    """
+    series = []
+    for node, (_, records) in nodes.items():
+        for time, event, packet_type, _, _, seq_num, _, _ in records:
+            if packet_type in (TYPE_DATA, TYPE_ACK, TYPE_SACK) and event != EVENT_RTT:
+                series.append((time, node, EVENT_NAMES[event], PACKET_TYPES[packet_type], seq_num))
+    series.sort()
+    return series
+
+
+def rtt_series(records):
+    """RTT samples of the sender.
+
+    :param records: Records of the sender.
+    :return: List of (seconds, sequence number, RTT in seconds, RTO in seconds).
+    """
+    return [(time, seq_num, a / 1e6, b / 1e6) for time, event, _, _, _, seq_num, a, b in records if event == EVENT_RTT]
+
+
+def window_series(records):
+    """Window occupancy of the sender after every packet it sent and every ACK it received.
+
+    :param records: Records of the sender.
+    :return: List of (seconds, packets in flight, congestion window).
+    """
+    return [(time, a, b) for time, event, _, _, _, _, a, b in records
+            if event in (EVENT_SEND, EVENT_RETRANSMIT, EVENT_RECEIVE)]
+
+
+def window_usage(window):
+    """Average the window occupancy over time.
+
+    :param window: As returned by window_series.
+    :return: Tuple (time-weighted mean packets in flight, fraction of the time the window was full), or None
+        if the series covers no time.
+    """
+    in_flight = full = 0.0
+    for (time, flight, cwnd), (next_time, _, _) in zip(window, window[1:]):
+        in_flight += flight * (next_time - time)
+        if flight >= cwnd:
+            full += next_time - time
+    span = window[-1][0] - window[0][0] if window else 0
+    if span <= 0:
+        return None
+    return in_flight / span, full / span
+
+
+def progress(records):
+    """Times the cumulative ACK moved forward at the sender.
+
+    :param records: Records of the sender.
+    :return: List of (seconds, next packet not acknowledged), from the first data packet sent to the EOT packet.
+    """
+    points = []
+    acked = 0
+    for time, event, packet_type, _, _, seq_num, _, _ in records:
+        if event == EVENT_SEND and packet_type == TYPE_DATA and not points:
+            points.append((time, 0))
+        elif event == EVENT_SEND and packet_type == TYPE_EOT:
+            break
+        elif event == EVENT_RECEIVE and points:
+            next_seq_num = seq_num + 1 if packet_type == TYPE_ACK else seq_num if packet_type == TYPE_SACK else 0
+            if next_seq_num > acked:
+                acked = next_seq_num
+                points.append((time, acked))
+    return points
+
+
+def find_stalls(points, threshold):
+    """Find the intervals in which the cumulative ACK did not move.
+
+    :param points: As returned by progress.
+    :param threshold: Shortest interval reported, in seconds.
+    :return: List of (start, end, packet waited for), in the order they happened.
+    """
+    return [(start, end, waited) for (start, waited), (end, _) in zip(points, points[1:]) if end - start >= threshold]
+
+
+def explain_stall(stall, nodes):
+    """Put together what every trace saw of the packet a stall waited for, and of the ACKs lost during it.
+
+    :param stall: Tuple (start, end, packet waited for).
+    :param nodes: As returned by load_traces.
+    :return: Sorted list of (seconds, finding), e.g. "dropped (loss) by the intermediate".
+    """
+    start, end, waited = stall
+    _, sender = nodes[NODE_SENDER]
+    findings = [(time, "sent by the sender" if event == EVENT_SEND else "retransmitted by the sender")
+                for time, event, packet_type, _, _, seq_num, _, _ in sender
+                if event in (EVENT_SEND, EVENT_RETRANSMIT) and packet_type == TYPE_DATA and seq_num == waited
+                and time <= end]
+    sent = bool(findings)
+    findings += [(time, f"timeout at the sender, {a} timer{'s' if a != 1 else ''} expired")
+                 for time, event, _, _, _, _, a, _ in sender if event == EVENT_TIMEOUT and start <= time <= end]
+    if NODE_INTERMEDIATE in nodes:
+        for time, event, packet_type, _, _, seq_num, a, b in nodes[NODE_INTERMEDIATE][1]:
+            if time > end:
+                break
+            if b == TOWARDS_RECEIVER and packet_type == TYPE_DATA and seq_num == waited:
+                if event == EVENT_DROP:
+                    findings.append((time, f"dropped ({DROP_REASONS[a]}) by the intermediate"))
+                elif event == EVENT_CORRUPT:
+                    findings.append((time, "corrupted by the intermediate"))
+                elif event == EVENT_REORDER:
+                    findings.append((time, f"held back {a / 1000:.3f} ms by the intermediate"))
+            elif b == TOWARDS_SENDER and event in (EVENT_DROP, EVENT_CORRUPT) and time >= start and (
+                    packet_type == TYPE_ACK and seq_num >= waited or packet_type == TYPE_SACK and seq_num > waited):
+                fate = f"dropped ({DROP_REASONS[a]})" if event == EVENT_DROP else "corrupted"
+                findings.append((time, f"ACK {seq_num} {fate} by the intermediate"))
+    if NODE_RECEIVER in nodes:
+        for time, event, packet_type, _, _, seq_num, _, _ in nodes[NODE_RECEIVER][1]:
+            if packet_type == TYPE_DATA and seq_num == waited and time <= end:
+                if event == EVENT_CORRUPT:
+                    findings.append((time, "failed its checksum at the receiver"))
+                elif event == EVENT_RECEIVE:
+                    findings.append((time, "reached the receiver"))
+    if not sent:
+        findings.append((start, "not sent yet, the sender had nothing in flight"))
+    findings.sort()
+    return findings
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values.
+
+    :param values: Sorted values.
+    :param fraction: Percentile between 0 and 1.
+    :return: The value.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def write_csv(path, header, rows, formats):
+    """Write rows as CSV.
+
+    :param path: File to write.
+    :param header: Names of the columns.
+    :param rows: Tuples of values.
+    :param formats: Format spec of every column.
+    """
+    with open(path, "w") as f:
+        f.write(",".join(header) + "\n")
+        for row in rows:
+            f.write(",".join(format(value, spec) for value, spec in zip(row, formats)) + "\n")
+
+
+def analyze(nodes, threshold=None, output=None):
+    """Print the report of a set of traces and write their series as CSV.
+
+    :param nodes: As returned by load_traces.
+    :param threshold: Shortest stall in seconds, by default STALL_RTTS median RTTs and at least MIN_STALL.
+    :param output: Directory to write seq.csv, rtt.csv, window.csv and stalls.csv to, None to skip them.
+    :return: List of stalls as returned by find_stalls, empty without a sender trace.
+    """
+    for node, (trace, records) in nodes.items():
+        span = records[-1][0] - records[0][0] if records else 0
+        counts = count_events(records)
+        print(f"{node}: {len(records)} records over {span:.3f} s"
+              + (f", the oldest {trace.overwritten} overwritten" if trace.overwritten else ""))
+        print("  " + ", ".join(f"{event} {packet_type} {count}" for (event, packet_type), count in sorted(counts.items())))
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+        write_csv(os.path.join(output, "seq.csv"), ("seconds", "node", "event", "type", "seq"),
+                  sequence_series(nodes), (".6f", "", "", "", "d"))
+    if NODE_SENDER not in nodes:
+        return []
+
+    sender = nodes[NODE_SENDER][1]
+    rtts = rtt_series(sender)
+    window = window_series(sender)
+    samples = sorted(rtt for _, _, rtt, _ in rtts)
+    if samples:
+        print(f"RTT: {len(samples)} samples, min {samples[0] * 1000:.3f} ms, median "
+              f"{percentile(samples, 0.5) * 1000:.3f} ms, p90 {percentile(samples, 0.9) * 1000:.3f} ms, "
+              f"max {samples[-1] * 1000:.3f} ms")
+    usage = window_usage(window)
+    if usage is not None:
+        print(f"Window: {usage[0]:.1f} packets in flight on average, full {usage[1]:.0%} of the time")
+    if threshold is None:
+        threshold = max(MIN_STALL, STALL_RTTS * statistics.median(samples)) if samples else MIN_STALL
+    points = progress(sender)
+    stalls = find_stalls(points, threshold)
+    duration = points[-1][0] - points[0][0] if len(points) > 1 else 0
+    stalled = sum(end - start for start, end, _ in stalls)
+    if duration > 0:
+        print(f"Data acknowledged in {duration:.3f} s, {len(stalls)} stalls of {threshold * 1000:.1f} ms or more "
+              f"took {stalled:.3f} s ({stalled / duration:.0%})")
+    for stall in sorted(stalls, key=lambda stall: stall[0] - stall[1])[:MAX_STALLS]:
+        start, end, waited = stall
+        print(f"  {start:.6f} s to {end:.6f} s ({(end - start) * 1000:.1f} ms) waiting for packet {waited}")
+        for time, finding in explain_stall(stall, nodes):
+            print(f"    {time:.6f} s  {finding}")
+    if output is not None:
+        write_csv(os.path.join(output, "rtt.csv"), ("seconds", "seq", "rtt", "rto"), rtts, (".6f", "d", ".6f", ".6f"))
+        write_csv(os.path.join(output, "window.csv"), ("seconds", "in_flight", "cwnd"), window, (".6f", "d", "d"))
+        write_csv(os.path.join(output, "stalls.csv"), ("start", "end", "seq"), stalls, (".6f", ".6f", "d"))
+    return stalls
+
+
+def main():
+    """Parse command-line arguments and analyse the traces."""
+    parser = argparse.ArgumentParser(description="Analyse the packet traces recorded by the nodes of a transfer")
+    parser.add_argument("traces", nargs="+", help="Ring files of the sender, receiver and intermediate, any subset")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Directory to write the sequence, RTT, window and stall series to as CSV")
+    parser.add_argument("--stall", type=float, default=None,
+                        help=f"Milliseconds without progress that make a stall, by default {STALL_RTTS} median RTTs")
+    parser.add_argument("--flow", type=int, default=None, help="Only use the intermediate's records of this flow")
+
+    args = parser.parse_args()
+    try:
+        nodes = load_traces(args.traces, args.flow)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    analyze(nodes, None if args.stall is None else args.stall / 1000, args.output)
+
+if __name__ == "__main__":
+    main()
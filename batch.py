@@ -0,0 +1,376 @@
+import bisect
+import glob
+import logging
+import os
+import struct
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from cache import UNKNOWN_SUM
+from packet import PacketCodec
+from stream import FileSink
+
+# Constants
+RECORD = struct.Struct('!HQ')  # Record header in a batch stream: name length and file size, then name and content
+CHUNK_SIZE = 1024 * 1024  # Bytes of the batch stream loaded at a time, rounded down to whole packets
+PREFETCH_CHUNKS = 8  # Chunks loaded ahead of the one being sent
+KEPT_CHUNKS = 8  # Chunks kept behind the one being sent, for retransmissions
+PREFETCH_WORKERS = 4  # Threads loading and summing chunks ahead of the Sender
+
+logger = logging.getLogger(__name__)
+
+
+def safe_name(name):
+    """Normalize the name of a file in a batch to a relative path that stays inside the directory it is
+    written to or matched in.
+
+    :param name: Name using / or \\ as separators.
+    :return: The relative path, or None if the name is empty, absolute or climbs out with "..".
+    """
+    if not name or name.startswith(("/", "\\")) or os.path.isabs(name):
+        return None
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    return os.path.join(*parts)
+
+
+def expand_paths(patterns, root=None):
+    """List the files named by paths, glob patterns and directories, for a batch.
+
+    A directory stands for every file below it. Files given directly or matched by a pattern are named by
+    their base name, and files found in a directory by their path relative to the directory's parent, so the
+    directory is recreated on the other end. With a root, patterns are matched in it and every file is named
+    by its path relative to it.
+
+    :param patterns: Paths, glob patterns (** matches subdirectories) and directories.
+    :param root: Directory the patterns are relative to, by default the working directory.
+    :return: List of (name, path) in the order of the patterns, sorted within each, without repeated names.
+    :raises FileNotFoundError: If a pattern matches nothing.
+    """
+    files = []
+    names = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.join(root, pattern) if root else pattern, recursive=True))
+        if not matches:
+            raise FileNotFoundError(f"No file matches {pattern}")
+        for match in matches:
+            if os.path.isdir(match):
+                base = root or os.path.dirname(os.path.normpath(match)) or os.curdir
+                found = []
+                for directory, subdirectories, filenames in os.walk(match):
+                    subdirectories.sort()
+                    found.extend(os.path.join(directory, filename) for filename in sorted(filenames))
+            else:
+                base = root
+                found = [match]
+            for path in found:
+                name = os.path.relpath(path, base) if base else os.path.basename(path)
+                if name not in names and os.path.isfile(path):
+                    names.add(name)
+                    files.append((name.replace(os.sep, "/"), path))
+    return files
+
+
+class ChunkSums:
+    """Payload sums of the packets of a BatchSource, kept with its loaded chunks.
+
+    The Sender indexes it by sequence number like the array of a cache.CachedSource. Only the chunks the
+    source holds have sums, so memory stays bounded whatever the size of the batch.
+    """
+    def __init__(self, source):
+        """Attach to a source whose chunks are summed.
+
+        :param source: The BatchSource.
+        """
+        self.source = source
+        self.packets_per_chunk = source.chunk_size // source.payload_size
+
+    def lookup(self, seq_num):
+        """Find the sums of the chunk of a packet.
+
+        :param seq_num: Sequence number of the packet.
+        :return: Tuple (array of sums or None, index in it).
+        """
+        chunk, index = divmod(seq_num, self.packets_per_chunk)
+        future = self.source.chunks.get(chunk)
+        if future is None or not future.done():
+            return None, index
+        return future.result()[1], index
+
+    def __getitem__(self, seq_num):
+        sums, index = self.lookup(seq_num)
+        return UNKNOWN_SUM if sums is None else sums[index]
+
+    def __setitem__(self, seq_num, payload_sum):
+        sums, index = self.lookup(seq_num)
+        if sums is not None:
+            sums[index] = payload_sum
+
+
+class BatchSource:
+    """The files of a batch as one stream of records, sent by a single Sender in one session.
+
+    Every record is a RECORD header with the length of the file's name and the size of its content, then the
+    name and the content. The sizes are taken when the source is created, so the setup packet announces the
+    size of the whole stream.
+
+    The stream is loaded CHUNK_SIZE bytes at a time, and a pool of threads loads the PREFETCH_CHUNKS chunks
+    after the one being sent, opening and reading the next files while the current one is in flight. Once
+    the Sender asks for payload sums, chunks are cut at packet boundaries and the threads also sum the
+    payloads of the packets in them. File reads release the GIL, and so does zlib.crc32, while the inet sum
+    does not. A chunk that was dropped is loaded again if a retransmission needs it.
+    """
+    def __init__(self, files, workers=PREFETCH_WORKERS):
+        """Lay out the stream.
+
+        :param files: List of (name, path), e.g. from expand_paths.
+        :param workers: Threads loading chunks ahead, 0 loads every chunk when it is first read.
+        :raises OSError: If a file cannot be read.
+        :raises ValueError: If a name is too long for its record.
+        """
+        self.paths = []
+        self.headers = []
+        self.starts = []
+        self.size = 0
+        for name, path in files:
+            encoded = name.encode('utf-8')
+            if len(encoded) > 0xFFFF:
+                raise ValueError(f"Name of {len(encoded)} bytes does not fit in a batch record")
+            header = RECORD.pack(len(encoded), os.path.getsize(path)) + encoded
+            self.paths.append(path)
+            self.headers.append(header)
+            self.starts.append(self.size)
+            self.size += len(header) + RECORD.unpack_from(header)[1]
+        self.file_count = len(self.paths)
+        self.chunk_size = CHUNK_SIZE
+        self.chunks = OrderedDict()  # Chunk number to Future of (data, payload sums or None), least recent first
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="prefetch") if workers else None
+        self.payload_size = None
+        self.codec = None
+
+    def payload_sums(self, payload_size, checksum_mode):
+        """Cut chunks at packet boundaries and sum the payloads of the packets of every chunk as it is loaded.
+
+        :param payload_size: Negotiated payload size.
+        :param checksum_mode: Checksum mode of the codec.
+        :return: ChunkSums indexed by sequence number.
+        """
+        self.drop()
+        self.payload_size = payload_size
+        self.chunk_size = payload_size * max(1, CHUNK_SIZE // payload_size)
+        self.codec = PacketCodec(0, checksum_mode)
+        return ChunkSums(self)
+
+    def read(self, offset, length):
+        """Return part of the stream, loading the chunks it lies in.
+
+        :param offset: Byte offset to read from.
+        :param length: Number of bytes to read, fewer are returned at the end of the stream.
+        :return: The bytes, a memoryview slice of the chunk unless they span two chunks.
+        """
+        end = min(offset + length, self.size)
+        first, start = divmod(offset, self.chunk_size)
+        data = self.chunk(first)[0]
+        if start + end - offset <= len(data):
+            return memoryview(data)[start:start + end - offset]
+        pieces = []
+        while offset < end:
+            number, start = divmod(offset, self.chunk_size)
+            piece = self.chunk(number)[0][start:start + end - offset]
+            pieces.append(piece)
+            offset += len(piece)
+        return b"".join(pieces)
+
+    def chunk(self, number):
+        """Return a chunk, and start loading the chunks after it.
+
+        :param number: Chunk number.
+        :return: Tuple (data, payload sums or None).
+        """
+        future = self.chunks.get(number)
+        if future is None:
+            future = self.submit(number)
+        else:
+            self.chunks.move_to_end(number)
+        last = min(number + PREFETCH_CHUNKS, (self.size - 1) // self.chunk_size)
+        for ahead in range(number + 1, last + 1):
+            if ahead not in self.chunks:
+                self.submit(ahead)
+        self.evict()
+        return future.result()
+
+    def submit(self, number):
+        """Start loading a chunk, in the pool if there is one.
+
+        :param number: Chunk number.
+        :return: Future of the chunk.
+        """
+        if self.pool is not None:
+            future = self.pool.submit(self.load, number)
+        else:
+            future = Future()
+            future.set_result(self.load(number))
+        self.chunks[number] = future
+        return future
+
+    def evict(self):
+        """Drop the least recently read chunks that are loaded, beyond PREFETCH_CHUNKS + KEPT_CHUNKS."""
+        excess = len(self.chunks) - PREFETCH_CHUNKS - KEPT_CHUNKS
+        for number in [number for number, future in self.chunks.items() if future.done()][:max(0, excess)]:
+            del self.chunks[number]
+
+    def load(self, number):
+        """Assemble a chunk from the record headers and the files, and sum its packets.
+
+        :param number: Chunk number.
+        :return: Tuple (data, array of the payload sums of its packets or None).
+        :raises OSError: If a file cannot be read or is shorter than when the batch was laid out.
+        """
+        offset = number * self.chunk_size
+        data = bytearray(min(self.chunk_size, self.size - offset))
+        view = memoryview(data)
+        position = 0
+        record = bisect.bisect_right(self.starts, offset) - 1
+        while position < len(data):
+            header = self.headers[record]
+            start = self.starts[record]
+            if offset + position < start + len(header):
+                piece = header[offset + position - start:][:len(data) - position]
+                view[position:position + len(piece)] = piece
+                position += len(piece)
+            length = min(start + len(header) + RECORD.unpack_from(header)[1] - offset - position,
+                         len(data) - position)
+            if length > 0:
+                with open(self.paths[record], 'rb') as f:
+                    f.seek(offset + position - start - len(header))
+                    if f.readinto(view[position:position + length]) != length:
+                        raise OSError(f"{self.paths[record]} shrank while its batch was sent")
+                position += length
+            record += 1
+        sums = None
+        if self.codec is not None:
+            sums = array('q', (self.codec.payload_sum(view[start:start + self.payload_size])
+                               for start in range(0, len(data), self.payload_size)))
+        return data, sums
+
+    def drop(self):
+        """Wait for the chunks being loaded and forget every chunk."""
+        for future in self.chunks.values():
+            future.result()
+        self.chunks.clear()
+
+    def close(self):
+        """Stop the prefetch threads and drop the chunks."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        self.chunks.clear()
+
+
+class BatchSink:
+    """Unpacks a batch stream into the files of a directory.
+
+    The records have to be read in order, so payloads that arrive ahead of a gap are held until it is filled,
+    at most a window of them. Every file is written as its content arrives, to a staging file that replaces it
+    once its content is complete, so a download reading the old file keeps it whole. Names are reduced by
+    safe_name, and a record whose name would leave the directory is skipped.
+    """
+    def __init__(self, directory, invalidate=None):
+        """Unpack into a directory.
+
+        :param directory: Directory the files are written to, subdirectories are created as needed.
+        :param invalidate: Function called with the path of every file once it is replaced, e.g.
+            Server.invalidate.
+        """
+        self.directory = directory
+        self.invalidate = invalidate
+        self.pending = {}
+        self.received = 0  # Bytes of the stream unpacked so far
+        self.header = bytearray()
+        self.file = None
+        self.name = None
+        self.remaining = 0  # Bytes of the current file's content still to come
+        self.files = []  # Names of the files written completely
+
+    def preallocate(self, size):
+        """Nothing to reserve, the sizes of the files are only known as their records arrive.
+
+        :param size: Size of the stream in bytes.
+        """
+
+    def write(self, offset, payload):
+        """Unpack a payload if it is the next one, along with the held payloads that follow it.
+
+        :param offset: Byte offset of the payload in the stream.
+        :param payload: Payload of a data packet.
+        """
+        if offset != self.received:
+            if offset > self.received:
+                self.pending[offset] = bytes(payload)
+            return
+        while payload is not None:
+            self.unpack(memoryview(payload))
+            self.received += len(payload)
+            payload = self.pending.pop(self.received, None)
+
+    def unpack(self, view):
+        """Split the next part of the stream into record headers, names and content.
+
+        :param view: memoryview of the part.
+        """
+        while view:
+            if self.remaining:
+                length = min(len(view), self.remaining)
+                if self.file is not None:
+                    self.file.write(self.file.size, view[:length])
+                self.remaining -= length
+                view = view[length:]
+                if not self.remaining:
+                    self.finish_file()
+                continue
+            if len(self.header) < RECORD.size:
+                length = RECORD.size - len(self.header)
+            else:
+                length = RECORD.size + RECORD.unpack_from(self.header)[0] - len(self.header)
+            self.header += view[:length]
+            view = view[length:]
+            if len(self.header) >= RECORD.size:
+                name_length, size = RECORD.unpack_from(self.header)
+                if len(self.header) == RECORD.size + name_length:
+                    self.start_file(bytes(self.header[RECORD.size:]), size)
+                    self.header.clear()
+
+    def start_file(self, name, size):
+        """Open the file of a record.
+
+        :param name: Name of the file, UTF-8 encoded.
+        :param size: Size of its content.
+        """
+        self.name = name.decode('utf-8', 'replace')
+        relative = safe_name(self.name)
+        if relative is None:
+            logger.warning("Skipping %r in batch, its name leaves the directory", self.name)
+        else:
+            path = os.path.join(self.directory, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = FileSink(path, replace=True)
+        self.remaining = size
+        if not size:
+            self.finish_file()
+
+    def finish_file(self):
+        """Replace the file of the current record once its content is complete."""
+        if self.file is not None:
+            self.file.commit()
+            if self.invalidate is not None:
+                self.invalidate(self.file.target)
+            self.file = None
+            self.files.append(self.name)
+            logger.debug("Unpacked %s from batch", self.name)
+
+    def close(self):
+        """Delete the staging file of an incomplete record, leaving the file it would have replaced."""
+        if self.file is not None:
+            self.file.discard()
+            self.file = None
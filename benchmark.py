@@ -0,0 +1,1742 @@
+import argparse
+import csv
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import selectors
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import tempfile
+import timeit
+import tracemalloc
+import simnet
+import analyze
+from sender import Sender
+from receiver import Receiver, ACK_EVERY, ACK_DELAY
+from intermediate import Intermediate
+from server import Server
+from client import Client
+from packet import (PacketCodec, enlarge_socket_buffers, BUFFER_SIZE, CHECKSUM_MODES, DEFAULT_PAYLOAD_SIZE,
+                    MAX_PAYLOAD_SIZE)
+from stream import FileSource, FileSink, BytesSource
+from fec import ParityDecoder, xor_payloads
+from checkpoint import block_hashes, block_size_for, CHECKPOINT_SUFFIX
+from cache import PacketCache
+from batch import PREFETCH_WORKERS
+from compress import CompressedSource, make_decompressor, COMPRESSION_MODES, COMPRESSION_NONE, CHUNK_SIZE
+from netmodel import NetworkProfile, DEFAULT_QUEUE_LIMIT
+from congestion import write_trace, CONGESTION_FIXED, CONGESTION_MODES
+from recorder import TraceRecorder, NODE_SENDER, NODE_RECEIVER, NODE_INTERMEDIATE, EVENT_SEND
+
+
+def free_port():
+    """Ask the OS for an unused UDP port on localhost.
+
+    :return: A port number that was free at the time of the call.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_transfer(data, window_size, use_intermediate=False, loss_prob=0.0, reorder_prob=0.0, corrupt_prob=0.0,
+                 payload_size=DEFAULT_PAYLOAD_SIZE, selective_repeat=False, congestion_control=CONGESTION_FIXED,
+                 trace_cwnd=False, sink=None, seed=None, profile=None, ack_every=ACK_EVERY, ack_delay=ACK_DELAY,
+                 fec_group=0, record_dir=None):
+    """Transfer data from a Sender to a Receiver on loopback and time it.
+
+    :param data: Bytes to transfer, or a source such as stream.FileSource.
+    :param window_size: Window size handed to the Sender.
+    :param use_intermediate: Route the transfer through an Intermediate node.
+    :param loss_prob: Loss probability of the Intermediate.
+    :param reorder_prob: Reorder probability of the Intermediate.
+    :param corrupt_prob: Corruption probability of the Intermediate.
+    :param payload_size: Payload size the Sender proposes.
+    :param selective_repeat: Use Selective Repeat instead of Go-Back-N.
+    :param congestion_control: Congestion control of the Sender, by default the window stays at window_size.
+    :param trace_cwnd: Record the Sender's congestion window trace.
+    :param sink: Sink of the Receiver. By default the data is kept in memory and compared with what was sent,
+        otherwise the caller verifies the sink.
+    :param seed: Seed of the Intermediate's impairments.
+    :param profile: netmodel.NetworkProfile of the Intermediate, replaces the three probabilities.
+    :param ack_every: In-order packets the Receiver acknowledges together.
+    :param ack_delay: Seconds the Receiver holds back the ACK of fewer packets.
+    :param fec_group: Data packets per parity packet, 0 without forward error correction.
+    :param record_dir: Directory every node records its packet trace to, as sender.trace, receiver.trace and
+        intermediate.trace, None to record nothing.
+    :return: Tuple (elapsed wall-clock seconds, Sender, Receiver), the endpoints are returned for their counters.
+        The Sender also gets a cpu_time attribute with the CPU seconds spent by the thread it ran on.
+    """
+    sender_port = free_port()
+    receiver_port = free_port()
+    target_port = receiver_port
+
+    record_paths = {}
+    if record_dir is not None:
+        record_paths = {node: os.path.join(record_dir, f"{node}.trace")
+                        for node in (NODE_SENDER, NODE_RECEIVER, NODE_INTERMEDIATE)}
+    receiver = Receiver(receiver_port, "127.0.0.1", sink=sink, ack_every=ack_every, ack_delay=ack_delay,
+                        record_path=record_paths.get(NODE_RECEIVER))
+    intermediate = None
+    if use_intermediate:
+        target_port = free_port()
+        if profile is None:
+            profile = NetworkProfile(loss_prob, reorder_prob, corrupt_prob)
+        intermediate = Intermediate(target_port, "127.0.0.1", receiver_port, profile, seed,
+                                    record_path=record_paths.get(NODE_INTERMEDIATE))
+        threading.Thread(target=intermediate.start, daemon=True).start()
+
+    receiver_thread = threading.Thread(target=receiver.start_receiving)
+    receiver_thread.start()
+
+    sender = Sender("127.0.0.1", target_port, sender_port, data, window_size=window_size, payload_size=payload_size,
+                    selective_repeat=selective_repeat, congestion_control=congestion_control, trace_cwnd=trace_cwnd,
+                    fec_group=fec_group, record_path=record_paths.get(NODE_SENDER))
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    sender.send_data()
+    sender.cpu_time = time.thread_time() - cpu_start
+    receiver_thread.join()
+    elapsed = time.perf_counter() - start
+    if intermediate is not None:
+        intermediate.stop()
+        if record_dir is not None:
+            time.sleep(1.5)  # start returns within a second and then closes the trace
+
+    if sink is None and receiver.reassemble_data() != data:
+        raise RuntimeError("Received data does not match the data that was sent")
+    return elapsed, sender, receiver
+
+
+def bench_window(size, windows, repeat, use_intermediate, loss_prob, reorder_prob, corrupt_prob):
+    """Compare goodput across window sizes. A window of 1 reproduces the old stop-and-wait behaviour.
+
+    :param size: Number of bytes to transfer.
+    :param windows: Window sizes to measure.
+    :param repeat: Number of runs per window size, the best run is reported.
+    :param use_intermediate: Route the transfers through an Intermediate node.
+    :return: List of (window_size, seconds, goodput in bytes per second).
+    """
+    data = os.urandom(size)
+    results = []
+    for window_size in windows:
+        best = min(run_transfer(data, window_size, use_intermediate, loss_prob, reorder_prob, corrupt_prob)[0]
+                   for _ in range(repeat))
+        results.append((window_size, best, size / best))
+    return results
+
+
+def bench_payload(size, payload_sizes, window_size, repeat, use_intermediate, loss_prob, reorder_prob, corrupt_prob):
+    """Compare goodput across negotiated payload sizes.
+
+    :param size: Number of bytes to transfer.
+    :param payload_sizes: Payload sizes to measure.
+    :param window_size: Window size handed to the Sender.
+    :param repeat: Number of runs per payload size, the best run is reported.
+    :param use_intermediate: Route the transfers through an Intermediate node.
+    :return: List of (payload_size, packets, seconds, goodput in bytes per second).
+    """
+    data = os.urandom(size)
+    results = []
+    for payload_size in payload_sizes:
+        best = min(run_transfer(data, window_size, use_intermediate, loss_prob, reorder_prob, corrupt_prob,
+                                payload_size)[0] for _ in range(repeat))
+        packets = (size + payload_size - 1) // payload_size
+        results.append((payload_size, packets, best, size / best))
+    return results
+
+
+def bench_sack(size, window_size, repeat, loss_prob, reorder_prob, corrupt_prob):
+    """Compare Go-Back-N and Selective Repeat through a lossy Intermediate node.
+
+    :param size: Number of bytes to transfer.
+    :param window_size: Window size handed to the Sender.
+    :param repeat: Number of runs per mode, the medians are reported since a lost EOT ACK makes single runs linger.
+    :return: List of (mode, seconds, retransmissions, duplicate packets at the receiver).
+    """
+    data = os.urandom(size)
+    results = []
+    for mode, selective_repeat in (("go-back-n", False), ("selective", True)):
+        runs = []
+        for _ in range(repeat):
+            elapsed, sender, receiver = run_transfer(data, window_size, True, loss_prob, reorder_prob, corrupt_prob,
+                                                     selective_repeat=selective_repeat)
+            runs.append((elapsed, sender.metrics.retransmissions, receiver.metrics.duplicates))
+        results.append((mode,) + tuple(statistics.median(column) for column in zip(*runs)))
+    return results
+
+
+def bench_acks(size, ack_counts, ack_delay, window_size, repeat, loss_prob, selective_repeat):
+    """Measure what coalescing ACKs saves on the reverse path and in the Sender.
+
+    :param size: Number of bytes to transfer.
+    :param ack_counts: Values of the Receiver's ack_every to compare, 1 acknowledges every packet.
+    :param ack_delay: Seconds the Receiver holds back the ACK of fewer than ack_every packets.
+    :param window_size: Window size handed to the Sender.
+    :param repeat: Number of runs per value, the medians are reported.
+    :param loss_prob: Loss probability of an Intermediate node, 0 transfers directly on loopback.
+    :param selective_repeat: Use Selective Repeat instead of Go-Back-N.
+    :return: List of (ack_every, seconds, ACKs sent, ACKs per data packet, Sender CPU seconds, retransmissions).
+    """
+    data = os.urandom(size)
+    results = []
+    for ack_every in ack_counts:
+        runs = []
+        for seed in range(repeat):
+            elapsed, sender, receiver = run_transfer(data, window_size, loss_prob > 0, loss_prob, seed=seed,
+                                                     selective_repeat=selective_repeat, ack_every=ack_every,
+                                                     ack_delay=ack_delay)
+            acks = receiver.metrics.acks_sent
+            runs.append((elapsed, acks, acks / sender.metrics.packets_sent, sender.cpu_time,
+                         sender.metrics.retransmissions))
+        results.append((ack_every,) + tuple(statistics.median(column) for column in zip(*runs)))
+    return results
+
+
+def bench_fec(size, groups, losses, window_size, repeat, selective_repeat):
+    """Weigh the retransmissions forward error correction saves against the parity it sends.
+
+    :param size: Number of bytes to transfer.
+    :param groups: Data packets per parity packet to compare, 0 without forward error correction.
+    :param losses: Loss probabilities of the Intermediate node, in both directions.
+    :param window_size: Window size handed to the Sender.
+    :param repeat: Number of runs per configuration with seeds 0, 1, ..., the medians are reported.
+    :param selective_repeat: Use Selective Repeat instead of Go-Back-N.
+    :return: List of (loss, group, seconds, retransmissions, timeouts, packets rebuilt, parity packets sent,
+        Sender CPU seconds).
+    """
+    data = os.urandom(size)
+    results = []
+    for loss_prob in losses:
+        for fec_group in groups:
+            runs = []
+            for seed in range(repeat):
+                elapsed, sender, receiver = run_transfer(data, window_size, True, loss_prob, seed=seed,
+                                                         selective_repeat=selective_repeat, fec_group=fec_group)
+                runs.append((elapsed, sender.metrics.retransmissions, sender.metrics.timeouts,
+                             receiver.metrics.recovered, sender.metrics.parity_packets, sender.cpu_time))
+            results.append((loss_prob, fec_group) + tuple(statistics.median(column) for column in zip(*runs)))
+    return results
+
+
+def bench_parity(payload_size, groups, number):
+    """Measure the per-packet cost of computing parity at the sender and of rebuilding a packet at the receiver.
+
+    :param payload_size: Payload size of the packets.
+    :param groups: Data packets per parity packet to measure.
+    :param number: Number of groups per measurement.
+    :return: List of (group, encode ns per data packet, decode ns per data packet).
+    """
+    results = []
+    for fec_group in groups:
+        payloads = [os.urandom(payload_size) for _ in range(fec_group)]
+        parity = xor_payloads(payloads).to_bytes(payload_size, 'little')
+        total_size = fec_group * payload_size
+
+        def decode():
+            decoder = ParityDecoder(fec_group, payload_size, total_size)
+            for seq_num in range(1, fec_group):
+                decoder.add(seq_num, payloads[seq_num])
+            return decoder.add_parity(0, parity)
+
+        if decode() != (0, payloads[0]):
+            raise RuntimeError("Parity did not rebuild the lost packet")
+        encode = timeit.timeit(lambda: xor_payloads(payloads), number=number)
+        results.append((fec_group, encode / number / fec_group * 1e9,
+                        timeit.timeit(decode, number=number) / number / fec_group * 1e9))
+    return results
+
+
+def simulate_file_transfer(source_path, sink_path, window_size, profile, seed, time_limit=simnet.TIME_LIMIT,
+                           dedup=False):
+    """Upload a file into a resuming Receiver over a SimNetwork, abandoning it after time_limit.
+
+    :param source_path: File to send.
+    :param sink_path: File the Receiver resumes into, with its checkpoint next to it.
+    :param window_size: Window size handed to the Sender.
+    :param profile: netmodel.NetworkProfile of the network.
+    :param seed: Seed of the impairments.
+    :param time_limit: Virtual seconds after which the transfer is interrupted.
+    :param dedup: Announce the block hashes of the file.
+    :return: Tuple (finished, virtual seconds, packets sent).
+    """
+    network = simnet.SimNetwork(simnet.RECEIVER_ADDRESS, profile, seed)
+    receiver = Receiver(simnet.RECEIVER_ADDRESS[1], simnet.RECEIVER_ADDRESS[0], sink=FileSink(sink_path, keep=True),
+                        sock=network.socket(simnet.RECEIVER_ADDRESS), clock=network.clock, resume=True)
+    sender = Sender(simnet.RECEIVER_ADDRESS[0], simnet.RECEIVER_ADDRESS[1], simnet.SENDER_ADDRESS[1],
+                    FileSource(source_path), window_size, sock=network.socket(simnet.SENDER_ADDRESS),
+                    clock=network.clock, dedup=dedup)
+    try:
+        network.run_transfer(sender, receiver, time_limit)
+    except TimeoutError:
+        sender.close()
+        receiver.close()
+        return False, network.clock.now, sender.metrics.packets_sent
+    return True, network.clock.now, sender.metrics.packets_sent
+
+
+def bench_resume(size, fractions, changed_counts, window_size, loss_prob, seed):
+    """Count the packets a resumed transfer and a block-deduplicated upload send, against a full transfer.
+
+    Each interrupted transfer is abandoned after a fraction of the virtual time a full transfer takes, its
+    Receiver saves the checkpoint, and a second transfer resumes from it. For deduplication, a copy of the
+    file the receiver already has is changed in a few blocks and uploaded again with block hashes.
+
+    :param size: Number of bytes to transfer.
+    :param fractions: Fractions of the full transfer time after which the first attempt is interrupted.
+    :param changed_counts: Numbers of blocks changed before a deduplicated upload.
+    :param window_size: Window size handed to the Sender.
+    :param loss_prob: Loss probability of the simulated network.
+    :param seed: Seed of the impairments and of the changed blocks.
+    :return: Tuple (full transfer seconds, full transfer packets, list of (fraction, packets of the first attempt,
+        packets of the resumed attempt, intact), list of (changed blocks, packets sent, intact), hashing seconds).
+    """
+    profile = NetworkProfile(loss_prob, delay=0.005)
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "source")
+        sink_path = os.path.join(directory, "sink")
+        write_random_file(source_path, size)
+
+        def reset():
+            for path in (sink_path, sink_path + CHECKPOINT_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        reset()
+        _, full_time, full_packets = simulate_file_transfer(source_path, sink_path, window_size, profile, seed)
+        resumed = []
+        for fraction in fractions:
+            reset()
+            _, _, first = simulate_file_transfer(source_path, sink_path, window_size, profile, seed,
+                                                 full_time * fraction)
+            _, _, second = simulate_file_transfer(source_path, sink_path, window_size, profile, seed + 1)
+            resumed.append((fraction, first, second, same_file(source_path, sink_path)))
+
+        block_size = block_size_for(size)
+        deduplicated = []
+        for changed in changed_counts:
+            with open(source_path, "r+b") as f:
+                for block in rng.sample(range((size + block_size - 1) // block_size), changed):
+                    f.seek(block * block_size)
+                    f.write(os.urandom(1))
+            _, _, packets = simulate_file_transfer(source_path, sink_path, window_size, profile, seed, dedup=True)
+            deduplicated.append((changed, packets, same_file(source_path, sink_path)))
+        source = FileSource(source_path)
+        hashing = timeit.timeit(lambda: block_hashes(source), number=1)
+        source.close()
+    return full_time, full_packets, resumed, deduplicated, hashing
+
+
+def bench_cache(size, file_count, downloads, cache_size, payload_size):
+    """Time simulated downloads sent from a cache.PacketCache against downloads sent straight from the files.
+
+    Every round downloads each file once, in virtual time, so the wall-clock time of a download is the CPU time
+    of its Sender and Receiver.
+
+    :param size: Size of every file in bytes.
+    :param file_count: Number of files, downloaded in turn.
+    :param downloads: Number of rounds.
+    :param cache_size: Byte limit of the cache, below file_count * size the files evict each other.
+    :param payload_size: Payload size of the Sender.
+    :return: Tuple (list of (round, median seconds per download without the cache, with the cache)), cache
+        counters as returned by PacketCache.stats).
+    """
+    cache = PacketCache(cache_size)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"file{i}") for i in range(file_count)]
+        for path in paths:
+            write_random_file(path, size)
+
+        def download(source):
+            network = simnet.SimNetwork()
+            receiver = Receiver(simnet.RECEIVER_ADDRESS[1], simnet.RECEIVER_ADDRESS[0],
+                                sock=network.socket(simnet.RECEIVER_ADDRESS), clock=network.clock)
+            sender = Sender(simnet.RECEIVER_ADDRESS[0], simnet.RECEIVER_ADDRESS[1], simnet.SENDER_ADDRESS[1], source,
+                            64, payload_size=payload_size, sock=network.socket(simnet.SENDER_ADDRESS),
+                            clock=network.clock)
+            start = time.perf_counter()
+            network.run_transfer(sender, receiver)
+            return time.perf_counter() - start
+
+        rounds = []
+        for round_number in range(downloads):
+            uncached = statistics.median(download(FileSource(path)) for path in paths)
+            cached = statistics.median(download(cache.open(path)) for path in paths)
+            rounds.append((round_number + 1, uncached, cached))
+        stats = cache.stats()
+        cache.clear()
+    return rounds, stats
+
+
+COMPRESSION_DATA = ("text", "log", "random")
+
+
+def compression_data(kind, size):
+    """Generate data to compress.
+
+    :param kind: "text" repeats this project's readme, "log" is log lines with timestamps and counters, and
+        "random" does not compress at all.
+    :param size: Number of bytes.
+    :return: The data.
+    """
+    if kind == "text":
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "readme.md"), "rb") as f:
+            text = f.read()
+        return (text * (size // len(text) + 1))[:size]
+    if kind == "log":
+        rng = random.Random(0)
+        lines = []
+        length = 0
+        while length < size:
+            line = (f"2024-05-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d},"
+                    f"{rng.randint(0, 999):03d} INFO sender: Sent packet {len(lines)} to 127.0.0.1:"
+                    f"{rng.choice((12000, 12500))}, rto {rng.random():.3f} s\n").encode()
+            lines.append(line)
+            length += len(line)
+        return b"".join(lines)[:size]
+    return os.urandom(size)
+
+
+def bench_compression(size, kinds, modes, window_size, rate, loss_prob):
+    """Weigh the CPU cost of compression against the packets it saves, over a simulated link.
+
+    The transfer runs in virtual time over a link of the given rate, and the compression and decompression
+    are timed separately on the CPU. Compression pays off on links slower than the break-even rate, at which
+    sending the bytes it saves takes as long as compressing and decompressing.
+
+    :param size: Number of bytes to transfer.
+    :param kinds: Kinds of data from COMPRESSION_DATA.
+    :param modes: Compressions from compress.COMPRESSION_MODES.
+    :param window_size: Window size handed to the Sender.
+    :param rate: Link rate in bytes per second.
+    :param loss_prob: Loss probability of the link.
+    :return: List of (kind, mode, compressed size, packets sent, compress seconds, decompress seconds, simulated
+        transfer seconds, break-even rate in bytes per second or None, intact).
+    """
+    profile = NetworkProfile(loss_prob, delay=0.005, rate=rate, queue_limit=max(DEFAULT_QUEUE_LIMIT, window_size))
+    results = []
+    for kind in kinds:
+        data = compression_data(kind, size)
+        for mode in modes:
+            compressed_size = size
+            compress_time = decompress_time = 0.0
+            if mode != COMPRESSION_NONE:
+                start = time.process_time()
+                source = CompressedSource(BytesSource(data), mode)
+                compress_time = time.process_time() - start
+                compressed_size = source.size
+                compressed = bytes(source.read(0, source.size))
+                source.close()
+                decompressor = make_decompressor(mode)
+                start = time.process_time()
+                for offset in range(0, len(compressed), CHUNK_SIZE):
+                    decompressor.decompress(compressed[offset:offset + CHUNK_SIZE])
+                decompress_time = time.process_time() - start
+            network = simnet.SimNetwork(simnet.RECEIVER_ADDRESS, profile, 0)
+            receiver = Receiver(simnet.RECEIVER_ADDRESS[1], simnet.RECEIVER_ADDRESS[0],
+                                sock=network.socket(simnet.RECEIVER_ADDRESS), clock=network.clock)
+            sender = Sender(simnet.RECEIVER_ADDRESS[0], simnet.RECEIVER_ADDRESS[1], simnet.SENDER_ADDRESS[1], data,
+                            window_size, sock=network.socket(simnet.SENDER_ADDRESS), clock=network.clock,
+                            compression=mode)
+            network.run_transfer(sender, receiver)
+            saved = size - compressed_size
+            cpu = compress_time + decompress_time
+            break_even = saved / cpu if cpu and saved > 0 else None
+            results.append((kind, mode, compressed_size, sender.metrics.packets_sent, compress_time, decompress_time,
+                            sender.metrics.elapsed(), break_even, receiver.reassemble_data() == data))
+    return results
+
+
+def bench_congestion(size, modes, max_window, repeat, profile, selective_repeat, trace_dir=None):
+    """Compare congestion controllers through an Intermediate node.
+
+    :param size: Number of bytes to transfer.
+    :param modes: Congestion controllers to compare, from CONGESTION_MODES.
+    :param max_window: Window of the fixed controller and cap of the others.
+    :param repeat: Number of runs per controller, the medians are reported.
+    :param profile: netmodel.NetworkProfile of the Intermediate, e.g. a bottleneck with a finite queue.
+    :param selective_repeat: Use Selective Repeat instead of Go-Back-N.
+    :param trace_dir: Directory to write one congestion window trace CSV per run to, or None.
+    :return: List of (mode, seconds, goodput in bytes per second, retransmissions, largest window).
+    """
+    data = os.urandom(size)
+    results = []
+    for mode in modes:
+        runs = []
+        for run in range(repeat):
+            elapsed, sender, _ = run_transfer(data, max_window, True, selective_repeat=selective_repeat,
+                                              congestion_control=mode, trace_cwnd=True, profile=profile)
+            trace = sender.congestion.trace
+            if trace_dir is not None:
+                write_trace(trace, os.path.join(trace_dir, f"cwnd_{mode}_{run}.csv"))
+            runs.append((elapsed, size / elapsed, sender.metrics.retransmissions, max(cwnd for _, cwnd, _, _ in trace)))
+        results.append((mode,) + tuple(statistics.median(column) for column in zip(*runs)))
+    return results
+
+
+def bench_logging(size, window_size, repeat):
+    """Measure what per-packet logging costs when it is disabled and when every packet is logged.
+
+    DEBUG records are formatted and written to os.devnull, so the cost measured is that of the logging
+    calls rather than of a terminal.
+
+    :param size: Number of bytes to transfer.
+    :param window_size: Window size handed to the Sender.
+    :param repeat: Number of runs per level, the best run is reported.
+    :return: List of (level, seconds, goodput in bytes per second).
+    """
+    data = os.urandom(size)
+    root = logging.getLogger()
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    root.addHandler(handler)
+    results = []
+    try:
+        for level in ("WARNING", "DEBUG"):
+            root.setLevel(level)
+            best = min(run_transfer(data, window_size)[0] for _ in range(repeat))
+            results.append((level, best, size / best))
+    finally:
+        root.setLevel(logging.WARNING)
+        root.removeHandler(handler)
+        handler.stream.close()
+    return results
+
+
+def bench_record(size, window_size, repeat, loss_prob, seed):
+    """Measure what recording packet traces costs, with every node of a transfer through an Intermediate
+    recording, and how long the traces take to read back.
+
+    :param size: Number of bytes to transfer.
+    :param window_size: Window size handed to the Sender.
+    :param repeat: Number of runs with and without recording, the best run is reported.
+    :param loss_prob: Loss probability of the Intermediate.
+    :param seed: Seed of the Intermediate's impairments.
+    :return: Tuple (seconds without recording, seconds recording, dict of node to records, seconds per record
+        written, seconds to read the traces back and analyse them).
+    """
+    data = os.urandom(size)
+    plain = min(run_transfer(data, window_size, True, loss_prob, seed=seed)[0] for _ in range(repeat))
+    recording = None
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(repeat):
+            elapsed = run_transfer(data, window_size, True, loss_prob, seed=seed, record_dir=directory)[0]
+            recording = elapsed if recording is None else min(recording, elapsed)
+        paths = [os.path.join(directory, f"{node}.trace") for node in (NODE_SENDER, NODE_RECEIVER, NODE_INTERMEDIATE)]
+        start = time.perf_counter()
+        nodes = analyze.load_traces(paths)
+        analyze.find_stalls(analyze.progress(nodes[NODE_SENDER][1]), analyze.MIN_STALL)
+        analyze.window_usage(analyze.window_series(nodes[NODE_SENDER][1]))
+        read_back = time.perf_counter() - start
+        recorder = TraceRecorder(os.path.join(directory, "bench.trace"), NODE_SENDER)
+        count = 200_000
+        per_record = timeit.timeit(lambda: recorder.record(EVENT_SEND, 0, 1, 1400, 10, 64), number=count) / count
+        recorder.close()
+    records = {node: len(node_records) for node, (_, node_records) in nodes.items()}
+    return plain, recording, records, per_record, read_back
+
+
+def run_intermediate(listen_port, receiver_port, seed):
+    """Run an unimpaired Intermediate until it is idle for a second, the target of the relay benchmark's process.
+
+    :param listen_port: Port the Intermediate listens on.
+    :param receiver_port: Port of the receiver.
+    :param seed: Seed of the impairments.
+    """
+    Intermediate(listen_port, "127.0.0.1", receiver_port, seed=seed, idle_timeout=1).start()
+
+
+def bench_relay(flow_counts, packets, window_size, payload_size, seed):
+    """Measure how many packets per second the Intermediate relays across concurrent flows.
+
+    The Intermediate runs in its own process. Every flow keeps window_size packets in flight through it to
+    an echo socket, which sends each packet back as its ACK, and sends its next packet whenever one comes
+    back. Packets relayed in both directions are counted.
+
+    :param flow_counts: Numbers of concurrent flows to measure.
+    :param packets: Number of packets each flow sends.
+    :param window_size: Packets each flow keeps in flight.
+    :param payload_size: Size of each packet.
+    :param seed: Seed of the Intermediate's impairments.
+    :return: List of (flows, seconds, packets relayed per second).
+    """
+    payload = os.urandom(payload_size)
+    results = []
+    for flows in flow_counts:
+        echo = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        echo.bind(("127.0.0.1", 0))
+        echo.setblocking(False)
+        enlarge_socket_buffers(echo)
+        listen_port = free_port()
+        relay = multiprocessing.Process(target=run_intermediate,
+                                        args=(listen_port, echo.getsockname()[1], seed))
+        relay.start()
+        time.sleep(0.5)
+
+        selector = selectors.DefaultSelector()
+        selector.register(echo, selectors.EVENT_READ)
+        sockets = []
+        remaining = {}
+        for _ in range(flows):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            enlarge_socket_buffers(sock)
+            sock.connect(("127.0.0.1", listen_port))
+            selector.register(sock, selectors.EVENT_READ)
+            sockets.append(sock)
+            remaining[sock] = packets
+        relayed = 0
+        start = time.perf_counter()
+        for sock in sockets:
+            for _ in range(min(window_size, packets)):
+                sock.send(payload)
+                remaining[sock] -= 1
+        end = start
+        while True:
+            events = selector.select(0.2)
+            if not events:
+                break
+            end = time.perf_counter()
+            for key, _ in events:
+                sock = key.fileobj
+                for _ in range(256):
+                    try:
+                        if sock is echo:
+                            packet, address = echo.recvfrom(BUFFER_SIZE)
+                            echo.sendto(packet, address)
+                        else:
+                            sock.recv(BUFFER_SIZE)
+                            if remaining[sock]:
+                                sock.send(payload)
+                                remaining[sock] -= 1
+                    except BlockingIOError:
+                        break
+                    relayed += 1
+        elapsed = end - start
+        if any(remaining.values()):
+            raise RuntimeError("Packets went missing in the relay")
+        for sock in sockets:
+            sock.close()
+        selector.close()
+        echo.close()
+        relay.join()
+        results.append((flows, elapsed, relayed / elapsed))
+    return results
+
+
+def run_server(server_port, directory, workers, max_payload_size=MAX_PAYLOAD_SIZE):
+    """Run a Server, the target of the load test's server process. Logging is not configured, so only
+    warnings reach stderr.
+
+    :param server_port: Port of the Server.
+    :param directory: Directory the Server stores and serves files in.
+    :param workers: Number of SO_REUSEPORT worker processes.
+    :param max_payload_size: Largest payload size the Server accepts.
+    """
+    Server(server_port, "127.0.0.1", max_payload_size, directory=directory, workers=workers).run()
+
+
+def run_client(server_port, filename, query, directory):
+    """Run one Client, the target of the load test's client processes.
+
+    :param server_port: Port of the Server.
+    :param filename: File to upload, or to download when query is set.
+    :param query: Download instead of upload.
+    :param directory: Directory downloads are written to.
+    """
+    Client(free_port(), server_port, "127.0.0.1", query, filename, directory=directory).run()
+
+
+def bench_load(size, client_counts, workers, query):
+    """Measure aggregate throughput of one Server as the number of concurrent clients grows.
+
+    The Server and every client run in their own process so they do not share an interpreter lock.
+
+    :param size: Number of bytes each client transfers.
+    :param client_counts: Numbers of concurrent clients to measure.
+    :param workers: Number of SO_REUSEPORT worker processes of the Server.
+    :param query: Clients download the file instead of uploading it.
+    :return: List of (clients, seconds, aggregate goodput in bytes per second).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        server_directory = os.path.join(directory, "server")
+        os.mkdir(server_directory)
+        data = os.urandom(size)
+        server_port = free_port()
+        server = multiprocessing.Process(target=run_server, args=(server_port, server_directory, workers))
+        server.start()
+        time.sleep(0.5)
+        try:
+            for clients in client_counts:
+                names = [f"client_{clients}_{i}.bin" for i in range(clients)]
+                local_directory = os.path.join(directory, f"clients_{clients}")
+                os.mkdir(local_directory)
+                for name in names:
+                    with open(os.path.join(server_directory if query else local_directory, name), "wb") as f:
+                        f.write(data)
+
+                processes = [multiprocessing.Process(target=run_client,
+                                                     args=(server_port, name if query else
+                                                           os.path.join(local_directory, name), query, local_directory))
+                             for name in names]
+                start = time.perf_counter()
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+                elapsed = time.perf_counter() - start
+
+                for name in names:
+                    with open(os.path.join(local_directory if query else server_directory, name), "rb") as f:
+                        if f.read() != data:
+                            raise RuntimeError(f"Transferred file {name} does not match the file that was sent")
+                results.append((clients, elapsed, clients * size / elapsed))
+        finally:
+            server.terminate()
+            server.join()
+    return results
+
+
+def bench_small_files(sizes, count, query, loss_prob=0.0, seed=None):
+    """Measure the latency of transferring small files one after the other between a Client and a Server.
+
+    The Server runs in its own process and each Client in this one, so the time of a transfer is the time
+    Client.run takes from the first setup packet to the end of the session. With a loss probability the
+    clients reach the Server through an Intermediate.
+
+    :param sizes: File sizes in bytes.
+    :param count: Files transferred per size.
+    :param query: Download the files instead of uploading them.
+    :param loss_prob: Loss probability of the Intermediate, 0 for a direct path.
+    :param seed: Seed of the Intermediate's impairments.
+    :return: List of (size, median seconds, slowest seconds) per size.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        server_directory = os.path.join(directory, "server")
+        client_directory = os.path.join(directory, "client")
+        os.mkdir(server_directory)
+        os.mkdir(client_directory)
+        server_port = free_port()
+        target_port = server_port
+        server = multiprocessing.Process(target=run_server, args=(server_port, server_directory, 1))
+        server.start()
+        intermediate = None
+        if loss_prob:
+            target_port = free_port()
+            intermediate = Intermediate(target_port, "127.0.0.1", server_port, NetworkProfile(loss_prob), seed)
+            threading.Thread(target=intermediate.start, daemon=True).start()
+        time.sleep(0.5)
+        try:
+            for size in sizes:
+                data = os.urandom(size)
+                names = [f"small_{size}_{i}.bin" for i in range(count)]
+                for name in names:
+                    with open(os.path.join(server_directory if query else client_directory, name), "wb") as f:
+                        f.write(data)
+                latencies = []
+                for name in names:
+                    filename = name if query else os.path.join(client_directory, name)
+                    start = time.perf_counter()
+                    Client(free_port(), target_port, "127.0.0.1", query, filename, directory=client_directory).run()
+                    latencies.append(time.perf_counter() - start)
+                time.sleep(0.1)
+                for name in names:
+                    with open(os.path.join(client_directory if query else server_directory, name), "rb") as f:
+                        if f.read() != data:
+                            raise RuntimeError(f"Transferred file {name} does not match the file that was sent")
+                results.append((size, statistics.median(latencies), max(latencies)))
+        finally:
+            if intermediate is not None:
+                intermediate.stop()
+            server.terminate()
+            server.join()
+    return results
+
+
+def bench_batch(count, size, query, prefetch_counts, payload_size, loss_prob=0.0, delay=0.0, seed=None):
+    """Compare transferring many small files one session at a time with transferring them as one batch.
+
+    The Server runs in its own process and the Client in this one. Every mode transfers the same files into a
+    fresh directory, and the time is the time Client.run takes for all of them.
+
+    :param count: Number of files.
+    :param size: Size of every file in bytes.
+    :param query: Download the files instead of uploading them.
+    :param prefetch_counts: Prefetch threads of the batch uploads to compare, downloads use the Server's.
+    :param payload_size: Payload size the Client proposes or accepts.
+    :param loss_prob: Loss probability of an Intermediate in the path.
+    :param delay: One-way delay of the Intermediate in seconds, the path is direct if it and loss_prob are 0.
+    :param seed: Seed of the Intermediate's impairments.
+    :return: List of (description, seconds, files per second).
+    """
+    modes = [("one session per file", None)]
+    modes += [("batch", PREFETCH_WORKERS)] if query else [(f"batch, {prefetch} prefetch threads", prefetch)
+                                                           for prefetch in prefetch_counts]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        source_directory = os.path.join(directory, "source")
+        os.mkdir(source_directory)
+        names = [f"file_{i:05}.bin" for i in range(count)]
+        for name in names:
+            with open(os.path.join(source_directory, name), "wb") as f:
+                f.write(os.urandom(size))
+        for number, (description, prefetch) in enumerate(modes):
+            server_directory = source_directory if query else os.path.join(directory, f"server_{number}")
+            client_directory = os.path.join(directory, f"client_{number}")
+            for path in {server_directory, client_directory}:
+                os.makedirs(path, exist_ok=True)
+            server_port = free_port()
+            target_port = server_port
+            server = multiprocessing.Process(target=run_server, args=(server_port, server_directory, 1, payload_size))
+            server.start()
+            intermediate = None
+            if loss_prob or delay:
+                target_port = free_port()
+                profile = NetworkProfile(loss_prob, delay=delay)
+                intermediate = Intermediate(target_port, "127.0.0.1", server_port, profile, seed)
+                threading.Thread(target=intermediate.start, daemon=True).start()
+            time.sleep(0.5)
+            try:
+                start = time.perf_counter()
+                if prefetch is None:
+                    for name in names:
+                        filename = name if query else os.path.join(source_directory, name)
+                        Client(free_port(), target_port, "127.0.0.1", query, filename, payload_size,
+                               directory=client_directory).run()
+                else:
+                    patterns = ["file_*.bin"] if query else [os.path.join(source_directory, "file_*.bin")]
+                    Client(free_port(), target_port, "127.0.0.1", query, None, payload_size,
+                           directory=client_directory, batch=patterns, prefetch=prefetch).run()
+                elapsed = time.perf_counter() - start
+                time.sleep(0.1)
+            finally:
+                if intermediate is not None:
+                    intermediate.stop()
+                server.terminate()
+                server.join()
+            received = client_directory if query else server_directory
+            for name in names:
+                with open(os.path.join(source_directory, name), "rb") as sent, \
+                        open(os.path.join(received, name), "rb") as arrived:
+                    if sent.read() != arrived.read():
+                        raise RuntimeError(f"Transferred file {name} does not match the file that was sent")
+            results.append((description, elapsed, count / elapsed))
+    return results
+
+
+def bench_streams(size, stream_counts, payload_size, workers):
+    """Measure the throughput of one upload split into parallel streams.
+
+    A fresh Server is started for every stream count, by default with one worker process per stream so
+    both ends can checksum on several cores.
+
+    :param size: Number of bytes to upload.
+    :param stream_counts: Numbers of streams to measure.
+    :param payload_size: Payload size the Client proposes.
+    :param workers: Server worker processes, None for one per stream.
+    :return: List of (streams, seconds, goodput in bytes per second).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "upload.bin")
+        data = os.urandom(size)
+        with open(source_path, "wb") as f:
+            f.write(data)
+        for streams in stream_counts:
+            server_directory = os.path.join(directory, f"server_{streams}")
+            os.mkdir(server_directory)
+            server_port = free_port()
+            server = multiprocessing.Process(target=run_server,
+                                             args=(server_port, server_directory, workers or streams))
+            server.start()
+            time.sleep(0.5)
+            try:
+                client = Client(free_port(), server_port, "127.0.0.1", False, source_path, payload_size,
+                                streams=streams)
+                start = time.perf_counter()
+                client.run()
+                elapsed = time.perf_counter() - start
+            finally:
+                server.terminate()
+                server.join()
+            with open(os.path.join(server_directory, "upload.bin"), "rb") as f:
+                if f.read() != data:
+                    raise RuntimeError("Uploaded file does not match the file that was sent")
+            results.append((streams, elapsed, size / elapsed))
+    return results
+
+
+def legacy_reassemble(chunks):
+    """Reassembly as done by the Receiver before sinks, kept for comparison. Quadratic in the data size.
+
+    :param chunks: Payloads by sequence number.
+    :return: The joined data.
+    """
+    complete_data = b''
+    for i in range(0, len(chunks)):
+        complete_data += chunks[i]
+    return complete_data
+
+
+def bench_stream(size, window_size, payload_size):
+    """Compare an in-memory transfer with a streaming file-to-file transfer, and the old reassembly with
+    joining.
+
+    :param size: Number of bytes to transfer.
+    :param window_size: Window size handed to the Sender.
+    :param payload_size: Payload size the Sender proposes.
+    :return: List of (description, seconds, peak traced Python memory in bytes).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "source.bin")
+        sink_path = os.path.join(directory, "sink.bin")
+        with open(source_path, "wb") as f:
+            for _ in range(0, size, 1 << 20):
+                f.write(os.urandom(min(1 << 20, size)))
+            f.truncate(size)
+
+        tracemalloc.start()
+        with open(source_path, "rb") as f:
+            data = f.read()
+        elapsed = run_transfer(data, window_size, payload_size=payload_size)[0]
+        results.append(("read + memory sink", elapsed, tracemalloc.get_traced_memory()[1]))
+        del data
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        elapsed = run_transfer(FileSource(source_path), window_size, payload_size=payload_size,
+                               sink=FileSink(sink_path))[0]
+        results.append(("mmap + pwrite sink", elapsed, tracemalloc.get_traced_memory()[1]))
+        tracemalloc.stop()
+        with open(source_path, "rb") as sent, open(sink_path, "rb") as received:
+            while True:
+                expected = sent.read(1 << 20)
+                if expected != received.read(1 << 20):
+                    raise RuntimeError("Received file does not match the file that was sent")
+                if not expected:
+                    break
+
+    chunks = {i: os.urandom(payload_size) for i in range(min(size // payload_size, 5_000))}
+    for description, reassemble in (("legacy += reassembly", legacy_reassemble),
+                                    ("join reassembly", lambda c: b"".join(c[i] for i in sorted(c)))):
+        start = time.perf_counter()
+        reassemble(chunks)
+        results.append((f"{description} of {len(chunks)} packets", time.perf_counter() - start, None))
+    return results
+
+
+def anonymous_memory():
+    """Resident anonymous memory of this process, which leaves out the file pages a FileSource maps.
+
+    :return: Bytes, or None where /proc/self/status is not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def bench_large(size, window_size, payload_size, selective_repeat, interval):
+    """Stream a file of several GB from a FileSource through a Sender and a Receiver on loopback into a
+    FileSink, sampling memory along the way.
+
+    A thread samples the anonymous resident memory of the process and the Python memory traced by
+    tracemalloc every interval seconds. Neither end holds the data and the state of a transfer is bounded
+    by its window, so both should stay flat however far the transfer has got.
+
+    :param size: Number of bytes to transfer.
+    :param window_size: Window size handed to the Sender.
+    :param payload_size: Payload size the Sender proposes.
+    :param selective_repeat: Use Selective Repeat instead of Go-Back-N.
+    :param interval: Seconds between samples.
+    :return: Tuple (elapsed seconds, Sender, samples), every sample is a tuple (seconds, bytes received,
+        anonymous resident bytes or None, traced Python bytes).
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "source.bin")
+        sink_path = os.path.join(directory, "sink.bin")
+        with open(source_path, "wb") as f:
+            for offset in range(0, size, 1 << 20):
+                f.write(os.urandom(min(1 << 20, size - offset)))
+
+        sink = FileSink(sink_path)
+        samples = []
+        done = threading.Event()
+        start = time.perf_counter()
+
+        def sample():
+            while True:
+                samples.append((time.perf_counter() - start, sink.size, anonymous_memory(),
+                                tracemalloc.get_traced_memory()[0]))
+                if done.wait(interval):
+                    return
+
+        tracemalloc.start()
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            elapsed, sender, _ = run_transfer(FileSource(source_path), window_size, payload_size=payload_size,
+                                              selective_repeat=selective_repeat, sink=sink)
+        finally:
+            done.set()
+            sampler.join()
+            tracemalloc.stop()
+        samples.append((time.perf_counter() - start, size, anonymous_memory(), samples[-1][3]))
+        with open(source_path, "rb") as sent, open(sink_path, "rb") as received:
+            while True:
+                expected = sent.read(1 << 20)
+                if expected != received.read(1 << 20):
+                    raise RuntimeError("Received file does not match the file that was sent")
+                if not expected:
+                    break
+    return elapsed, sender, samples
+
+
+def legacy_checksum(data):
+    """The per-byte-pair checksum the Sender and Receiver used before the shared codec, kept for comparison.
+
+    :param data: data to compute the checksum
+    :return checksum:
+    """
+    if len(data) % 2:
+        data += b'\x00'
+    checksum = sum((data[i] << 8) + data[i + 1] for i in range(0, len(data), 2))
+    checksum = (checksum >> 16) + (checksum & 0xFFFF)
+    checksum = ~checksum & 0xFFFF
+    return checksum
+
+
+def legacy_encode(seq_num, payload):
+    """Packet construction as done before the shared codec.
+
+    :param seq_num: Sequence number of the packet.
+    :param payload: Payload of the packet.
+    :return: The encoded packet.
+    """
+    return struct.pack('!I', seq_num) + struct.pack('!H', legacy_checksum(payload)) + payload
+
+
+def legacy_decode(packet):
+    """Packet verification as done by the Receiver before the shared codec.
+
+    :param packet: Raw datagram.
+    :return: Tuple (seq_num, payload, valid).
+    """
+    seq_num, checksum = struct.unpack('!IH', packet[:6])
+    valid = legacy_checksum(packet[6:]) == checksum
+    checksum = legacy_checksum(packet[6:])
+    return seq_num, packet[6:], valid
+
+
+def bench_codec(payload_sizes, number):
+    """Measure the per-packet cost of encoding and decoding.
+
+    :param payload_sizes: Payload sizes to measure.
+    :param number: Number of packets per measurement.
+    :return: List of (implementation, payload_size, encode ns per packet, decode ns per packet).
+    """
+    results = []
+    for payload_size in payload_sizes:
+        payload = os.urandom(payload_size)
+        packet = legacy_encode(7, payload)
+        encode = timeit.timeit(lambda: legacy_encode(7, payload), number=number)
+        decode = timeit.timeit(lambda: legacy_decode(packet), number=number)
+        results.append(("legacy", payload_size, encode / number * 1e9, decode / number * 1e9))
+
+        for mode in CHECKSUM_MODES:
+            codec = PacketCodec(payload_size, mode)
+            packet = bytes(codec.encode(7, payload))
+            encode = timeit.timeit(lambda: codec.encode(7, payload), number=number)
+            decode = timeit.timeit(lambda: codec.decode(packet), number=number)
+            results.append((mode, payload_size, encode / number * 1e9, decode / number * 1e9))
+            payload_sum = codec.payload_sum(payload)
+            encode = timeit.timeit(lambda: codec.encode(7, payload, payload_sum), number=number)
+            results.append((mode + "+sum", payload_size, encode / number * 1e9, decode / number * 1e9))
+    return results
+
+
+MATRIX_FIELDS = ("size", "payload_size", "window_size", "loss", "reorder", "corrupt")
+RESULT_FIELDS = ("elapsed", "goodput", "retransmission_ratio", "retransmissions", "packets_sent", "peak_memory")
+
+
+def same_file(path, other_path):
+    """Compare two files in 1 MiB chunks.
+
+    :param path: First file.
+    :param other_path: Second file.
+    :return: True if both hold the same bytes.
+    """
+    with open(path, "rb") as f, open(other_path, "rb") as other:
+        while True:
+            chunk = f.read(1 << 20)
+            if chunk != other.read(1 << 20):
+                return False
+            if not chunk:
+                return True
+
+
+def write_random_file(path, size):
+    """Fill a file with random bytes, 1 MiB at a time.
+
+    :param path: File to write.
+    :param size: Number of bytes.
+    """
+    with open(path, "wb") as f:
+        for offset in range(0, size, 1 << 20):
+            f.write(os.urandom(min(1 << 20, size - offset)))
+
+
+def run_matrix_in_process(config, source_path, sink_path, seed, congestion_control, selective_repeat):
+    """Stream a file through Sender, Intermediate and Receiver threads in this process.
+
+    :param config: Dict with the MATRIX_FIELDS of the run.
+    :param source_path: File to send.
+    :param sink_path: File the Receiver writes.
+    :param seed: Seed of the Intermediate.
+    :param congestion_control: Congestion control of the Sender.
+    :param selective_repeat: Use Selective Repeat.
+    :return: Tuple (Sender metrics dict, peak memory in bytes as traced by tracemalloc).
+    """
+    impaired = config["loss"] or config["reorder"] or config["corrupt"]
+    tracemalloc.start()
+    try:
+        _, sender, _ = run_transfer(FileSource(source_path), config["window_size"], impaired, config["loss"],
+                                    config["reorder"], config["corrupt"], config["payload_size"], selective_repeat,
+                                    congestion_control, sink=FileSink(sink_path), seed=seed)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return sender.metrics.to_dict(), peak
+
+
+def run_matrix_subprocess(config, source_path, sink_path, seed, congestion_control, selective_repeat, directory):
+    """Run receiver.py, intermediate.py and sender.py as separate processes and read back their metrics.
+
+    :param config: Dict with the MATRIX_FIELDS of the run.
+    :param source_path: File to send.
+    :param sink_path: File the receiver writes.
+    :param seed: Seed of the Intermediate.
+    :param congestion_control: Congestion control of the Sender.
+    :param selective_repeat: Use Selective Repeat.
+    :param directory: Directory for the metrics files.
+    :return: Tuple (Sender metrics dict, largest peak resident set size of the Sender and Receiver in bytes).
+    """
+    python = [sys.executable, "-u"]
+    quiet = ["--log-level", "WARNING"]
+    here = os.path.dirname(os.path.abspath(__file__))
+    metrics_path = os.path.join(directory, "sender.json")
+    receiver_port = target_port = free_port()
+    receiver = subprocess.Popen(python + [os.path.join(here, "receiver.py"), "--listen-port", str(receiver_port),
+                                          "--output", sink_path] + quiet)
+    intermediate = None
+    if config["loss"] or config["reorder"] or config["corrupt"]:
+        target_port = free_port()
+        intermediate = subprocess.Popen(python + [os.path.join(here, "intermediate.py"),
+                                                  "--receiver-port", str(receiver_port),
+                                                  "--listen-port", str(target_port), "--seed", str(seed),
+                                                  "--loss", str(config["loss"]), "--reorder", str(config["reorder"]),
+                                                  "--corrupt", str(config["corrupt"])] + quiet)
+    time.sleep(0.5)
+    sender_command = [os.path.join(here, "sender.py"), "--receiver-port", str(target_port),
+                      "--listening-port", str(free_port()), "--file", source_path,
+                      "--window-size", str(config["window_size"]), "--payload-size", str(config["payload_size"]),
+                      "--congestion", congestion_control, "--metrics", metrics_path]
+    if selective_repeat:
+        sender_command.append("--selective-repeat")
+    sender = subprocess.Popen(python + sender_command + quiet)
+    peaks = []
+    try:
+        for process in (sender, receiver):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            if process.returncode != 0:
+                raise RuntimeError(f"{process.args[2]} exited with status {process.returncode}")
+            peaks.append(usage.ru_maxrss * 1024)
+    finally:
+        for process in (sender, receiver, intermediate):
+            if process is not None and process.returncode is None:
+                process.kill()
+                process.wait()
+    with open(metrics_path) as f:
+        return json.load(f), max(peaks)
+
+
+def bench_matrix(sizes, payload_sizes, windows, losses, reorders, corrupts, repeat, seed, congestion_control,
+                 selective_repeat, subprocesses):
+    """Run every combination of file size, payload size, window size and impairment rates.
+
+    Each configuration streams a random file from disk to disk repeat times, with the Intermediate only in
+    the path when an impairment is configured. Runs are seeded with seed plus the run number, so the same
+    packets are impaired on every invocation. Peak memory is the Python heap traced by tracemalloc in
+    process, or the largest peak resident set size of the Sender and Receiver processes.
+
+    :param sizes: File sizes in bytes.
+    :param payload_sizes: Payload sizes.
+    :param windows: Window sizes, the fixed window or the cap of the congestion window.
+    :param losses: Loss probabilities.
+    :param reorders: Reorder probabilities.
+    :param corrupts: Corruption probabilities.
+    :param repeat: Runs per configuration, the medians are reported.
+    :param seed: Seed of the first run of every configuration.
+    :param congestion_control: Congestion control of the Sender.
+    :param selective_repeat: Use Selective Repeat.
+    :param subprocesses: Run every node as a separate process instead of threads of this one.
+    :return: List of dicts with the MATRIX_FIELDS and the medians of the RESULT_FIELDS.
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "source.bin")
+        sink_path = os.path.join(directory, "sink.bin")
+        for size in sizes:
+            write_random_file(source_path, size)
+            for values in itertools.product(payload_sizes, windows, losses, reorders, corrupts):
+                config = dict(zip(MATRIX_FIELDS, (size,) + values))
+                runs = []
+                for run in range(repeat):
+                    if subprocesses:
+                        metrics, peak = run_matrix_subprocess(config, source_path, sink_path, seed + run,
+                                                              congestion_control, selective_repeat, directory)
+                    else:
+                        metrics, peak = run_matrix_in_process(config, source_path, sink_path, seed + run,
+                                                              congestion_control, selective_repeat)
+                    if not same_file(source_path, sink_path):
+                        raise RuntimeError(f"Received file does not match the file that was sent for {config}")
+                    runs.append((metrics, peak))
+                rows.append(matrix_row(config, runs))
+    return rows
+
+
+def bench_matrix_simulated(sizes, payload_sizes, windows, losses, reorders, corrupts, repeat, seed,
+                           congestion_control, selective_repeat, processes=None):
+    """Run the matrix of bench_matrix on simnet's virtual-time network, spread across a process pool.
+
+    Timeouts and delays cost no wall-clock time, so elapsed and goodput are in simulated time and no peak
+    memory is reported. The impairments of a seed are the same as those of the Intermediate.
+
+    :param sizes: Data sizes in bytes.
+    :param payload_sizes: Payload sizes.
+    :param windows: Window sizes, the fixed window or the cap of the congestion window.
+    :param losses: Loss probabilities.
+    :param reorders: Reorder probabilities.
+    :param corrupts: Corruption probabilities.
+    :param repeat: Runs per configuration, the medians are reported.
+    :param seed: Seed of the first run of every configuration.
+    :param congestion_control: Congestion control of the Sender.
+    :param selective_repeat: Use Selective Repeat.
+    :param processes: Worker processes, by default one per CPU.
+    :return: List of dicts with the MATRIX_FIELDS and the medians of the RESULT_FIELDS.
+    """
+    configs = [dict(zip(MATRIX_FIELDS, values))
+               for values in itertools.product(sizes, payload_sizes, windows, losses, reorders, corrupts)]
+    results = simnet.sweep([dict(size=config["size"], window_size=config["window_size"],
+                                 payload_size=config["payload_size"], selective_repeat=selective_repeat,
+                                 congestion_control=congestion_control, seed=seed + run,
+                                 profile=NetworkProfile(config["loss"], config["reorder"], config["corrupt"]))
+                            for config in configs for run in range(repeat)], processes)
+    rows = []
+    for i, config in enumerate(configs):
+        runs = results[i * repeat:(i + 1) * repeat]
+        if not all(result["intact"] for result in runs):
+            raise RuntimeError(f"Received data does not match the data that was sent for {config}")
+        rows.append(matrix_row(config, [(result["sender"], None) for result in runs]))
+    return rows
+
+
+def matrix_row(config, runs):
+    """Summarize the runs of one configuration of the matrix.
+
+    :param config: Dict with the MATRIX_FIELDS of the configuration.
+    :param runs: List of (Sender metrics dict, peak memory in bytes or None) per run.
+    :return: Dict with the MATRIX_FIELDS, the number of runs and the medians of the RESULT_FIELDS.
+    """
+    packets = max(1, -(-config["size"] // config["payload_size"]))
+    results = dict(config, runs=len(runs))
+    columns = zip(*((metrics["elapsed"], config["size"] / metrics["elapsed"], metrics["retransmissions"] / packets,
+                     metrics["retransmissions"], metrics["packets_sent"], peak) for metrics, peak in runs))
+    for field, column in zip(RESULT_FIELDS, columns):
+        results[field] = None if None in column else statistics.median(column)
+    return results
+
+
+def matrix_metadata(args):
+    """Describe where and how a matrix was run, so results of different commits can be told apart.
+
+    :param args: Parsed command-line arguments of the matrix subcommand.
+    :return: JSON-serializable dict.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "congestion": args.congestion,
+        "selective_repeat": args.selective_repeat,
+        "subprocesses": args.subprocesses,
+        "simulated": args.simulate,
+        "seed": args.seed,
+    }
+
+
+def write_matrix(rows, metadata, json_path=None, csv_path=None):
+    """Write matrix results.
+
+    :param rows: Rows returned by bench_matrix.
+    :param metadata: Dict returned by matrix_metadata, stored with the JSON rows.
+    :param json_path: JSON file to write, or None.
+    :param csv_path: CSV file to write, or None.
+    """
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"metadata": metadata, "results": rows}, f, indent=2)
+    if csv_path:
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=MATRIX_FIELDS + ("runs",) + RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def compare_matrix(baseline_path, candidate_path):
+    """Match the rows of two JSON matrix results by configuration.
+
+    :param baseline_path: Results of the reference commit.
+    :param candidate_path: Results to compare with them.
+    :return: List of (config, baseline row, candidate row) for the configurations found in both.
+    """
+    with open(baseline_path) as f:
+        baseline = {tuple(row[field] for field in MATRIX_FIELDS): row for row in json.load(f)["results"]}
+    with open(candidate_path) as f:
+        candidate = json.load(f)["results"]
+    return [(key, baseline[key], row) for row in candidate
+            for key in [tuple(row[field] for field in MATRIX_FIELDS)] if key in baseline]
+
+
+def main():
+    """Parse command-line arguments and run the requested benchmark."""
+    parser = argparse.ArgumentParser(description="Go-Back-N and Selective Repeat benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    window_parser = subparsers.add_parser("window", help="Goodput across window sizes on loopback")
+    window_parser.add_argument("--size", type=int, default=200_000, help="Number of bytes to transfer")
+    window_parser.add_argument("--windows", type=int, nargs="+", default=[1, 5, 16, 64], help="Window sizes to compare")
+    window_parser.add_argument("--repeat", type=int, default=3, help="Runs per configuration")
+    window_parser.add_argument("--intermediate", action="store_true", help="Route transfers through an Intermediate node")
+    window_parser.add_argument("--loss", type=float, default=0.0, help="Intermediate loss probability")
+    window_parser.add_argument("--reorder", type=float, default=0.0, help="Intermediate reorder probability")
+    window_parser.add_argument("--corrupt", type=float, default=0.0, help="Intermediate corruption probability")
+
+    payload_parser = subparsers.add_parser("payload", help="Goodput across payload sizes on loopback")
+    payload_parser.add_argument("--size", type=int, default=2_000_000, help="Number of bytes to transfer")
+    payload_parser.add_argument("--payload-sizes", type=int, nargs="+", default=[44, 512, 1400, 8192, 65000],
+                                help="Payload sizes to compare")
+    payload_parser.add_argument("--window-size", type=int, default=16, help="Window size of the Sender")
+    payload_parser.add_argument("--repeat", type=int, default=3, help="Runs per configuration")
+    payload_parser.add_argument("--intermediate", action="store_true", help="Route transfers through an Intermediate node")
+    payload_parser.add_argument("--loss", type=float, default=0.0, help="Intermediate loss probability")
+    payload_parser.add_argument("--reorder", type=float, default=0.0, help="Intermediate reorder probability")
+    payload_parser.add_argument("--corrupt", type=float, default=0.0, help="Intermediate corruption probability")
+
+    sack_parser = subparsers.add_parser("sack", help="Go-Back-N against Selective Repeat over a lossy link")
+    sack_parser.add_argument("--size", type=int, default=500_000, help="Number of bytes to transfer")
+    sack_parser.add_argument("--window-size", type=int, default=32, help="Window size of the Sender")
+    sack_parser.add_argument("--repeat", type=int, default=3, help="Runs per mode")
+    sack_parser.add_argument("--loss", type=float, default=0.1, help="Intermediate loss probability")
+    sack_parser.add_argument("--reorder", type=float, default=0.1, help="Intermediate reorder probability")
+    sack_parser.add_argument("--corrupt", type=float, default=0.0, help="Intermediate corruption probability")
+
+    acks_parser = subparsers.add_parser("acks", help="Reverse-path ACKs and Sender CPU across ACK coalescing")
+    acks_parser.add_argument("--size", type=int, default=4 * 1024 * 1024)
+    acks_parser.add_argument("--ack-every", type=int, nargs="+", default=[1, 2, 4, 8])
+    acks_parser.add_argument("--ack-delay", type=float, default=ACK_DELAY * 1000, help="Milliseconds")
+    acks_parser.add_argument("--window", type=int, default=64)
+    acks_parser.add_argument("--repeat", type=int, default=3)
+    acks_parser.add_argument("--loss", type=float, default=0.0, help="Loss probability of an Intermediate node")
+    acks_parser.add_argument("--selective-repeat", action="store_true")
+
+    fec_parser = subparsers.add_parser("fec", help="Retransmissions saved by parity packets across loss rates")
+    fec_parser.add_argument("--size", type=int, default=1024 * 1024)
+    fec_parser.add_argument("--groups", type=int, nargs="+", default=[0, 4, 8, 16],
+                            help="Data packets per parity packet, 0 without FEC")
+    fec_parser.add_argument("--loss", type=float, nargs="+", default=[0.01, 0.05, 0.1])
+    fec_parser.add_argument("--window", type=int, default=32)
+    fec_parser.add_argument("--repeat", type=int, default=5)
+    fec_parser.add_argument("--selective-repeat", action="store_true")
+
+    resume_parser = subparsers.add_parser("resume", help="Packets sent by resumed and deduplicated transfers")
+    resume_parser.add_argument("--size", type=int, default=20_000_000)
+    resume_parser.add_argument("--fractions", type=float, nargs="+", default=[0.25, 0.5, 0.9],
+                               help="Fractions of the full transfer time after which the first attempt stops")
+    resume_parser.add_argument("--changed", type=int, nargs="+", default=[0, 1, 10],
+                               help="Blocks changed before a deduplicated upload")
+    resume_parser.add_argument("--window", type=int, default=64)
+    resume_parser.add_argument("--loss", type=float, default=0.01, help="Loss probability of the simulated network")
+    resume_parser.add_argument("--seed", type=int, default=0)
+
+    cache_parser = subparsers.add_parser("cache", help="Repeated downloads sent from the server's packet cache")
+    cache_parser.add_argument("--size", type=int, default=10_000_000, help="Size of every file")
+    cache_parser.add_argument("--files", type=int, default=2, help="Files downloaded in turn")
+    cache_parser.add_argument("--downloads", type=int, default=4, help="Downloads of every file")
+    cache_parser.add_argument("--cache-size", type=int, default=64 * 1024 * 1024, help="Byte limit of the cache")
+    cache_parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE)
+
+    compress_parser = subparsers.add_parser("compress", help="Packets and CPU time saved or spent by compression")
+    compress_parser.add_argument("--size", type=int, default=4_000_000)
+    compress_parser.add_argument("--data", choices=COMPRESSION_DATA, nargs="+", default=list(COMPRESSION_DATA))
+    compress_parser.add_argument("--modes", choices=COMPRESSION_MODES, nargs="+", default=list(COMPRESSION_MODES))
+    compress_parser.add_argument("--window", type=int, default=64)
+    compress_parser.add_argument("--rate", type=float, default=100, help="Link rate in Mbit/s")
+    compress_parser.add_argument("--loss", type=float, default=0.0, help="Loss probability of the link")
+
+    congestion_parser = subparsers.add_parser("congestion", help="Congestion controllers over an impaired link")
+    congestion_parser.add_argument("--size", type=int, default=2_000_000, help="Number of bytes to transfer")
+    congestion_parser.add_argument("--modes", choices=CONGESTION_MODES, nargs="+", default=list(CONGESTION_MODES),
+                                   help="Congestion controllers to compare")
+    congestion_parser.add_argument("--window-size", type=int, default=256,
+                                   help="Window of the fixed controller and cap of the others")
+    congestion_parser.add_argument("--repeat", type=int, default=3, help="Runs per controller")
+    congestion_parser.add_argument("--loss", type=float, default=0.01, help="Intermediate loss probability")
+    congestion_parser.add_argument("--reorder", type=float, default=0.0, help="Intermediate reorder probability")
+    congestion_parser.add_argument("--corrupt", type=float, default=0.0, help="Intermediate corruption probability")
+    congestion_parser.add_argument("--delay", type=float, default=0.0, help="Intermediate one-way delay in milliseconds")
+    congestion_parser.add_argument("--jitter", type=float, default=0.0, help="Intermediate jitter in milliseconds")
+    congestion_parser.add_argument("--rate", type=float, default=None, help="Intermediate bandwidth cap in Mbit/s")
+    congestion_parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE_LIMIT,
+                                   help="Packets queued at the bandwidth cap before tail drop")
+    congestion_parser.add_argument("--selective-repeat", action="store_true", help="Use Selective Repeat")
+    congestion_parser.add_argument("--trace-dir", type=str, default=None,
+                                   help="Directory to write a congestion window trace CSV per run to")
+
+    stream_parser = subparsers.add_parser("stream", help="In-memory against streaming file transfer, and reassembly")
+    stream_parser.add_argument("--size", type=int, default=20_000_000, help="Number of bytes to transfer")
+    stream_parser.add_argument("--window-size", type=int, default=64, help="Window size of the Sender")
+    stream_parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE, help="Payload bytes per packet")
+
+    large_parser = subparsers.add_parser("large", help="Memory while streaming a file of several GB")
+    large_parser.add_argument("--size", type=int, default=4 * 2 ** 30, help="Number of bytes to transfer")
+    large_parser.add_argument("--window-size", type=int, default=64, help="Window size of the Sender")
+    large_parser.add_argument("--payload-size", type=int, default=60000, help="Payload bytes per packet")
+    large_parser.add_argument("--go-back-n", action="store_true", help="Use Go-Back-N instead of Selective Repeat")
+    large_parser.add_argument("--interval", type=float, default=1.0, help="Seconds between memory samples")
+    large_parser.add_argument("--rows", type=int, default=10, help="Samples printed, evenly spaced")
+
+    load_parser = subparsers.add_parser("load", help="Aggregate server throughput with concurrent clients")
+    load_parser.add_argument("--size", type=int, default=2_000_000, help="Number of bytes per client")
+    load_parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                             help="Numbers of concurrent clients to compare")
+    load_parser.add_argument("--workers", type=int, default=1, help="Server worker processes sharing the port")
+    load_parser.add_argument("--query", action="store_true", help="Clients download instead of upload")
+
+    streams_parser = subparsers.add_parser("streams", help="Upload throughput across parallel streams")
+    streams_parser.add_argument("--size", type=int, default=20_000_000, help="Number of bytes to upload")
+    streams_parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8], help="Stream counts to compare")
+    streams_parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE, help="Payload bytes per packet")
+    streams_parser.add_argument("--workers", type=int, default=None,
+                                help="Server worker processes, one per stream by default")
+
+    small_parser = subparsers.add_parser("small", help="Latency of small file transfers between a client and server")
+    small_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000], help="File sizes in bytes")
+    small_parser.add_argument("--count", type=int, default=20, help="Files transferred per size")
+    small_parser.add_argument("--query", action="store_true", help="Download the files instead of uploading them")
+    small_parser.add_argument("--loss", type=float, default=0.0, help="Loss probability of an Intermediate in the path")
+    small_parser.add_argument("--seed", type=int, default=1, help="Seed of the Intermediate's impairments")
+
+    batch_parser = subparsers.add_parser("batch", help="Many small files one session at a time against one batch")
+    batch_parser.add_argument("--count", type=int, default=1000, help="Number of files")
+    batch_parser.add_argument("--size", type=int, default=4096, help="Size of every file in bytes")
+    batch_parser.add_argument("--query", action="store_true", help="Download the files instead of uploading them")
+    batch_parser.add_argument("--prefetch", type=int, nargs="+", default=[0, PREFETCH_WORKERS],
+                              help="Prefetch threads of the batch uploads to compare")
+    batch_parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE, help="Payload bytes per packet")
+    batch_parser.add_argument("--loss", type=float, default=0.0, help="Loss probability of an Intermediate in the path")
+    batch_parser.add_argument("--delay", type=float, default=0.0, help="One-way delay of an Intermediate in ms")
+    batch_parser.add_argument("--seed", type=int, default=1, help="Seed of the Intermediate's impairments")
+
+    record_parser = subparsers.add_parser("record", help="Transfer time with packet trace recording off and on")
+    record_parser.add_argument("--size", type=int, default=2_000_000, help="Number of bytes to transfer")
+    record_parser.add_argument("--window-size", type=int, default=64, help="Window size of the Sender")
+    record_parser.add_argument("--repeat", type=int, default=3, help="Runs with and without recording")
+    record_parser.add_argument("--loss", type=float, default=0.0, help="Loss probability of the Intermediate")
+    record_parser.add_argument("--seed", type=int, default=1, help="Seed of the Intermediate's impairments")
+
+    logging_parser = subparsers.add_parser("logging", help="Transfer time with per-packet logging off and on")
+    logging_parser.add_argument("--size", type=int, default=2_000_000, help="Number of bytes to transfer")
+    logging_parser.add_argument("--window-size", type=int, default=64, help="Window size of the Sender")
+    logging_parser.add_argument("--repeat", type=int, default=3, help="Runs per level")
+
+    relay_parser = subparsers.add_parser("relay", help="Packets per second relayed by the Intermediate")
+    relay_parser.add_argument("--flows", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrent flows to compare")
+    relay_parser.add_argument("--packets", type=int, default=20_000, help="Packets sent by each flow")
+    relay_parser.add_argument("--window-size", type=int, default=32, help="Packets in flight per flow")
+    relay_parser.add_argument("--payload-size", type=int, default=64, help="Bytes per packet")
+    relay_parser.add_argument("--seed", type=int, default=1, help="Seed of the Intermediate's impairments")
+
+    codec_parser = subparsers.add_parser("codec", help="Per-packet encode and decode cost")
+    codec_parser.add_argument("--payload-sizes", type=int, nargs="+", default=[44, DEFAULT_PAYLOAD_SIZE],
+                              help="Payload sizes to measure")
+    codec_parser.add_argument("--number", type=int, default=20_000, help="Packets per measurement")
+
+    matrix_parser = subparsers.add_parser("matrix", help="Every combination of sizes, windows and impairments")
+    matrix_parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 2_000_000], help="File sizes in bytes")
+    matrix_parser.add_argument("--payload-sizes", type=int, nargs="+", default=[DEFAULT_PAYLOAD_SIZE],
+                               help="Payload sizes")
+    matrix_parser.add_argument("--windows", type=int, nargs="+", default=[16, 64], help="Window sizes")
+    matrix_parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.05], help="Loss probabilities")
+    matrix_parser.add_argument("--reorder", type=float, nargs="+", default=[0.0], help="Reorder probabilities")
+    matrix_parser.add_argument("--corrupt", type=float, nargs="+", default=[0.0], help="Corruption probabilities")
+    matrix_parser.add_argument("--repeat", type=int, default=3, help="Runs per configuration")
+    matrix_parser.add_argument("--seed", type=int, default=1, help="Seed of the first run of every configuration")
+    matrix_parser.add_argument("--congestion", choices=CONGESTION_MODES, default=CONGESTION_FIXED,
+                               help="Congestion control of the Sender")
+    matrix_parser.add_argument("--selective-repeat", action="store_true", help="Use Selective Repeat")
+    matrix_parser.add_argument("--subprocesses", action="store_true",
+                               help="Run the sender, receiver and intermediate scripts as separate processes")
+    matrix_parser.add_argument("--simulate", action="store_true",
+                               help="Run on the virtual-time network of simnet instead of loopback sockets")
+    matrix_parser.add_argument("--processes", type=int, default=None,
+                               help="Worker processes of a simulated matrix, one per CPU by default")
+    matrix_parser.add_argument("--json", type=str, default=None, help="Write the results to this JSON file")
+    matrix_parser.add_argument("--csv", type=str, default=None, help="Write the results to this CSV file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON results of the matrix benchmark")
+    compare_parser.add_argument("baseline", type=str, help="Results of the reference commit")
+    compare_parser.add_argument("candidate", type=str, help="Results to compare with them")
+
+    args = parser.parse_args()
+
+    if args.command == "window":
+        results = bench_window(args.size, args.windows, args.repeat, args.intermediate,
+                               args.loss, args.reorder, args.corrupt)
+
+        path = "via intermediate" if args.intermediate else "direct"
+        print(f"Goodput for {args.size} bytes ({path}):")
+        for window_size, elapsed, goodput in results:
+            print(f"  window {window_size:>4}: {elapsed:8.3f} s  {goodput / 1024:10.1f} KiB/s")
+
+    elif args.command == "payload":
+        results = bench_payload(args.size, args.payload_sizes, args.window_size, args.repeat, args.intermediate,
+                                args.loss, args.reorder, args.corrupt)
+
+        path = "via intermediate" if args.intermediate else "direct"
+        print(f"Goodput for {args.size} bytes with window {args.window_size} ({path}):")
+        for payload_size, packets, elapsed, goodput in results:
+            print(f"  payload {payload_size:>6}: {packets:>7} packets {elapsed:8.3f} s  {goodput / 1024:10.1f} KiB/s")
+
+    elif args.command == "sack":
+        results = bench_sack(args.size, args.window_size, args.repeat, args.loss, args.reorder, args.corrupt)
+
+        print(f"{args.size} bytes with window {args.window_size}, loss {args.loss}, reorder {args.reorder}:")
+        print(f"{'mode':>10} {'seconds':>8} {'retransmitted':>14} {'duplicates':>11}")
+        for mode, elapsed, retransmissions, duplicates in results:
+            print(f"{mode:>10} {elapsed:>8.3f} {retransmissions:>14.0f} {duplicates:>11.0f}")
+
+    elif args.command == "acks":
+        results = bench_acks(args.size, args.ack_every, args.ack_delay / 1000, args.window, args.repeat, args.loss,
+                             args.selective_repeat)
+        print(f"{'ack every':>10} {'seconds':>9} {'ACKs':>8} {'ACKs/packet':>12} {'sender CPU s':>13} {'retransmits':>12}")
+        for ack_every, elapsed, acks, ratio, cpu, retransmissions in results:
+            print(f"{ack_every:>10} {elapsed:>9.3f} {acks:>8.0f} {ratio:>12.3f} {cpu:>13.3f} {retransmissions:>12.0f}")
+    elif args.command == "fec":
+        results = bench_fec(args.size, args.groups, args.loss, args.window, args.repeat, args.selective_repeat)
+        protocol = "Selective Repeat" if args.selective_repeat else "Go-Back-N"
+        print(f"{args.size} bytes, {protocol}, window {args.window}, medians of {args.repeat} runs:")
+        print(f"{'loss':>6} {'group':>6} {'seconds':>9} {'retransmits':>12} {'timeouts':>9} {'rebuilt':>8} "
+              f"{'parity':>7} {'sender CPU s':>13}")
+        for loss_prob, fec_group, elapsed, retransmissions, timeouts, recovered, parity, cpu in results:
+            print(f"{loss_prob:>6} {fec_group:>6} {elapsed:>9.3f} {retransmissions:>12.0f} {timeouts:>9.0f} "
+                  f"{recovered:>8.0f} {parity:>7.0f} {cpu:>13.3f}")
+        print(f"Parity cost per data packet of {DEFAULT_PAYLOAD_SIZE} bytes:")
+        for fec_group, encode, decode in bench_parity(DEFAULT_PAYLOAD_SIZE, [g for g in args.groups if g], 10000):
+            print(f"  group {fec_group:>3}: encode {encode:8.0f} ns  decode {decode:8.0f} ns")
+    elif args.command == "resume":
+        full_time, full_packets, resumed, deduplicated, hashing = bench_resume(
+            args.size, args.fractions, args.changed, args.window, args.loss, args.seed)
+        print(f"{args.size} bytes in {block_size_for(args.size)} byte blocks, window {args.window}, loss {args.loss}, "
+              f"simulated:")
+        print(f"  full transfer: {full_packets} packets in {full_time:.3f} s")
+        for fraction, first, second, intact in resumed:
+            print(f"  interrupted at {fraction:.0%}: {first:>7} + {second:>7} packets resumed "
+                  f"({(first + second) / full_packets:.2f}x full){'' if intact else '  CORRUPT'}")
+        for changed, packets, intact in deduplicated:
+            print(f"  dedup, {changed:>3} blocks changed: {packets:>7} packets "
+                  f"({packets / full_packets:.1%} of full){'' if intact else '  CORRUPT'}")
+        print(f"  hashing every block: {hashing * 1000:.1f} ms")
+    elif args.command == "cache":
+        rounds, stats = bench_cache(args.size, args.files, args.downloads, args.cache_size, args.payload_size)
+        print(f"{args.files} files of {args.size} bytes, {args.payload_size} byte payloads, cache of "
+              f"{args.cache_size} bytes, simulated downloads:")
+        print(f"{'round':>6} {'uncached s':>11} {'cached s':>9}")
+        for round_number, uncached, cached in rounds:
+            print(f"{round_number:>6} {uncached:>11.3f} {cached:>9.3f}")
+        print(f"Cache: {stats}")
+    elif args.command == "compress":
+        results = bench_compression(args.size, args.data, args.modes, args.window, args.rate * 1e6 / 8, args.loss)
+        print(f"{args.size} bytes, window {args.window}, simulated {args.rate} Mbit/s link with {args.loss} loss:")
+        print(f"{'data':>7} {'mode':>5} {'ratio':>6} {'packets':>8} {'compress s':>11} {'decompress s':>13} "
+              f"{'transfer s':>11} {'total s':>8} {'pays off below':>15}")
+        for row in results:
+            kind, mode, compressed_size, packets, compress_time, decompress_time, elapsed, break_even, intact = row
+            below = "-" if break_even is None else f"{break_even * 8 / 1e6:.0f} Mbit/s"
+            print(f"{kind:>7} {mode:>5} {compressed_size / args.size:>6.3f} {packets:>8} {compress_time:>11.3f} "
+                  f"{decompress_time:>13.3f} {elapsed:>11.3f} {compress_time + decompress_time + elapsed:>8.3f} "
+                  f"{below:>15}{'' if intact else '  CORRUPT'}")
+    elif args.command == "congestion":
+        profile = NetworkProfile(args.loss, args.reorder, args.corrupt, args.delay / 1000, args.jitter / 1000,
+                                 None if args.rate is None else args.rate * 1e6 / 8, queue_limit=args.queue)
+        results = bench_congestion(args.size, args.modes, args.window_size, args.repeat, profile,
+                                   args.selective_repeat, args.trace_dir)
+
+        protocol = "Selective Repeat" if args.selective_repeat else "Go-Back-N"
+        link = "" if args.rate is None else f", {args.rate} Mbit/s with a {args.queue} packet queue"
+        print(f"{args.size} bytes, {protocol}, window cap {args.window_size}, loss {args.loss}, reorder {args.reorder}, "
+              f"delay {args.delay} ms{link}:")
+        print(f"{'mode':>6} {'seconds':>8} {'KiB/s':>10} {'retransmitted':>14} {'max cwnd':>9}")
+        for mode, elapsed, goodput, retransmissions, max_cwnd in results:
+            print(f"{mode:>6} {elapsed:>8.3f} {goodput / 1024:>10.1f} {retransmissions:>14.0f} {max_cwnd:>9.1f}")
+
+    elif args.command == "stream":
+        results = bench_stream(args.size, args.window_size, args.payload_size)
+
+        print(f"{args.size} bytes with {args.payload_size} byte payloads:")
+        for description, elapsed, peak in results:
+            memory = "" if peak is None else f"  peak {peak / 2 ** 20:8.1f} MiB"
+            print(f"  {description:<36} {elapsed:8.3f} s{memory}")
+
+    elif args.command == "large":
+        elapsed, sender, samples = bench_large(args.size, args.window_size, args.payload_size, not args.go_back_n,
+                                               args.interval)
+
+        mode = "Go-Back-N" if args.go_back_n else "Selective Repeat"
+        print(f"{args.size} bytes with {args.payload_size} byte payloads, {mode}, window {args.window_size}: "
+              f"{elapsed:.1f} s, {args.size / elapsed / 2 ** 20:.1f} MiB/s, {sender.metrics.packets_sent} packets, "
+              f"{sender.metrics.retransmissions} retransmitted")
+        print(f"  {'seconds':>8} {'received':>9} {'anon RSS MiB':>13} {'traced MiB':>11}")
+        rows = sorted({round(row * (len(samples) - 1) / max(1, args.rows - 1)) for row in range(args.rows)})
+        for seconds, received, anonymous, traced in (samples[row] for row in rows):
+            anonymous = "-" if anonymous is None else f"{anonymous / 2 ** 20:.1f}"
+            print(f"  {seconds:8.1f} {received / args.size:9.0%} {anonymous:>13} {traced / 2 ** 20:11.2f}")
+        anonymous = [sample[2] for sample in samples if sample[2] is not None]
+        if anonymous:
+            print(f"  anonymous RSS growth from the first to the last sample: "
+                  f"{(anonymous[-1] - anonymous[0]) / 2 ** 20:+.1f} MiB")
+
+    elif args.command == "load":
+        results = bench_load(args.size, args.clients, args.workers, args.query)
+
+        direction = "downloading" if args.query else "uploading"
+        print(f"Clients {direction} {args.size} bytes each, server with {args.workers} worker(s):")
+        for clients, elapsed, goodput in results:
+            print(f"  {clients:>4} clients: {elapsed:8.3f} s  {goodput / 1024:10.1f} KiB/s aggregate")
+
+    elif args.command == "streams":
+        results = bench_streams(args.size, args.streams, args.payload_size, args.workers)
+
+        print(f"Upload of {args.size} bytes with {args.payload_size} byte payloads ({os.cpu_count()} CPUs):")
+        for streams, elapsed, goodput in results:
+            print(f"  {streams:>3} streams: {elapsed:8.3f} s  {goodput / 1024:10.1f} KiB/s")
+
+    elif args.command == "small":
+        results = bench_small_files(args.sizes, args.count, args.query, args.loss, args.seed)
+
+        direction = "Downloading" if args.query else "Uploading"
+        print(f"{direction} {args.count} files of each size, one after the other, with {args.loss} loss:")
+        for size, median, slowest in results:
+            print(f"  {size:>10} bytes: median {median * 1000:8.2f} ms  slowest {slowest * 1000:8.2f} ms")
+
+    elif args.command == "batch":
+        results = bench_batch(args.count, args.size, args.query, args.prefetch, args.payload_size, args.loss,
+                              args.delay / 1000, args.seed)
+
+        direction = "Downloading" if args.query else "Uploading"
+        print(f"{direction} {args.count} files of {args.size} bytes with {args.loss} loss and {args.delay} ms delay:")
+        for description, elapsed, files_per_second in results:
+            print(f"  {description:<26} {elapsed:8.3f} s  {files_per_second:9.1f} files/s")
+
+    elif args.command == "record":
+        plain, recording, records, per_record, read_back = bench_record(args.size, args.window_size, args.repeat,
+                                                                        args.loss, args.seed)
+
+        print(f"{args.size} bytes through an Intermediate with {args.loss} loss, window {args.window_size}:")
+        print(f"  not recording  {plain:8.3f} s  {args.size / plain / 1024:10.1f} KiB/s")
+        print(f"  recording      {recording:8.3f} s  {args.size / recording / 1024:10.1f} KiB/s  "
+              f"({recording / plain - 1:+.1%})")
+        print(f"  {sum(records.values())} records ("
+              + ", ".join(f"{node} {count}" for node, count in records.items())
+              + f"), {per_record * 1e6:.2f} µs per record, read back and analysed in {read_back:.3f} s")
+
+    elif args.command == "logging":
+        results = bench_logging(args.size, args.window_size, args.repeat)
+
+        print(f"{args.size} bytes with window {args.window_size}:")
+        for level, elapsed, goodput in results:
+            print(f"  {level:<8} {elapsed:8.3f} s  {goodput / 1024:10.1f} KiB/s")
+
+    elif args.command == "relay":
+        results = bench_relay(args.flows, args.packets, args.window_size, args.payload_size, args.seed)
+
+        print(f"Intermediate relaying {args.packets} packets of {args.payload_size} bytes per flow and their echoes:")
+        for flows, elapsed, rate in results:
+            print(f"  {flows:>4} flows: {elapsed:8.3f} s  {rate:12.0f} packets/s")
+
+    elif args.command == "codec":
+        print(f"{'codec':>8} {'payload':>8} {'encode ns':>10} {'decode ns':>10}")
+        for name, payload_size, encode, decode in bench_codec(args.payload_sizes, args.number):
+            print(f"{name:>8} {payload_size:>8} {encode:>10.0f} {decode:>10.0f}")
+
+    elif args.command == "matrix":
+        start = time.perf_counter()
+        if args.simulate:
+            rows = bench_matrix_simulated(args.sizes, args.payload_sizes, args.windows, args.loss, args.reorder,
+                                          args.corrupt, args.repeat, args.seed, args.congestion,
+                                          args.selective_repeat, args.processes)
+        else:
+            rows = bench_matrix(args.sizes, args.payload_sizes, args.windows, args.loss, args.reorder,
+                                args.corrupt, args.repeat, args.seed, args.congestion, args.selective_repeat,
+                                args.subprocesses)
+        wall_time = time.perf_counter() - start
+        write_matrix(rows, matrix_metadata(args), args.json, args.csv)
+
+        memory = "peak RSS" if args.subprocesses else "peak heap"
+        print(f"{'size':>10} {'payload':>7} {'window':>6} {'loss':>5} {'reorder':>7} {'corrupt':>7} {'seconds':>8} "
+              f"{'KiB/s':>10} {'retx ratio':>10} {memory:>10}")
+        for row in rows:
+            print(f"{row['size']:>10} {row['payload_size']:>7} {row['window_size']:>6} {row['loss']:>5} "
+                  f"{row['reorder']:>7} {row['corrupt']:>7} {row['elapsed']:>8.3f} {row['goodput'] / 1024:>10.1f} "
+                  f"{row['retransmission_ratio']:>10.3f} " +
+                  ("         -" if row["peak_memory"] is None else f"{row['peak_memory'] / 2 ** 20:>6.1f} MiB"))
+        if args.simulate:
+            simulated = sum(row["elapsed"] * row["runs"] for row in rows)
+            print(f"{simulated:.1f} s of transfers simulated in {wall_time:.1f} s")
+
+    elif args.command == "compare":
+        print(f"{'size':>10} {'payload':>7} {'window':>6} {'loss':>5} {'reorder':>7} {'corrupt':>7} "
+              f"{'KiB/s before':>12} {'after':>10} {'change':>8}")
+        for config, before, after in compare_matrix(args.baseline, args.candidate):
+            change = (after["goodput"] - before["goodput"]) / before["goodput"] * 100
+            size, payload_size, window_size, loss, reorder, corrupt = config
+            print(f"{size:>10} {payload_size:>7} {window_size:>6} {loss:>5} {reorder:>7} {corrupt:>7} "
+                  f"{before['goodput'] / 1024:>12.1f} {after['goodput'] / 1024:>10.1f} {change:>+7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
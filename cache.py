@@ -0,0 +1,233 @@
+import array
+import logging
+import os
+from collections import OrderedDict
+from stream import FileSource
+from compress import COMPRESSION_NONE, COMPRESSION_MODES
+
+# Constants
+CACHE_SIZE = 256 * 1024 * 1024  # Bytes of mapped files and checksum indexes the Server keeps by default
+UNKNOWN_SUM = -1  # Index entry of a packet whose payload has not been summed yet
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    """A file kept mapped by a PacketCache, as it is or compressed, with the payload sums of its packets.
+
+    The payload sums, the part of a packet's checksum that does not depend on its sequence number, are
+    indexed per payload size and checksum mode, since downloads may negotiate different ones. They are filled
+    in as packets are first sent, so the first download of a file costs no more than without the cache and
+    later ones skip the checksum of every packet it sent.
+    """
+    def __init__(self, path, version, source):
+        """Keep a source of the file.
+
+        :param path: Path of the file.
+        :param version: Tuple (mtime in ns, size, inode) of the file the source was read from, as file_version
+            returns.
+        :param source: A stream.FileSource of the file, or a compress.CompressedSource of it.
+        """
+        self.path = path
+        self.version = version
+        self.source = source
+        self.indexes = {}
+        self.cost = self.source.size
+        self.users = 0
+        self.evicted = False
+
+    def payload_sums(self, payload_size, checksum_mode):
+        """Return the index of payload sums for a payload size and checksum mode, creating it empty.
+
+        :param payload_size: Negotiated payload size.
+        :param checksum_mode: Checksum mode of the codec.
+        :return: Tuple (index, bytes added to the cost of the entry), the index is an array of one sum per
+            packet, UNKNOWN_SUM until the packet is first sent.
+        """
+        key = (payload_size, checksum_mode)
+        sums = self.indexes.get(key)
+        if sums is not None:
+            return sums, 0
+        packets = (self.source.size + payload_size - 1) // payload_size
+        sums = self.indexes[key] = array.array('q', [UNKNOWN_SUM]) * packets
+        added = sums.itemsize * packets
+        self.cost += added
+        return sums, added
+
+    def release(self):
+        """Close the file once it is evicted and no download uses it any more. Until then the mapping stays
+        valid only because writers replace the file instead of truncating it, see PacketCache."""
+        if self.evicted and not self.users:
+            self.source.close()
+
+
+class CachedSource:
+    """The source of one download of a cached file, a view of its CacheEntry.
+
+    It reads like a stream.FileSource, or a compress.CompressedSource for a compressed entry. The Sender asks
+    it for the payload sums of the negotiated payload size and checksum mode, and closing it lets the cache
+    close the file once it is evicted.
+    """
+    def __init__(self, cache, entry):
+        """Start using an entry.
+
+        :param cache: PacketCache the entry belongs to.
+        :param entry: The CacheEntry.
+        """
+        self.cache = cache
+        self.entry = entry
+        self.size = entry.source.size
+        self.version = entry.version[0]
+        self.compression = getattr(entry.source, "compression", COMPRESSION_NONE)
+        self.read = entry.source.read
+        self.closed = False
+        entry.users += 1
+
+    def payload_sums(self, payload_size, checksum_mode):
+        """Return the shared index of payload sums for a payload size and checksum mode.
+
+        :param payload_size: Negotiated payload size.
+        :param checksum_mode: Checksum mode of the codec.
+        :return: Array of one payload sum per packet, UNKNOWN_SUM for packets not summed yet.
+        """
+        sums, added = self.entry.payload_sums(payload_size, checksum_mode)
+        if added and not self.entry.evicted:
+            self.cache.grow(added)
+        return sums
+
+    def close(self):
+        """Stop using the entry."""
+        if self.closed:
+            return
+        self.closed = True
+        self.entry.users -= 1
+        self.entry.release()
+
+
+def file_version(stat):
+    """Identify the version of a file.
+
+    :param stat: Result of os.stat on the file.
+    :return: Tuple (mtime in ns, size, inode).
+    """
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class PacketCache:
+    """LRU cache of the files the Server sends, limited by the bytes it holds.
+
+    Entries are keyed by path and compression and remember the modification time, size and inode of the file
+    when it was mapped; a file that changed since is mapped again. A compressed entry holds the compressed data
+    in a compress.CompressedSource, so repeated compressed downloads of a file are compressed once; the
+    Server compresses off its event loop and adds the result with add. Each entry keeps the file mapped and
+    the payload sums of its packets, so repeated downloads of a popular file neither open nor checksum it
+    again. The cost of an entry is the size of the file plus its indexes. When the total exceeds max_bytes,
+    the least recently used entries are evicted; a file still being sent is only closed once its last
+    download finishes. Files larger than max_bytes are not cached.
+
+    Since entries keep their files mapped, writers must replace a file, never truncate or rewrite it in place:
+    reading a page of a mapping past the end of a truncated file raises SIGBUS, which kills the Server. Uploads
+    and batches are written to a staging file that os.replace moves over the file, see stream.FileSink, so a
+    download still using an entry keeps reading the old inode, and the new inode makes the next open map the
+    new file. A file whose version changed under the same inode was rewritten in place, and open logs it.
+    """
+    def __init__(self, max_bytes=CACHE_SIZE):
+        """Initialize an empty cache.
+
+        :param max_bytes: Largest total cost of the entries.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open(self, path, compression=COMPRESSION_NONE):
+        """Open a file to send, from the cache if it holds the current version.
+
+        :param path: Path of the file.
+        :param compression: One of compress.COMPRESSION_MODES.
+        :return: A CachedSource, or a stream.FileSource for a file too large to cache. For a compression, None
+            if the cache does not hold the current version compressed, which the caller then adds.
+        :raises OSError: If the file cannot be opened.
+        """
+        stat = os.stat(path)
+        key = (path, compression)
+        entry = self.entries.get(key)
+        if entry is not None and entry.version == file_version(stat):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return CachedSource(self, entry)
+        self.misses += 1
+        if entry is not None:
+            if entry.version[2] == stat.st_ino:
+                logger.warning("%s was rewritten in place instead of replaced, downloads sending it may crash", path)
+            self.evict(key)
+        if compression != COMPRESSION_NONE:
+            return None
+        return self.add(path, file_version(stat), FileSource(path))
+
+    def add(self, path, version, source, compression=COMPRESSION_NONE):
+        """Cache a source of a file, unless it is larger than the cache.
+
+        :param path: Path of the file.
+        :param version: Version of the file the source was read from, as file_version returns.
+        :param source: A stream.FileSource of the file, or a compress.CompressedSource of it.
+        :param compression: The compression of the source.
+        :return: A CachedSource of the new entry, or the source itself if it is too large to cache.
+        """
+        if source.size > self.max_bytes:
+            return source
+        key = (path, compression)
+        if key in self.entries:
+            self.evict(key)
+        entry = CacheEntry(path, version, source)
+        self.entries[key] = entry
+        cached = CachedSource(self, entry)
+        self.grow(entry.cost)
+        return cached
+
+    def grow(self, added):
+        """Account for bytes added to an entry and evict the least recently used entries over the limit.
+
+        :param added: Number of bytes added.
+        """
+        self.size += added
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self.evict(next(iter(self.entries)))
+
+    def invalidate(self, path):
+        """Drop the entries of a file that was replaced. Downloads using them keep the old file.
+
+        :param path: Path of the file.
+        """
+        for compression in COMPRESSION_MODES:
+            if (path, compression) in self.entries:
+                self.evict((path, compression))
+
+    def evict(self, key):
+        """Remove an entry, closing its file unless a download still uses it, which keeps reading the file it
+        mapped even if it has been replaced since.
+
+        :param key: Tuple (path, compression) of the entry.
+        """
+        entry = self.entries.pop(key)
+        self.size -= entry.cost
+        self.evictions += 1
+        entry.evicted = True
+        entry.release()
+        logger.debug("Evicted %s (%s) from the packet cache", *key)
+
+    def clear(self):
+        """Evict every entry."""
+        while self.entries:
+            self.evict(next(iter(self.entries)))
+
+    def stats(self):
+        """Export the counters of the cache.
+
+        :return: Dict of hits, misses, evictions, cached files and bytes held.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "files": len(self.entries), "bytes": self.size}
@@ -0,0 +1,250 @@
+import array
+import hashlib
+import os
+import struct
+from stream import FileSource
+
+# Constants
+BLOCK_SIZE = 64 * 1024  # Smallest block tracked by a checkpoint, in bytes
+MAX_BLOCKS = 4096  # Most blocks per transfer, so the block hashes of a file fit in one setup packet
+HASH_SIZE = 8  # Bytes of BLAKE2b digest per block
+CHECKPOINT_SUFFIX = ".checkpoint"
+CHECKPOINT_INTERVAL = 1.0  # Seconds between writes of the checkpoint while blocks complete
+CHECKPOINT_HEADER = struct.Struct('!QIQ')  # Size of the data, block size and version, followed by the bitmap
+
+
+def block_size_for(total_size):
+    """Block size of a transfer: BLOCK_SIZE, doubled until the data fits in MAX_BLOCKS blocks.
+
+    Both ends derive it from the size announced in the setup packet, independently of the payload size,
+    so a checkpoint stays valid when a resumed transfer negotiates another payload size.
+
+    :param total_size: Size of the data in bytes.
+    :return: Block size in bytes.
+    """
+    block_size = BLOCK_SIZE
+    while block_size * MAX_BLOCKS < total_size:
+        block_size *= 2
+    return block_size
+
+
+def block_hashes(source):
+    """Hash every block of a source, for the receiver to find the blocks it already has.
+
+    :param source: A source with size and read(offset, length), e.g. stream.FileSource.
+    :return: HASH_SIZE bytes per block, concatenated.
+    """
+    block_size = block_size_for(source.size)
+    return b"".join(hashlib.blake2b(source.read(offset, block_size), digest_size=HASH_SIZE).digest()
+                    for offset in range(0, source.size, block_size))
+
+
+def sync_file(path):
+    """Flush the data written to a file to disk, through any descriptor, with fsync.
+
+    :param path: Path of the file.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BlockMap:
+    """Bitmap of the blocks of a transfer that the receiver already has.
+
+    The receiver sends it in its answer to the setup packet. The sender skips every packet that lies
+    entirely in blocks marked in it, and the receiver treats those packets as received.
+    """
+    def __init__(self, total_size, bitmap=None):
+        """Initialize the map.
+
+        :param total_size: Size of the data in bytes.
+        :param bitmap: Bitmap as returned by to_bytes, by default no block is marked.
+        """
+        self.total_size = total_size
+        self.block_size = block_size_for(total_size)
+        self.block_count = (total_size + self.block_size - 1) // self.block_size
+        self.bitmap = bytearray((self.block_count + 7) // 8)
+        if bitmap is not None:
+            self.bitmap[:len(bitmap)] = bitmap[:len(self.bitmap)]
+
+    def has(self, block):
+        """Check whether a block is marked.
+
+        :param block: Block number.
+        :return: True if the receiver has the block.
+        """
+        return bool(self.bitmap[block >> 3] & (1 << (block & 7)))
+
+    def mark(self, block):
+        """Mark a block.
+
+        :param block: Block number.
+        """
+        self.bitmap[block >> 3] |= 1 << (block & 7)
+
+    def unmark(self, block):
+        """Clear the mark of a block.
+
+        :param block: Block number.
+        """
+        self.bitmap[block >> 3] &= ~(1 << (block & 7))
+
+    def covers(self, offset, length):
+        """Check whether a byte range lies entirely in marked blocks.
+
+        :param offset: First byte of the range.
+        :param length: Number of bytes, at least 1.
+        :return: True if the receiver has every byte of the range.
+        """
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        return all(self.has(block) for block in range(first, last + 1))
+
+    def count(self):
+        """Count the marked blocks.
+
+        :return: Number of blocks the receiver has.
+        """
+        return sum(bin(byte).count("1") for byte in self.bitmap)
+
+    def block_length(self, block):
+        """Length of a block, shorter for the last one.
+
+        :param block: Block number.
+        :return: Bytes in the block.
+        """
+        return min(self.block_size, self.total_size - block * self.block_size)
+
+    def to_bytes(self):
+        """Export the bitmap.
+
+        :return: One bit per block, block i in bit i % 8 of byte i // 8.
+        """
+        return bytes(self.bitmap)
+
+
+class Checkpoint:
+    """Progress of a transfer into a file, persisted next to it so an interrupted transfer can resume.
+
+    The receiver counts the bytes written to every block and marks a block in its BlockMap once all of
+    them have arrived. The map is written to the checkpoint file at most every CHECKPOINT_INTERVAL seconds
+    while blocks complete, and when the receiver is closed; it is removed once the transfer completes. The
+    file is synced to disk before the map that describes it, so after a crash the map never claims blocks
+    that did not reach the disk. A checkpoint only describes data of the same size and version, so a
+    transfer of other data, or of data whose version the sender does not know, starts over.
+
+    When the sender announces the hashes of its blocks, every block of the existing file is hashed and
+    compared with them: blocks the checkpoint does not mark are marked if they match, so an unchanged part
+    of a file is not sent again, and blocks it marks are dropped if they do not.
+    """
+    def __init__(self, path, total_size, version=0):
+        """Load the checkpoint of a file, or start an empty one.
+
+        :param path: Path of the file being received.
+        :param total_size: Size of the data announced by the sender.
+        :param version: Version of the data announced by the sender, 0 if it is unknown.
+        """
+        self.path = path
+        self.checkpoint_path = path + CHECKPOINT_SUFFIX
+        self.version = version
+        self.blocks = BlockMap(total_size, self.load(total_size))
+        self.received = array.array('Q', bytes(8 * self.blocks.block_count))
+        self.saved = None
+
+    def load(self, total_size):
+        """Read the bitmap of the checkpoint file.
+
+        :param total_size: Size of the data announced by the sender.
+        :return: The bitmap, or None if there is no checkpoint of data of this size and version.
+        """
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        if len(content) < CHECKPOINT_HEADER.size:
+            return None
+        size, block_size, version = CHECKPOINT_HEADER.unpack_from(content)
+        if size != total_size or block_size != block_size_for(total_size) or version != self.version or not version:
+            return None
+        return content[CHECKPOINT_HEADER.size:]
+
+    def match(self, hashes):
+        """Compare every block of the existing file with the sender's hash, marking the blocks that match and
+        dropping the marked ones that do not.
+
+        :param hashes: Block hashes of the sender, as returned by block_hashes.
+        :return: Tuple (blocks newly marked, marked blocks dropped).
+        """
+        blocks = self.blocks
+        try:
+            source = FileSource(self.path)
+        except OSError:
+            source = None
+        matched = dropped = 0
+        try:
+            for block in range(blocks.block_count):
+                offset = block * blocks.block_size
+                length = blocks.block_length(block)
+                expected = hashes[block * HASH_SIZE:(block + 1) * HASH_SIZE]
+                same = (source is not None and offset + length <= source.size and len(expected) == HASH_SIZE
+                        and hashlib.blake2b(source.read(offset, length), digest_size=HASH_SIZE).digest() == expected)
+                if same and not blocks.has(block):
+                    blocks.mark(block)
+                    matched += 1
+                elif not same and blocks.has(block):
+                    blocks.unmark(block)
+                    dropped += 1
+        finally:
+            if source is not None:
+                source.close()
+        return matched, dropped
+
+    def add(self, offset, length, now):
+        """Count bytes written to the file, and save the checkpoint when a block completes.
+
+        :param offset: First byte written.
+        :param length: Number of bytes written.
+        :param now: Current time, to limit how often the checkpoint is written.
+        """
+        blocks = self.blocks
+        end = offset + length
+        block = offset // blocks.block_size
+        while offset < end:
+            block_end = min((block + 1) * blocks.block_size, end)
+            if not blocks.has(block):
+                self.received[block] += block_end - offset
+                if self.received[block] >= blocks.block_length(block):
+                    blocks.mark(block)
+                    if self.saved is None or now - self.saved >= CHECKPOINT_INTERVAL:
+                        self.save(now)
+            offset = block_end
+            block += 1
+
+    def save(self, now=None):
+        """Sync the file to disk, then write the checkpoint file, replacing it atomically.
+
+        :param now: Current time, recorded as the time of the last write.
+        """
+        blocks = self.blocks
+        sync_file(self.path)
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, 'wb') as f:
+            f.write(CHECKPOINT_HEADER.pack(blocks.total_size, blocks.block_size, self.version) + blocks.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+        self.saved = now
+
+    def remove(self):
+        """Delete the checkpoint file once the transfer is complete."""
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
@@ -1,11 +1,28 @@
 import argparse
+import logging
+import multiprocessing
+import os
+import time
 from sender import Sender
 from receiver import Receiver
+from stream import FileSource, FileSink, range_filename
+from metrics import configure_logging, LOG_LEVELS
+from packet import DEFAULT_PAYLOAD_SIZE, new_session_id
+from compress import should_compress, COMPRESSION_NONE, COMPRESSION_MODES
+from batch import BatchSource, BatchSink, expand_paths, PREFETCH_WORKERS
+
+# Constants
+FILES_DIRECTORY = "Client_files"
+
+logger = logging.getLogger(__name__)
 
 
 class Client:
-    """A client that can either send a file to a server or query a file from the server."""
-    def __init__(self, listen_port, server_port, server_ip, query, filename):
+    """A client that can either send a file, or a batch of files, to a server or query them from the server."""
+    def __init__(self, listen_port, server_port, server_ip, query, filename, payload_size=DEFAULT_PAYLOAD_SIZE,
+                 selective_repeat=False, directory=FILES_DIRECTORY, streams=1, metrics_path=None, fec_group=0,
+                 resume=False, dedup=False, compression=COMPRESSION_NONE, batch=None, prefetch=PREFETCH_WORKERS,
+                 record_path=None):
         """
         Initialize the client with the specified parameters.
 
@@ -14,17 +31,51 @@ class Client:
         :param server_ip: IP address of the server.
         :param query: Boolean flag indicating if the client should query the server for a file.
         :param filename: Name of the file to send to the server or query from the server.
+        :param payload_size: Payload size proposed for uploads and the largest accepted for downloads.
+        :param selective_repeat: Propose Selective Repeat for uploads.
+        :param directory: Directory downloaded files are written to.
+        :param streams: Number of parallel flows an upload is split into.
+        :param metrics_path: Write the metrics of the file transfer as JSON to this file. Each stream of a
+            parallel upload writes its own file, suffixed with the offset of its range.
+        :param fec_group: Data packets per parity packet proposed for uploads, 0 without forward error correction.
+        :param resume: Keep a checkpoint of downloads so an interrupted download resumes, and skip the blocks of
+            a local copy that are unchanged when the server announces its block hashes.
+        :param dedup: Announce the block hashes of uploads, so a server resuming into an older copy of the file
+            is only sent the blocks that changed.
+        :param compression: One of compress.COMPRESSION_MODES, used for uploads and asked of the server for
+            downloads. Files that are already compressed are sent as they are, except in a batch.
+        :param batch: Transfer many files in one session instead of filename: paths, glob patterns and
+            directories to upload, or glob patterns matched in the server's directory to download.
+        :param prefetch: Threads reading and checksumming the next files of a batch upload while the current one
+            is in flight, 0 reads them as they are sent.
+        :param record_path: Record the packet events of the transfer to this recorder.TraceRecorder ring file. Each
+            stream of a parallel upload records its own file, suffixed with the offset of its range.
         """
         self.listen_port = listen_port
         self.server_port = server_port
         self.server_ip = server_ip
         self.query = query
         self.filename = filename
-        self.reassembled_data = b''
+        self.payload_size = payload_size
+        self.selective_repeat = selective_repeat
+        self.directory = directory
+        self.streams = streams
+        self.metrics_path = metrics_path
+        self.fec_group = fec_group
+        self.resume = resume
+        self.dedup = dedup
+        self.compression = compression
+        self.batch = batch
+        self.prefetch = prefetch
+        self.record_path = record_path
 
     def run(self):
         """Execute the client's main functionality."""
-        if self.query:
+        if self.batch and self.query:
+            self.query_batch()
+        elif self.batch:
+            self.send_batch()
+        elif self.query:
             self.query_file()
         else:
             self.send_file()
@@ -33,39 +84,148 @@ class Client:
         """
         Sends a file to the server.
 
-        Reads the file specified by the class variable filename into a byte string,
-        sends the filename to the server, and then sends the file data to the server.
-        Ensures that an ACK is received from the server after sending the filename.
+        Streams the file specified by the class variable filename to the server without reading it into
+        memory, in a single session whose setup packet carries the filename and size.
+        With more than one stream the file is split into byte ranges that are uploaded in parallel, and
+        not compressed, since the server writes every range at its offset.
         """
+        total_size = os.path.getsize(self.filename)
+        if self.streams > 1 and total_size > 0:
+            self.send_ranges(total_size)
+            return
 
-        with open(self.filename, 'rb') as f:
-            data = f.read()
-
-        sender = Sender(self.server_ip, self.server_port, self.listen_port, filename)
+        compression = self.compression
+        if compression != COMPRESSION_NONE and not should_compress(self.filename, compression):
+            logger.info("%s does not compress well, sending it uncompressed", self.filename)
+            compression = COMPRESSION_NONE
+        sender = Sender(self.server_ip, self.server_port, self.listen_port, FileSource(self.filename),
+                        payload_size=self.payload_size, selective_repeat=self.selective_repeat,
+                        metrics_path=self.metrics_path, name=self.filename, fec_group=self.fec_group,
+                        dedup=self.dedup, compression=compression, record_path=self.record_path)
         sender.send_data()
-        sender.sock.close()
 
-        sender = Sender(self.server_ip, self.server_port, self.listen_port, data)
+    def send_ranges(self, total_size):
+        """
+        Uploads a file as byte ranges over parallel flows, one process with its own socket per range.
+
+        Checksumming is CPU-bound, so separate processes let the flows use separate cores. The first flow
+        listens on the client's port and the others on ports chosen by the OS. The ranges announce a shared
+        upload ID, so the server puts them together and only replaces its file once every range arrived.
+
+        :param total_size: Size of the file.
+        :raises RuntimeError: If any range could not be uploaded.
+        """
+        range_size = -(-total_size // self.streams)
+        upload_id = new_session_id()
+        processes = []
+        for i, offset in enumerate(range(0, total_size, range_size)):
+            listen_port = self.listen_port if i == 0 else 0
+            length = min(range_size, total_size - offset)
+            processes.append(multiprocessing.Process(target=self.send_range,
+                                                     args=(offset, length, total_size, upload_id, listen_port)))
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise RuntimeError(f"Uploading {self.filename} failed in at least one stream")
+
+    def send_range(self, offset, length, total_size, upload_id, listen_port):
+        """
+        Uploads one byte range of the file in a session announcing its name and position.
+
+        :param offset: First byte of the range.
+        :param length: Number of bytes in the range.
+        :param total_size: Size of the file.
+        :param upload_id: ID shared by the ranges of the upload.
+        :param listen_port: Port to send from.
+        """
+        metrics_path = f"{self.metrics_path}.{offset}" if self.metrics_path else None
+        record_path = f"{self.record_path}.{offset}" if self.record_path else None
+        name = range_filename(self.filename, offset, length, total_size, upload_id)
+        sender = Sender(self.server_ip, self.server_port, listen_port, FileSource(self.filename, offset, length),
+                        payload_size=self.payload_size, selective_repeat=self.selective_repeat,
+                        metrics_path=metrics_path, name=name, fec_group=self.fec_group, record_path=record_path)
         sender.send_data()
 
-    def query_file(self):
+    def send_batch(self):
         """
-        Queries the server for a file and writes the received data to a local file.
+        Uploads every file named by the batch patterns in a single session.
+
+        The files are sent back to back as one batch.BatchSource stream, each preceded by its name and size,
+        so the setup and the end of the session are paid once for the whole batch.
 
-        Sends a filename to the server, receives the file data from the server,
-        and writes the received data to a local file with the same name as the queried file.
-        Ensures that an ACK is received from the server after sending the filename, and sends
-        ACKs as the data is received from the Server
+        :raises FileNotFoundError: If a pattern matches nothing.
         """
-        sender = Sender(self.server_ip, self.server_port, self.listen_port, filename+"QUERY")
+        source = BatchSource(expand_paths(self.batch), self.prefetch)
+        sender = Sender(self.server_ip, self.server_port, self.listen_port, source, payload_size=self.payload_size,
+                        selective_repeat=self.selective_repeat, metrics_path=self.metrics_path,
+                        name=f"{source.file_count} files", fec_group=self.fec_group, compression=self.compression,
+                        batch=True, record_path=self.record_path)
+        start = time.monotonic()
         sender.send_data()
-        sender.sock.close()
+        self.report("Sent", source.file_count, source.size, time.monotonic() - start)
 
-        receiver = Receiver(self.listen_port, "127.0.0.1")
+    def query_batch(self):
+        """
+        Downloads every file of the server matching the batch patterns in a single session, unpacking them
+        into the client's directory as they arrive.
+
+        :raises FileNotFoundError: If the server has no file matching a pattern.
+        """
+        sink = BatchSink(self.directory)
+        receiver = Receiver(self.listen_port, "127.0.0.1", max_payload_size=self.payload_size, sink=sink,
+                            metrics_path=self.metrics_path, record_path=self.record_path)
+        start = time.monotonic()
+        try:
+            receiver.request((self.server_ip, self.server_port), "\n".join(self.batch), self.compression, batch=True)
+        except (FileNotFoundError, ConnectionError):
+            receiver.close()
+            raise
         receiver.start_receiving()
-        self.reassembled_data = receiver.reassemble_data()
-        with open("Client_files/" + self.filename, "wb") as f:
-                f.write(self.reassembled_data)
+        self.report("Received", len(sink.files), receiver.total_size, time.monotonic() - start)
+
+    def report(self, verb, files, size, elapsed):
+        """
+        Logs the aggregate rate of a batch.
+
+        :param verb: "Sent" or "Received".
+        :param files: Number of files.
+        :param size: Bytes of the batch stream.
+        :param elapsed: Seconds the session took.
+        """
+        elapsed = max(elapsed, 1e-9)
+        logger.info("%s %d files (%d bytes) in %.3f s: %.1f files/s, %.1f KiB/s", verb, files, size, elapsed,
+                    files / elapsed, size / elapsed / 1024)
+
+    def query_file(self):
+        """
+        Queries the server for a file and writes the received data to a local file.
+
+        The receiver is bound before the query is sent and keeps retransmitting it until the server's
+        sender answers, then writes each payload as it arrives, all in one session. The payloads go to a
+        staging file next to the local file with the same name as the queried file, which only replaces it
+        once the download is complete, so a failed download leaves an existing local file as it was. With
+        resume, the staging file starts as a copy of the local file and an interrupted download keeps it with
+        its checkpoint, so running the query again only fetches the missing blocks.
+
+        :raises FileNotFoundError: If the server cannot send the file.
+        """
+        sink = FileSink(os.path.join(self.directory, os.path.basename(self.filename)), keep=self.resume,
+                        replace=True)
+        receiver = Receiver(self.listen_port, "127.0.0.1", max_payload_size=self.payload_size, sink=sink,
+                            metrics_path=self.metrics_path, resume=self.resume, record_path=self.record_path)
+        try:
+            receiver.request((self.server_ip, self.server_port), self.filename, self.compression)
+            receiver.start_receiving()
+        except (FileNotFoundError, ConnectionError, KeyboardInterrupt):
+            receiver.close()
+            sink.discard()
+            raise
+        if receiver.complete():
+            sink.commit()
+        else:
+            sink.discard()
 
 
 if __name__ == "__main__":
@@ -75,8 +235,27 @@ if __name__ == "__main__":
     parser.add_argument("--server-port", type=int, required=True, help="Client's sending port")
     parser.add_argument("--server-ip", type=str, default="127.0.0.1", help="IP address of the server")
     parser.add_argument("-q", "--query", action="store_true", help="Query mode")
+    parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE, help="Payload bytes per packet")
+    parser.add_argument("--selective-repeat", action="store_true", help="Use Selective Repeat for uploads")
+    parser.add_argument("--directory", type=str, default=FILES_DIRECTORY, help="Directory to store downloaded files")
+    parser.add_argument("--streams", type=int, default=1, help="Parallel flows to split an upload into")
+    parser.add_argument("--fec", type=int, default=0, help="Upload packets per XOR parity packet, 0 disables FEC")
+    parser.add_argument("--compress", choices=COMPRESSION_MODES, default=COMPRESSION_NONE,
+                        help="Compress uploads and ask for compressed downloads, unless the file is already compressed")
+    parser.add_argument("--resume", action="store_true", help="Checkpoint downloads so interrupted ones resume")
+    parser.add_argument("--dedup", action="store_true", help="Only send the blocks of an upload the server lacks")
+    parser.add_argument("--batch", nargs="+", default=None, metavar="PATTERN",
+                        help="Files, globs and directories to send in one session, with -q globs on the server")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_WORKERS,
+                        help="Threads reading the next files of a batch upload ahead, 0 disables prefetching")
+    parser.add_argument("--metrics", type=str, default=None, help="Write the transfer metrics to this JSON file")
+    parser.add_argument("--record", type=str, default=None, help="Record packet events to this ring file")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="DEBUG logs every packet")
     args = parser.parse_args()
+    configure_logging(args.log_level)
 
-    filename = input("Enter the filename: ")
-    client = Client(args.listen_port, args.server_port, args.server_ip, args.query, filename)
+    filename = None if args.batch else input("Enter the filename: ")
+    client = Client(args.listen_port, args.server_port, args.server_ip, args.query, filename, args.payload_size,
+                    args.selective_repeat, args.directory, args.streams, args.metrics, args.fec, args.resume,
+                    args.dedup, args.compress, args.batch, args.prefetch, args.record)
     client.run()
\ No newline at end of file
@@ -0,0 +1,198 @@
+import lzma
+import mmap
+import os
+import tempfile
+import zlib
+from packet import FLAG_ZLIB, FLAG_LZMA
+
+# Constants
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_LZMA = "lzma"
+COMPRESSION_MODES = (COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_LZMA)
+DEFAULT_LEVELS = {COMPRESSION_ZLIB: 6, COMPRESSION_LZMA: 1}  # zlib level and lzma preset
+CHUNK_SIZE = 1024 * 1024  # Bytes fed to the compressor at a time
+SAMPLE_SIZE = 64 * 1024  # Bytes of a file compressed to decide whether the whole file is worth compressing
+MIN_SAVING = 0.1  # Smallest fraction of the sample compression has to save
+COMPRESSED_EXTENSIONS = frozenset((".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".zst", ".7z", ".rar",
+                                   ".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".webm",
+                                   ".docx", ".xlsx", ".pptx", ".jar", ".whl"))
+COMPRESSION_FLAGS = {COMPRESSION_ZLIB: FLAG_ZLIB, COMPRESSION_LZMA: FLAG_LZMA}  # Setup flag of each compression
+
+
+def compression_flags(mode):
+    """Setup flags announcing a compression.
+
+    :param mode: One of COMPRESSION_MODES.
+    :return: The flag of the compression, 0 for COMPRESSION_NONE.
+    """
+    return COMPRESSION_FLAGS.get(mode, 0)
+
+
+def compression_from_flags(flags):
+    """Read the compression announced by setup flags.
+
+    :param flags: Flags of a setup packet.
+    :return: One of COMPRESSION_MODES.
+    """
+    for mode, flag in COMPRESSION_FLAGS.items():
+        if flags & flag:
+            return mode
+    return COMPRESSION_NONE
+
+
+def make_compressor(mode, level=None):
+    """Create a streaming compressor.
+
+    :param mode: COMPRESSION_ZLIB or COMPRESSION_LZMA.
+    :param level: zlib level or lzma preset, by default DEFAULT_LEVELS.
+    :return: Object with compress(data) and flush().
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[mode]
+    if mode == COMPRESSION_ZLIB:
+        return zlib.compressobj(level)
+    if mode == COMPRESSION_LZMA:
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError(f"Unknown compression {mode!r}")
+
+
+def make_decompressor(mode):
+    """Create a streaming decompressor.
+
+    :param mode: COMPRESSION_ZLIB or COMPRESSION_LZMA.
+    :return: Object with decompress(data).
+    """
+    if mode == COMPRESSION_ZLIB:
+        return zlib.decompressobj()
+    if mode == COMPRESSION_LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown compression {mode!r}")
+
+
+def should_compress(path, mode, level=None):
+    """Decide whether a file is worth compressing before it is sent.
+
+    Files with the extension of an already compressed format are skipped without reading them. Otherwise
+    the first SAMPLE_SIZE bytes are compressed, and the file is only compressed if that saves at least
+    MIN_SAVING of them.
+
+    :param path: Path of the file.
+    :param mode: One of COMPRESSION_MODES.
+    :param level: zlib level or lzma preset, by default DEFAULT_LEVELS.
+    :return: True if the file should be sent compressed.
+    """
+    if mode == COMPRESSION_NONE or os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if not sample:
+        return False
+    compressor = make_compressor(mode, level)
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressed <= len(sample) * (1 - MIN_SAVING)
+
+
+class CompressedSource:
+    """Compresses a source into a temporary file and sends it from there.
+
+    The setup packet announces the size of the data before the first packet is sent, and retransmissions
+    read the data again at any offset, so the source is compressed completely, CHUNK_SIZE bytes at a time
+    through a streaming compressor, before the transfer starts. The temporary file is mapped like a
+    stream.FileSource and deleted when the source is closed. Memory use stays bounded whatever the size of
+    the source.
+    """
+    def __init__(self, source, mode, level=None):
+        """Compress a source.
+
+        :param source: Source to compress, with size, read(offset, length) and close(). It is closed once
+            compressed.
+        :param mode: COMPRESSION_ZLIB or COMPRESSION_LZMA.
+        :param level: zlib level or lzma preset, by default DEFAULT_LEVELS.
+        """
+        self.compression = mode
+        self.original_size = source.size
+        self.version = getattr(source, "version", 0)
+        self.inode = getattr(source, "inode", 0)
+        self.file = tempfile.TemporaryFile()
+        compressor = make_compressor(mode, level)
+        try:
+            for offset in range(0, source.size, CHUNK_SIZE):
+                self.file.write(compressor.compress(source.read(offset, CHUNK_SIZE)))
+            self.file.write(compressor.flush())
+        finally:
+            source.close()
+        self.file.flush()
+        self.size = self.file.tell()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def read(self, offset, length):
+        """Return part of the compressed data.
+
+        :param offset: Byte offset to read from.
+        :param length: Number of bytes to read, fewer are returned at the end of the data.
+        :return: Zero-copy slice of the mapping.
+        """
+        return self.view[offset:offset + length]
+
+    def close(self):
+        """Unmap and delete the temporary file."""
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+class DecompressingSink:
+    """Decompresses received payloads in order and writes the result to another sink.
+
+    A streaming decompressor needs its input in order, so payloads that arrive ahead of a gap are held until
+    it is filled, at most a window of them. The decompressed data is written sequentially to the wrapped sink.
+    """
+    def __init__(self, sink, mode):
+        """Wrap a sink.
+
+        :param sink: Sink the decompressed data is written to, e.g. a stream.FileSink.
+        :param mode: COMPRESSION_ZLIB or COMPRESSION_LZMA.
+        """
+        self.sink = sink
+        self.decompressor = make_decompressor(mode)
+        self.pending = {}
+        self.received = 0  # Compressed bytes fed to the decompressor
+        self.output = 0  # Decompressed bytes written to the sink
+
+    def preallocate(self, size):
+        """Nothing to reserve, the decompressed size is only known at the end.
+
+        :param size: Size of the compressed data in bytes.
+        """
+
+    def write(self, offset, payload):
+        """Decompress a payload if it is the next one, along with the held payloads that follow it.
+
+        :param offset: Byte offset of the payload in the compressed data.
+        :param payload: Payload of a data packet.
+        """
+        if offset != self.received:
+            if offset > self.received:
+                self.pending[offset] = bytes(payload)
+            return
+        while payload is not None:
+            data = self.decompressor.decompress(payload)
+            if data:
+                self.sink.write(self.output, data)
+                self.output += len(data)
+            self.received += len(payload)
+            payload = self.pending.pop(self.received, None)
+
+    def getvalue(self):
+        """Return the decompressed data held by a stream.MemorySink.
+
+        :return: The decompressed data.
+        """
+        return self.sink.getvalue()
+
+    def close(self):
+        """Close the wrapped sink, telling it the decompressed size so a sink that keeps its file trims it."""
+        self.sink.preallocate(self.output)
+        self.sink.close()
@@ -0,0 +1,226 @@
+import time
+
+# Constants
+INITIAL_WINDOW = 10  # Packets, RFC 6928
+MIN_WINDOW = 1  # Packets, the window after a retransmission timeout
+MIN_SSTHRESH = 2  # Packets
+MAX_WINDOW = 4096  # Packets, default cap of the congestion window
+RENO_BETA = 0.5  # Multiplicative decrease of AIMD
+CUBIC_BETA = 0.7  # Multiplicative decrease of CUBIC, RFC 8312 section 4.5
+CUBIC_C = 0.4  # Scaling constant of the cubic window growth, RFC 8312 section 5
+CONGESTION_FIXED = "fixed"
+CONGESTION_AIMD = "aimd"
+CONGESTION_CUBIC = "cubic"
+CONGESTION_MODES = (CONGESTION_FIXED, CONGESTION_AIMD, CONGESTION_CUBIC)
+
+
+class CongestionControl:
+    """Base class of the congestion controllers, which size the Sender's window in packets.
+
+    The Sender reports acknowledged packets, losses it infers from selective ACKs and retransmission
+    timeouts. A loss only reduces the window once per window of data: losses of packets sent before the
+    previous reduction took effect belong to the same congestion event. Every change of the window can be
+    recorded in trace as (seconds since start, cwnd, ssthresh, event) to tune a controller against the
+    Intermediate's impairment profiles.
+    """
+    name = None
+
+    def __init__(self, max_window=MAX_WINDOW, trace=False, clock=time.monotonic):
+        """Initialize the controller.
+
+        :param max_window: Upper bound of the window, e.g. the receiver's buffer.
+        :param trace: Record every change of the window in trace.
+        :param clock: Function returning the current time in seconds, for the trace.
+        """
+        self.max_window = max_window
+        self.clock = clock
+        self.cwnd = float(self.initial_window())
+        self.ssthresh = float("inf")
+        self.recovery_point = 0
+        self.start = clock()
+        self.trace = [] if trace else None
+        self.record("start")
+
+    def initial_window(self):
+        """Window of a new transfer.
+
+        :return: INITIAL_WINDOW packets, at most max_window.
+        """
+        return min(INITIAL_WINDOW, self.max_window)
+
+    def window(self):
+        """Number of packets the Sender may have in flight.
+
+        :return: The congestion window rounded down, between 1 and max_window.
+        """
+        return max(1, min(int(self.cwnd), self.max_window))
+
+    def ack(self, acked, now, srtt=None):
+        """Grow the window for newly acknowledged packets.
+
+        :param acked: Number of packets acknowledged by this ACK.
+        :param now: Monotonic time the ACK arrived.
+        :param srtt: Smoothed RTT in seconds, None before the first sample.
+        """
+        if acked <= 0:
+            return
+        self.on_ack(acked, now, srtt)
+        self.cwnd = min(self.cwnd, float(self.max_window))
+        self.record("ack")
+
+    def loss(self, seq_num, next_seq_num, now):
+        """Shrink the window after a loss detected without a timeout, e.g. a fast retransmit.
+
+        :param seq_num: Sequence number of the lost packet.
+        :param next_seq_num: Next sequence number the Sender will send, ends the recovery period.
+        :param now: Monotonic time the loss was detected.
+        """
+        if seq_num < self.recovery_point:
+            return
+        self.recovery_point = next_seq_num
+        self.on_loss(now)
+        self.record("loss")
+
+    def timeout(self, next_seq_num, now):
+        """Collapse the window after a retransmission timeout of the oldest outstanding packet.
+
+        :param next_seq_num: Next sequence number the Sender will send, ends the recovery period.
+        :param now: Monotonic time the timer expired.
+        """
+        self.recovery_point = next_seq_num
+        self.on_timeout(now)
+        self.record("timeout")
+
+    def on_ack(self, acked, now, srtt):
+        """Controller specific window growth, see ack."""
+
+    def on_loss(self, now):
+        """Controller specific window reduction, see loss."""
+
+    def on_timeout(self, now):
+        """Controller specific window reduction, see timeout."""
+
+    def record(self, event):
+        """Append the current window to the trace, if tracing.
+
+        :param event: What changed the window.
+        """
+        if self.trace is not None:
+            self.trace.append((self.clock() - self.start, self.cwnd, self.ssthresh, event))
+
+
+class FixedWindow(CongestionControl):
+    """No congestion control: the window stays at max_window, the behaviour of the original Sender."""
+    name = CONGESTION_FIXED
+
+    def initial_window(self):
+        return self.max_window
+
+
+class Aimd(CongestionControl):
+    """Slow start followed by additive increase, multiplicative decrease, as in TCP Reno (RFC 5681).
+
+    Below ssthresh the window grows by one packet per acknowledged packet, doubling every RTT. Above it
+    the window grows by one packet per RTT. A loss halves the window and a timeout restarts slow start
+    from one packet.
+    """
+    name = CONGESTION_AIMD
+
+    def on_ack(self, acked, now, srtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += acked / self.cwnd
+
+    def on_loss(self, now):
+        self.ssthresh = max(self.cwnd * RENO_BETA, MIN_SSTHRESH)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, now):
+        self.ssthresh = max(self.cwnd * RENO_BETA, MIN_SSTHRESH)
+        self.cwnd = MIN_WINDOW
+
+
+class Cubic(CongestionControl):
+    """CUBIC congestion control (RFC 8312).
+
+    After a loss the window grows along a cubic curve of the time since the loss: quickly back up to the
+    window where the loss happened, flat around it, then probing faster beyond it. The growth does not
+    depend on the RTT, and never falls below what AIMD would reach in the same time.
+    """
+    name = CONGESTION_CUBIC
+
+    def __init__(self, max_window=MAX_WINDOW, trace=False, clock=time.monotonic):
+        super().__init__(max_window, trace, clock)
+        self.w_max = 0.0
+        self.w_last_max = 0.0
+        self.epoch_start = None
+        self.origin = 0.0
+        self.k = 0.0
+        self.w_est = 0.0
+
+    def on_ack(self, acked, now, srtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+            return
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / CUBIC_C) ** (1 / 3)
+                self.origin = self.w_max
+            else:
+                self.k = 0.0
+                self.origin = self.cwnd
+            self.w_est = self.cwnd
+        t = now - self.epoch_start + (srtt or 0.0)
+        target = self.origin + CUBIC_C * (t - self.k) ** 3
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+        self.w_est += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * acked / self.cwnd
+        self.cwnd = max(self.cwnd, self.w_est)
+
+    def on_loss(self, now):
+        self.epoch_start = None
+        if self.cwnd < self.w_last_max:
+            self.w_last_max = self.cwnd
+            self.w_max = self.cwnd * (1 + CUBIC_BETA) / 2
+        else:
+            self.w_last_max = self.cwnd
+            self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * CUBIC_BETA, MIN_SSTHRESH)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, now):
+        self.on_loss(now)
+        self.cwnd = MIN_WINDOW
+
+
+CONTROLLERS = {controller.name: controller for controller in (FixedWindow, Aimd, Cubic)}
+
+
+def make_congestion_control(name, max_window=MAX_WINDOW, trace=False, clock=time.monotonic):
+    """Create a congestion controller by name.
+
+    :param name: One of CONGESTION_MODES.
+    :param max_window: Upper bound of the window.
+    :param trace: Record every change of the window.
+    :param clock: Function returning the current time in seconds, for the trace.
+    :return: A CongestionControl instance.
+    """
+    if name not in CONTROLLERS:
+        raise ValueError(f"Unknown congestion control {name!r}")
+    return CONTROLLERS[name](max_window, trace, clock)
+
+
+def write_trace(trace, path):
+    """Write a congestion window trace as CSV.
+
+    :param trace: List of (seconds, cwnd, ssthresh, event) as recorded by a CongestionControl.
+    :param path: File to write.
+    """
+    with open(path, "w") as f:
+        f.write("seconds,cwnd,ssthresh,event\n")
+        for seconds, cwnd, ssthresh, event in trace:
+            f.write(f"{seconds:.6f},{cwnd:.3f},{ssthresh:.3f},{event}\n")
@@ -0,0 +1,111 @@
+# Constants
+MAX_FEC_GROUP = 255  # Largest number of data packets protected by one parity packet, fits the setup field
+
+
+def xor_payloads(payloads):
+    """XOR payloads of different lengths, the shorter ones padded with zeros at the end.
+
+    Payloads are read as little-endian integers, so padding at the end costs nothing and the XOR of a whole
+    payload is done by one C loop instead of one Python operation per byte.
+
+    :param payloads: Iterable of bytes-like payloads.
+    :return: The XOR as an int, turn it back into bytes with to_bytes(length, 'little').
+    """
+    parity = 0
+    for payload in payloads:
+        parity ^= int.from_bytes(payload, 'little')
+    return parity
+
+
+class ParityDecoder:
+    """Rebuilds a lost data packet from the parity packet of its group.
+
+    The sender follows every group_size data packets, and the last packet of the data, with a parity packet
+    of type packet.TYPE_PARITY whose sequence number is the group number and whose payload is the XOR of the
+    group's payloads. For every group this keeps the XOR of the payloads received so far, their number and
+    the XOR of their sequence numbers. Once the parity packet has arrived and exactly one packet of the
+    group is missing, XORing the parity with the payloads received gives the missing payload, and XORing
+    the group's sequence numbers with the received ones gives its sequence number.
+
+    The Receiver passes every data packet it stores for the first time to add and every parity packet to
+    add_parity, and calls release as its next expected sequence number advances so the state of groups it
+    has completely received is dropped.
+    """
+    def __init__(self, group_size, payload_size, total_size):
+        """Initialize the decoder of one session.
+
+        :param group_size: Data packets per parity packet, as negotiated during session setup.
+        :param payload_size: Negotiated payload size.
+        :param total_size: Number of bytes in the session, gives the length of the last packet.
+        """
+        self.group_size = group_size
+        self.payload_size = payload_size
+        self.total_size = total_size
+        self.total_packets = (total_size + payload_size - 1) // payload_size
+        self.groups = {}  # Group number to [packets received, XOR of their sequence numbers, XOR of payloads, parity]
+        self.released = 0  # Groups below this one are complete at the receiver and ignored
+
+    def add(self, seq_num, payload):
+        """Account for a data packet received for the first time.
+
+        :param seq_num: Sequence number of the packet.
+        :param payload: Its payload.
+        :return: Tuple (sequence number, payload) of a packet rebuilt with it, or None.
+        """
+        group = seq_num // self.group_size
+        if group < self.released:
+            return None
+        state = self.groups.get(group)
+        if state is None:
+            state = self.groups[group] = [0, 0, 0, None]
+        state[0] += 1
+        state[1] ^= seq_num
+        state[2] ^= int.from_bytes(payload, 'little')
+        return self.recover(group, state)
+
+    def add_parity(self, group, payload):
+        """Account for the parity packet of a group.
+
+        :param group: Group number, the sequence number of the parity packet.
+        :param payload: Its payload.
+        :return: Tuple (sequence number, payload) of a packet rebuilt with it, or None.
+        """
+        if group < self.released or group * self.group_size >= self.total_packets:
+            return None
+        state = self.groups.get(group)
+        if state is None:
+            state = self.groups[group] = [0, 0, 0, None]
+        if state[3] is not None:
+            return None
+        state[3] = int.from_bytes(payload, 'little')
+        return self.recover(group, state)
+
+    def recover(self, group, state):
+        """Rebuild the missing packet of a group if exactly one is missing and the parity has arrived.
+
+        :param group: Group number.
+        :param state: State of the group.
+        :return: Tuple (sequence number, payload) of the rebuilt packet, or None.
+        """
+        start = group * self.group_size
+        end = min(start + self.group_size, self.total_packets)
+        received, seq_xor, payload_xor, parity = state
+        if received == end - start:
+            del self.groups[group]
+            return None
+        if parity is None or received != end - start - 1:
+            return None
+        missing = seq_xor
+        for seq_num in range(start, end):
+            missing ^= seq_num
+        length = min(self.payload_size, self.total_size - missing * self.payload_size)
+        return missing, (parity ^ payload_xor).to_bytes(self.payload_size, 'little')[:length]
+
+    def release(self, expected_seq_num):
+        """Drop the state of every group received completely.
+
+        :param expected_seq_num: Next sequence number the receiver expects, every packet before it was received.
+        """
+        while (self.released + 1) * self.group_size <= expected_seq_num:
+            self.groups.pop(self.released, None)
+            self.released += 1
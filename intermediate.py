@@ -1,131 +1,324 @@
 import socket
-import struct
 import argparse
+import heapq
+import logging
 import random
+import selectors
+import time
+from metrics import configure_logging, LOG_LEVELS
+from netmodel import NetworkProfile, Link, load_trace, DEFAULT_BURST, DEFAULT_QUEUE_LIMIT, DEFAULT_REORDER_DELAY
+from packet import enlarge_socket_buffers, peek_seq, BUFFER_SIZE, HEADER_SIZE, TYPE_SEQ, SACK, TYPE_SACK
+from recorder import (TraceRecorder, NODE_INTERMEDIATE, EVENT_FORWARD, EVENT_DROP, EVENT_CORRUPT, EVENT_REORDER,
+                      DROP_LOSS, DROP_QUEUE, DROP_SOCKET, TOWARDS_SENDER, TOWARDS_RECEIVER)
 
 # Constants
-BUFFER_SIZE = 2048
-END_OF_TRANSMISSION = 0xFFFFFF
-TIMEOUT_TIME = 20
+TIMEOUT_TIME = 20  # Seconds without any packet before the intermediate exits
+FLOW_TIMEOUT = 30  # Seconds without a packet in either direction before a flow is dropped
+BATCH_SIZE = 256  # Datagrams drained from one socket before the other ready sockets get a turn
+DEFAULT_PROB = 0.1  # Probability of an impairment enabled on the command line without a value
+
+logger = logging.getLogger(__name__)
+
+
+def recorded_seq(packet):
+    """Read the type and sequence number of a packet as the packet trace records them.
+
+    :param packet: Raw datagram, at least a header long.
+    :return: Tuple (type, sequence number), the next expected sequence number for a selective ACK.
+    """
+    packet_type, seq_num = TYPE_SEQ.unpack_from(packet)
+    if packet_type == TYPE_SACK and len(packet) >= HEADER_SIZE + SACK.size:
+        seq_num = SACK.unpack_from(packet, HEADER_SIZE)[0]
+    return packet_type, seq_num
+
+
+class Flow:
+    """One sender talking to the receiver through the intermediate.
+
+    Each flow has its own upstream socket towards the receiver, so whatever the receiver sends back arrives
+    on that socket and belongs to this flow, however many flows share the receiver's port. Each flow also
+    has its own random generator, seeded from the intermediate's seed and the flow's number, so its
+    impairments are the same on every run with the same seed, and a netmodel.Link per direction.
+    """
+    def __init__(self, number, address, upstream, seed, profile, buckets):
+        """Initialize the flow.
+
+        :param number: Position of the flow in the order flows were opened.
+        :param address: Address of the sender, where packets from the receiver are relayed to.
+        :param upstream: Non-blocking socket connected to the receiver.
+        :param seed: Seed of the intermediate, or None for unseeded impairments.
+        :param profile: netmodel.NetworkProfile of the intermediate.
+        :param buckets: Tuple of the shared bottlenecks towards the receiver and towards the senders.
+        """
+        self.number = number
+        self.address = address
+        self.upstream = upstream
+        self.random = random.Random(None if seed is None else f"{seed}:{number}")
+        self.data_link = Link(profile, self.random, buckets[0], True)
+        self.ack_link = Link(profile, self.random, buckets[1], False)
+        self.last_activity = time.monotonic()
+        self.forwarded = 0
+        self.dropped = 0
+
+    def counters(self):
+        """Summarize what happened to the flow's packets, for the log.
+
+        :return: Description of the counters.
+        """
+        links = (self.data_link, self.ack_link)
+        return (f"{self.forwarded} forwarded, {sum(link.lost for link in links)} lost, "
+                f"{sum(link.tail_dropped for link in links) + self.dropped} dropped at a full queue, "
+                f"{sum(link.corrupted for link in links)} corrupted, {self.data_link.reordered} reordered")
+
 
 class Intermediate:
     """
     An intermediate node that simulates network impairments such as
-    packet loss, reordering, and corruption between a sender and a receiver.
+    packet loss, reordering, corruption, delay and a bandwidth limit between senders and a receiver.
+
+    Senders send to the intermediate's port instead of the receiver's. The first packet from a new address
+    opens a Flow in the flow table, and everything the receiver sends back on the flow's upstream socket
+    is relayed to that address, so any number of senders, or clients of a Server, can share one
+    intermediate. All sockets are non-blocking and driven by one selector; every ready socket is drained
+    in batches of up to BATCH_SIZE datagrams into a single preallocated buffer. The flow's Link decides
+    when each packet is released; packets due at once are sent straight from that buffer, delayed ones are
+    copied into a heap ordered by release time. Impairments that are not configured cost no random
+    draws, so an unimpaired relay costs two system calls per packet.
     """
-    def __init__(self, listen_port, sender_ip, sender_port, receiver_ip, receiver_port, loss_prob, reorder_prob, corrupt_prob):
+    def __init__(self, listen_port, receiver_ip, receiver_port, profile=None, seed=None, listen_ip="127.0.0.1",
+                 idle_timeout=TIMEOUT_TIME, record_path=None):
         """
         Initializes the Intermediate node with specified network parameters.
 
-        :param listen_port: Port number to listen on for incoming packets.
-        :param sender_ip: IP address of the sender.
-        :param sender_port: Port number of the sender.
+        :param listen_port: Port number to listen on for packets from senders.
         :param receiver_ip: IP address of the receiver.
         :param receiver_port: Port number of the receiver.
-        :param loss_prob: If loss prob will be active.
-        :param reorder_prob: If reorder prob will be active.
-        :param corrupt_prob: If corrupt prob will be active.
+        :param profile: netmodel.NetworkProfile with the impairments to apply, by default none.
+        :param seed: Seed of the random impairments, so runs can be reproduced. None seeds from the OS.
+        :param listen_ip: IP address to listen on.
+        :param idle_timeout: Seconds without any packet before start returns.
+        :param record_path: Record the fate of every packet, forwarded, dropped, corrupted or reordered, in a
+            recorder.TraceRecorder ring file at this path, for analyze.py.
         """
-        self.sender_ip = sender_ip
-        self.sender_port = sender_port
-        self.receiver_ip = receiver_ip
-        self.receiver_port = receiver_port
-        self.loss_prob = loss_prob
-        self.reorder_prob = reorder_prob
-        self.corrupt_prob = corrupt_prob
+        self.receiver_address = (receiver_ip, receiver_port)
+        self.profile = profile if profile is not None else NetworkProfile()
+        self.buckets = (self.profile.make_bucket(), self.profile.make_bucket())
+        self.seed = seed
+        self.idle_timeout = idle_timeout
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind(("127.0.0.1", listen_port))  # Listen on receiver's port
-        self.sock.settimeout(TIMEOUT_TIME)
-        self.socket_closed = False
-        self.packet_buffer = []
+        self.sock.bind((listen_ip, listen_port))
+        self.sock.setblocking(False)
+        enlarge_socket_buffers(self.sock)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.flows = {}
+        self.flow_count = 0
+        self.pending = []
+        self.pending_count = 0
+        self.buffer = bytearray(BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.running = False
+        self.log_packets = logger.isEnabledFor(logging.DEBUG)
+        self.recorder = None if record_path is None else TraceRecorder(record_path, NODE_INTERMEDIATE)
 
     def start(self):
         """
-        Starts the intermediate node, continuously handling packets until terminated.
+        Starts the intermediate node, relaying packets until it is idle for idle_timeout seconds or stopped.
         """
-        print("Intermediate started.")
-        while True:
-            # Check for packets from sender
-            self.handlePackets()
-            if self.socket_closed:
-                print(f"Socket closed. Exiting...")
-                break
-            
-    def handlePackets(self):
+        logger.info("Intermediate started")
+        self.running = True
+        last_packet = time.monotonic()
+        try:
+            while self.running:
+                events = self.selector.select(self.poll_timeout())
+                now = time.monotonic()
+                self.release(now)
+                for key, _ in events:
+                    if key.data is None:
+                        self.relay_from_senders()
+                    else:
+                        self.relay_from_receiver(key.data)
+                if events or self.pending:
+                    last_packet = now
+                elif now - last_packet > self.idle_timeout:
+                    logger.info("No packet for %d seconds. Exiting...", self.idle_timeout)
+                    break
+                self.expire_flows(now)
+        finally:
+            self.close()
+
+    def stop(self):
+        """Ask start to return, it does so within a second."""
+        self.running = False
+
+    def poll_timeout(self):
+        """Return how long to wait for a datagram.
+
+        :return: Seconds until the earliest delayed packet is due, at most one second.
+        """
+        if not self.pending:
+            return 1.0
+        return min(1.0, max(0.0, self.pending[0][0] - time.monotonic()))
+
+    def relay_from_senders(self):
+        """Drain a batch of packets from senders and relay them upstream through their flows."""
+        for _ in range(BATCH_SIZE):
+            try:
+                size, address = self.sock.recvfrom_into(self.buffer)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            flow = self.flows.get(address)
+            if flow is None:
+                flow = self.open_flow(address)
+            self.forward(flow, flow.data_link, self.view[:size], True)
+
+    def relay_from_receiver(self, flow):
+        """Drain a batch of packets the receiver sent back on a flow and relay them to its sender.
+
+        :param flow: Flow whose upstream socket is readable.
         """
-        Handles incoming packets, distinguishing between data and ACK packets.
+        for _ in range(BATCH_SIZE):
+            try:
+                size = flow.upstream.recv_into(self.buffer)
+            except (BlockingIOError, ConnectionRefusedError):
+                return
+            self.forward(flow, flow.ack_link, self.view[:size], False)
+
+    def open_flow(self, address):
+        """Add a sender to the flow table.
+
+        :param address: Address of the sender.
+        :return: The new Flow.
         """
-        try:
-            packet, addr = self.sock.recvfrom(BUFFER_SIZE)
-            if addr[1] == self.sender_port:
-                self.handle_data_packet(packet)
-            else:
-                self.handle_ack_packet(packet)
-        except (socket.timeout, ConnectionResetError):
-            self.sock.close()
-            self.socket_closed = True
-    
-    def handle_data_packet(self, packet):
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        upstream.setblocking(False)
+        enlarge_socket_buffers(upstream)
+        upstream.connect(self.receiver_address)
+        flow = self.flows[address] = Flow(self.flow_count, address, upstream, self.seed, self.profile, self.buckets)
+        self.flow_count += 1
+        self.selector.register(upstream, selectors.EVENT_READ, flow)
+        logger.info("New flow %d from %s", flow.number, address)
+        return flow
+
+    def forward(self, flow, link, packet, upstream):
+        """Pass a packet through a link of its flow and send it, now or once its delay has passed.
+
+        :param flow: Flow of the packet.
+        :param link: Link of the direction the packet travels in.
+        :param packet: The packet, only valid until the next receive.
+        :param upstream: True for a packet from the sender to the receiver.
         """
-        Handles incoming data packets, simulating packet loss, corruption, and reordering as specified.
+        now = time.monotonic()
+        flow.last_activity = now
+        if self.recorder is not None:
+            counters = (link.lost, link.corrupted, link.reordered)
+        outcome = link.transmit(packet, now)
+        if self.recorder is not None:
+            self.record_fate(flow, link, packet, outcome, counters, now, upstream)
+        if outcome is None:
+            if self.log_packets:
+                logger.debug("Flow %d: packet %s dropped (simulated)", flow.number, peek_seq(packet))
+            return
+        release, packet = outcome
+        if release <= now:
+            self.send(flow, packet, upstream)
+            return
+        if self.log_packets:
+            logger.debug("Flow %d: packet %s delayed by %.3f s (simulated)", flow.number, peek_seq(packet),
+                         release - now)
+        heapq.heappush(self.pending, (release, self.pending_count, bytes(packet), flow, upstream))
+        self.pending_count += 1
 
-        :param packet: The incoming data packet.
+    def record_fate(self, flow, link, packet, outcome, counters, now, upstream):
+        """Record what a link did to a packet in the packet trace.
+
+        :param flow: Flow of the packet.
+        :param link: Link the packet went through.
+        :param packet: The packet as it arrived.
+        :param outcome: What Link.transmit returned for it.
+        :param counters: Lost, corrupted and reordered counters of the link before the packet went through it.
+        :param now: Monotonic arrival time.
+        :param upstream: True for a packet from the sender to the receiver.
         """
-        original_packet = packet
-        if random.random() < self.loss_prob:
-            print("\nData packet lost (simulated).")
-            print(f"Contents of dropped packet: {original_packet}\n")
+        if len(packet) < HEADER_SIZE:
+            return
+        packet_type, seq_num = recorded_seq(packet)
+        size = len(packet) - HEADER_SIZE
+        direction = TOWARDS_RECEIVER if upstream else TOWARDS_SENDER
+        number = flow.number & 0xFFFF
+        lost, corrupted, reordered = counters
+        if outcome is None:
+            reason = DROP_LOSS if link.lost > lost else DROP_QUEUE
+            self.recorder.record(EVENT_DROP, packet_type, seq_num, size, reason, direction, number)
             return
-        if random.random() < self.corrupt_prob:
-            print("\nData packet corrupted (simulated).")
-            packet = self.corrupt_packet(packet)
-            print(f"Original packet: {original_packet}")
-            print(f"Corrupted packet: {packet}")
-            print(f"Difference: {bytes([a ^ b for a, b in zip(original_packet, packet)])}\n")
-        if random.random() < self.reorder_prob:
-            print("\nData packet reordered (simulated).")
-            self.packet_buffer.append(packet)
-            if len(self.packet_buffer) > 1:
-                # Swap last two packets
-                print(f"Original packet buffer: {self.packet_buffer}")
-                self.packet_buffer[-1], self.packet_buffer[-2] = self.packet_buffer[-2], self.packet_buffer[-1]
-                print(f"Reordered packet buffer: {self.packet_buffer}\n")
-            for pkt in self.packet_buffer:
-                self.sock.sendto(pkt, (self.receiver_ip, self.receiver_port))
-            self.packet_buffer.clear()
-        else:
-            self.sock.sendto(packet, (self.receiver_ip, self.receiver_port))
-
-    def handle_ack_packet(self, packet):
+        delay = int((outcome[0] - now) * 1e6)
+        if link.corrupted > corrupted:
+            self.recorder.record(EVENT_CORRUPT, packet_type, seq_num, size, 0, direction, number)
+        if link.reordered > reordered:
+            self.recorder.record(EVENT_REORDER, packet_type, seq_num, size, delay, direction, number)
+        self.recorder.record(EVENT_FORWARD, packet_type, seq_num, size, delay, direction, number)
+
+    def release(self, now):
+        """Send the delayed packets that are due, in the order of their release times.
+
+        :param now: Monotonic time.
         """
-        Handles incoming ACK packets, simulating packet loss and corruption as specified.
+        pending = self.pending
+        while pending and pending[0][0] <= now:
+            _, _, packet, flow, upstream = heapq.heappop(pending)
+            self.send(flow, packet, upstream)
+
+    def send(self, flow, packet, upstream):
+        """Send a packet on, dropping it if the socket buffer is full as a router would.
 
-        :param packet: The incoming ACK packet.
+        :param flow: Flow of the packet.
+        :param packet: Packet to send.
+        :param upstream: True to send it to the receiver, False to the flow's sender.
         """
-        original_packet = packet
-        if random.random() < self.loss_prob:
-            print("\nACK lost (simulated).")
-            print(f"Contents of dropped packet: {packet}\n")
+        try:
+            if upstream:
+                flow.upstream.send(packet)
+            else:
+                self.sock.sendto(packet, flow.address)
+            flow.forwarded += 1
+        except (BlockingIOError, ConnectionRefusedError):
+            flow.dropped += 1
+            if self.recorder is not None and len(packet) >= HEADER_SIZE:
+                packet_type, seq_num = recorded_seq(packet)
+                self.recorder.record(EVENT_DROP, packet_type, seq_num, len(packet) - HEADER_SIZE, DROP_SOCKET,
+                                     TOWARDS_RECEIVER if upstream else TOWARDS_SENDER, flow.number & 0xFFFF)
+
+    def expire_flows(self, now):
+        """Drop flows that have been idle for FLOW_TIMEOUT seconds and have no delayed packet left.
+
+        :param now: Monotonic time.
+        """
+        if self.pending:
             return
-        if random.random() < self.corrupt_prob:
-            print("\nACK corrupted (simulated).")
-            packet = self.corrupt_packet(packet)
-            print(f"Original packet: {original_packet}")
-            print(f"Corrupted packet: {packet}")
-            print(f"Difference: {bytes([a ^ b for a, b in zip(original_packet, packet)])}\n")
-        self.sock.sendto(packet, (self.sender_ip, self.sender_port))
-
-    def corrupt_packet(self, packet):
-        """Corrupts a packet by randomly flipping bits in it.
-
-        :param packet: The packet to corrupt.
-        :return: The corrupted packet.
+        for address, flow in list(self.flows.items()):
+            if now - flow.last_activity > FLOW_TIMEOUT:
+                self.close_flow(flow)
+                del self.flows[address]
+
+    def close_flow(self, flow):
+        """Log the flow's counters and close its upstream socket.
+
+        :param flow: Flow to close.
         """
-        packet = bytearray(packet)
-        for i in range(len(packet)):
-            if random.random() < 0.1: 
-                packet[i] ^= 0xFF 
-        return bytes(packet)
+        logger.info("Flow %d from %s: %s", flow.number, flow.address, flow.counters())
+        self.selector.unregister(flow.upstream)
+        flow.upstream.close()
+
+    def close(self):
+        """Close every flow, the listening socket and the packet trace."""
+        for flow in self.flows.values():
+            self.close_flow(flow)
+        self.flows.clear()
+        self.selector.close()
+        self.sock.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
 
 def main():
@@ -133,22 +326,43 @@ def main():
     Parses command-line arguments and starts the intermediate node.
     """
     parser = argparse.ArgumentParser(description="UDP Intermediate Simulator")
-    parser.add_argument("--sender-port", type=int, required=True, help="Sender's port number")
     parser.add_argument("--receiver-port", type=int, required=True, help="Receiver's port number")
+    parser.add_argument("--receiver-ip", type=str, default="127.0.0.1", help="Receiver's IP address")
     parser.add_argument("--listen-port", type=int, required=True, help="This intermediate's port number")
-    parser.add_argument("--loss", action="store_true", help="Enable packet loss simulation")
-    parser.add_argument("--reorder", action="store_true", help="Enable packet reordering simulation")
-    parser.add_argument("--corrupt", action="store_true", help="Enable packet corruption simulation")
+    parser.add_argument("--loss", type=float, nargs="?", const=DEFAULT_PROB, default=0.0,
+                        help=f"Enable packet loss simulation, with the given probability or {DEFAULT_PROB}")
+    parser.add_argument("--reorder", type=float, nargs="?", const=DEFAULT_PROB, default=0.0,
+                        help=f"Enable packet reordering simulation, with the given probability or {DEFAULT_PROB}")
+    parser.add_argument("--corrupt", type=float, nargs="?", const=DEFAULT_PROB, default=0.0,
+                        help=f"Enable packet corruption simulation, with the given probability or {DEFAULT_PROB}")
+    parser.add_argument("--reorder-delay", type=float, default=DEFAULT_REORDER_DELAY * 1000,
+                        help="Milliseconds a reordered packet is held back")
+    parser.add_argument("--delay", type=float, default=0.0, help="One-way propagation delay in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Largest deviation from the delay in milliseconds")
+    parser.add_argument("--rate", type=float, default=None, help="Bandwidth cap in Mbit/s, shared by all flows")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help="Bytes sent back to back at the cap after idling")
+    parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE_LIMIT,
+                        help="Packets queued for the bandwidth cap before tail drop")
+    parser.add_argument("--gilbert", type=float, nargs=2, metavar=("P", "R"), default=None,
+                        help="Bursty Gilbert-Elliott loss: P moves from the good to the bad state, R back")
+    parser.add_argument("--gilbert-loss", type=float, nargs=2, metavar=("GOOD", "BAD"), default=(0.0, 1.0),
+                        help="Loss probabilities in the good and bad Gilbert-Elliott states")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Replay per-packet losses and delays from this file, one 'loss' or delay in ms per line")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the random impairments, for reproducible runs")
+    parser.add_argument("--record", type=str, default=None, help="Record the fate of every packet to this ring file")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="DEBUG logs every simulated impairment")
 
     args = parser.parse_args()
+    configure_logging(args.log_level)
 
-    # Set probabilities for each type of network impairment
-    loss_prob = 0.1 if args.loss else 0.0
-    reorder_prob = 0.1 if args.reorder else 0.0
-    corrupt_prob = 0.1 if args.corrupt else 0.0
-
-    intermediate = Intermediate(args.listen_port, "127.0.0.1", args.sender_port, "127.0.0.1", args.receiver_port, loss_prob, reorder_prob, corrupt_prob)
+    profile = NetworkProfile(args.loss, args.reorder, args.corrupt, args.delay / 1000, args.jitter / 1000,
+                             None if args.rate is None else args.rate * 1e6 / 8, args.burst, args.queue,
+                             None if args.gilbert is None else tuple(args.gilbert) + tuple(args.gilbert_loss),
+                             None if args.trace is None else load_trace(args.trace), args.reorder_delay / 1000)
+    intermediate = Intermediate(args.listen_port, args.receiver_ip, args.receiver_port, profile, args.seed,
+                                record_path=args.record)
     intermediate.start()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
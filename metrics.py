@@ -0,0 +1,175 @@
+import json
+import logging
+import math
+import time
+
+# Constants
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+LOG_FORMAT = "%(asctime)s %(name)s %(levelname)s %(message)s"
+GOODPUT_INTERVAL = 0.1  # Seconds of delivered data per goodput histogram sample
+
+
+def configure_logging(level="INFO"):
+    """Send log records of the given level and above to stderr, for the command-line tools.
+
+    Per-packet messages are logged at DEBUG. The nodes check whether DEBUG is enabled once, when they are
+    created, so at INFO and above they cost a single attribute test per packet.
+
+    :param level: One of LOG_LEVELS.
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+class Histogram:
+    """Histogram with power-of-two buckets, so recording a value is O(1) and the buckets cover any range.
+
+    A value v lands in the bucket whose upper bound is the smallest power of two >= v.
+    """
+    def __init__(self):
+        """Initialize an empty histogram."""
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """Add a value.
+
+        :param value: Non-negative value to add.
+        """
+        exponent = math.frexp(value)[1] if value > 0 else -1074
+        if value > 0 and value == 2.0 ** (exponent - 1):
+            exponent -= 1
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self):
+        """Summarize the histogram.
+
+        :return: Dict with count, mean, min, max and the bucket counts keyed by their upper bound.
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {f"{2.0 ** exponent:.6g}": self.buckets[exponent] for exponent in sorted(self.buckets)},
+        }
+
+
+class TransferMetrics:
+    """Counters and histograms of one transfer, kept by the Sender and the Receiver.
+
+    Counters are plain attributes incremented inline on the packet path. RTT samples and goodput, measured
+    over GOODPUT_INTERVAL windows of delivered data, are kept in histograms. to_dict and dump_json export
+    everything at the end of the transfer.
+    """
+    def __init__(self, role, clock=time.monotonic):
+        """Initialize the metrics.
+
+        :param role: "sender" or "receiver", recorded in the export.
+        :param clock: Function returning the current time in seconds, a simnet.SimClock in simulations.
+        """
+        self.role = role
+        self.clock = clock
+        self.start_time = clock()
+        self.end_time = None
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.retransmissions = 0
+        self.fast_retransmissions = 0
+        self.timeouts = 0
+        self.acks_sent = 0
+        self.acks_received = 0
+        self.checksum_failures = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.parity_packets = 0
+        self.recovered = 0
+        self.bytes_delivered = 0
+        self.rtt = Histogram()
+        self.goodput = Histogram()
+        self.interval_start = self.start_time
+        self.interval_bytes = 0
+
+    def deliver(self, size, now):
+        """Count bytes acknowledged by the receiver (sender side) or delivered in order (receiver side).
+
+        :param size: Number of bytes.
+        :param now: Monotonic time of the delivery.
+        """
+        self.bytes_delivered += size
+        self.interval_bytes += size
+        elapsed = now - self.interval_start
+        if elapsed >= GOODPUT_INTERVAL:
+            self.goodput.record(self.interval_bytes / elapsed)
+            self.interval_start = now
+            self.interval_bytes = 0
+
+    def finish(self):
+        """Mark the end of the transfer, recording the goodput of the last partial interval."""
+        if self.end_time is not None:
+            return
+        self.end_time = self.clock()
+        elapsed = self.end_time - self.interval_start
+        if self.interval_bytes and elapsed > 0:
+            self.goodput.record(self.interval_bytes / elapsed)
+            self.interval_bytes = 0
+
+    def elapsed(self):
+        """Duration of the transfer so far, or in total once finished.
+
+        :return: Seconds.
+        """
+        end = self.end_time if self.end_time is not None else self.clock()
+        return end - self.start_time
+
+    def to_dict(self):
+        """Export the metrics.
+
+        :return: JSON-serializable dict.
+        """
+        elapsed = self.elapsed()
+        return {
+            "role": self.role,
+            "elapsed": elapsed,
+            "packets_sent": self.packets_sent,
+            "packets_received": self.packets_received,
+            "retransmissions": self.retransmissions,
+            "fast_retransmissions": self.fast_retransmissions,
+            "timeouts": self.timeouts,
+            "acks_sent": self.acks_sent,
+            "acks_received": self.acks_received,
+            "checksum_failures": self.checksum_failures,
+            "duplicates": self.duplicates,
+            "out_of_order": self.out_of_order,
+            "parity_packets": self.parity_packets,
+            "recovered": self.recovered,
+            "bytes_delivered": self.bytes_delivered,
+            "goodput": self.bytes_delivered / elapsed if elapsed > 0 else None,
+            "rtt_histogram": self.rtt.to_dict(),
+            "goodput_histogram": self.goodput.to_dict(),
+        }
+
+    def summary(self):
+        """One-line summary for the log.
+
+        :return: The summary.
+        """
+        elapsed = self.elapsed()
+        return (f"{self.bytes_delivered} bytes in {elapsed:.3f} s, {self.packets_sent} packets sent, "
+                f"{self.packets_received} received, {self.acks_sent + self.acks_received} ACKs, "
+                f"{self.retransmissions} retransmitted, {self.checksum_failures} checksum failures, "
+                f"{self.duplicates} duplicates")
+
+    def dump_json(self, path):
+        """Write the metrics to a JSON file.
+
+        :param path: File to write.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
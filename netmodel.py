@@ -0,0 +1,259 @@
+from collections import deque
+
+# Constants
+DEFAULT_QUEUE_LIMIT = 100  # Packets waiting for the bottleneck before tail drop
+DEFAULT_BURST = 16 * 1024  # Bytes the token bucket can send back to back after an idle period
+DEFAULT_REORDER_DELAY = 0.01  # Seconds a reordered packet is held back so later packets overtake it
+CORRUPT_BYTE_FRACTION = 0.1  # Fraction of the bytes of a corrupted packet that are flipped
+TRACE_LOSS = "loss"  # Trace line of a lost packet, other lines hold a delay in milliseconds
+
+
+class BernoulliLoss:
+    """Independent losses with a fixed probability."""
+    def __init__(self, prob):
+        """Initialize the loss model.
+
+        :param prob: Probability that a packet is lost.
+        """
+        self.prob = prob
+
+    def lost(self, rng):
+        """Decide the fate of the next packet.
+
+        :param rng: random.Random of the flow.
+        :return: True if the packet is lost.
+        """
+        return rng.random() < self.prob
+
+
+class GilbertElliott:
+    """Bursty losses from a two-state Markov chain.
+
+    The link moves from the good to the bad state with probability p and back with probability r before
+    every packet, then loses the packet with the loss probability of its state. The mean burst lasts 1 / r
+    packets and the link spends p / (p + r) of the time in the bad state. With loss_good 0 and loss_bad 1
+    this is the simple Gilbert model.
+    """
+    def __init__(self, p, r, loss_good=0.0, loss_bad=1.0):
+        """Initialize the loss model in the good state.
+
+        :param p: Probability of moving from the good to the bad state.
+        :param r: Probability of moving from the bad to the good state.
+        :param loss_good: Loss probability in the good state.
+        :param loss_bad: Loss probability in the bad state.
+        """
+        self.p = p
+        self.r = r
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.bad = False
+
+    def lost(self, rng):
+        """Advance the chain and decide the fate of the next packet.
+
+        :param rng: random.Random of the flow.
+        :return: True if the packet is lost.
+        """
+        self.bad = rng.random() >= self.r if self.bad else rng.random() < self.p
+        loss = self.loss_bad if self.bad else self.loss_good
+        return loss > 0 and rng.random() < loss
+
+
+class TokenBucket:
+    """A bottleneck of a given rate with a finite FIFO queue and tail drop.
+
+    Tokens accumulate at rate bytes per second up to burst bytes while the link is idle. A packet departs
+    as soon as the packets queued before it have departed and enough tokens have accumulated to pay for
+    it. A packet arriving while queue_limit packets wait for their departure is dropped.
+    """
+    def __init__(self, rate, burst=DEFAULT_BURST, queue_limit=DEFAULT_QUEUE_LIMIT):
+        """Initialize the bucket full.
+
+        :param rate: Bytes per second.
+        :param burst: Largest number of tokens, in bytes.
+        :param queue_limit: Packets that may wait for departure.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.queue_limit = queue_limit
+        self.tokens = float(burst)
+        self.updated = None
+        self.departures = deque()
+
+    def admit(self, size, now):
+        """Queue a packet.
+
+        :param size: Size of the packet in bytes.
+        :param now: Monotonic arrival time.
+        :return: Monotonic departure time, or None if the queue is full and the packet is dropped.
+        """
+        departures = self.departures
+        while departures and departures[0] <= now:
+            departures.popleft()
+        if len(departures) >= self.queue_limit:
+            return None
+        start = max(now, departures[-1]) if departures else now
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (start - self.updated) * self.rate)
+        departure = start
+        if self.tokens < size:
+            departure += (size - self.tokens) / self.rate
+            self.tokens = 0.0
+        else:
+            self.tokens -= size
+        self.updated = departure
+        departures.append(departure)
+        return departure
+
+
+def load_trace(path):
+    """Read a loss and delay trace.
+
+    Every line describes one packet: TRACE_LOSS if it is lost, otherwise its one-way delay in milliseconds.
+    Blank lines and lines starting with # are skipped.
+
+    :param path: Trace file.
+    :return: List with None for every lost packet and the delay in seconds of every other one.
+    """
+    trace = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            trace.append(None if line == TRACE_LOSS else float(line) / 1000)
+    if not trace:
+        raise ValueError(f"Trace {path} describes no packets")
+    return trace
+
+
+class Link:
+    """One direction of one flow through the Intermediate.
+
+    transmit decides the fate of every packet in order: loss (Bernoulli, Gilbert-Elliott or the trace),
+    corruption, the shared bottleneck, then propagation delay with jitter or the delay of the trace, and an
+    extra delay for packets picked for reordering. Jitter and reordering let later packets overtake
+    earlier ones, since the Intermediate releases packets in the order of their release times.
+    """
+    def __init__(self, profile, rng, bucket, reorder):
+        """Initialize the link.
+
+        :param profile: NetworkProfile describing the link.
+        :param rng: random.Random of the flow.
+        :param bucket: TokenBucket of the bottleneck shared by every flow in this direction, or None.
+        :param reorder: Apply the reorder probability of the profile, only done for data packets.
+        """
+        self.profile = profile
+        self.rng = rng
+        self.bucket = bucket
+        self.reorder_prob = profile.reorder_prob if reorder else 0.0
+        self.loss = profile.make_loss_model()
+        self.trace_position = 0
+        self.lost = 0
+        self.tail_dropped = 0
+        self.corrupted = 0
+        self.reordered = 0
+
+    def transmit(self, packet, now):
+        """Decide what happens to a packet.
+
+        :param packet: The packet.
+        :param now: Monotonic arrival time.
+        :return: Tuple (release time, packet), with the packet replaced by a corrupted copy if it was
+            corrupted, or None if the packet is dropped.
+        """
+        profile = self.profile
+        rng = self.rng
+        delay = profile.delay
+        if profile.trace is not None:
+            delay = profile.trace[self.trace_position]
+            self.trace_position = (self.trace_position + 1) % len(profile.trace)
+            if delay is None:
+                self.lost += 1
+                return None
+        elif self.loss is not None and self.loss.lost(rng):
+            self.lost += 1
+            return None
+        if profile.corrupt_prob and rng.random() < profile.corrupt_prob:
+            self.corrupted += 1
+            packet = self.corrupt(packet)
+        release = now
+        if self.bucket is not None:
+            release = self.bucket.admit(len(packet), now)
+            if release is None:
+                self.tail_dropped += 1
+                return None
+        if profile.jitter and profile.trace is None:
+            delay = max(0.0, delay + rng.uniform(-profile.jitter, profile.jitter))
+        if self.reorder_prob and rng.random() < self.reorder_prob:
+            self.reordered += 1
+            delay += profile.reorder_delay
+        return release + delay, packet
+
+    def corrupt(self, packet):
+        """Flip every bit of randomly chosen bytes of a packet.
+
+        :param packet: The packet to corrupt.
+        :return: The corrupted copy.
+        """
+        packet = bytearray(packet)
+        for i in self.rng.sample(range(len(packet)), max(1, int(len(packet) * CORRUPT_BYTE_FRACTION))):
+            packet[i] ^= 0xFF
+        return packet
+
+
+class NetworkProfile:
+    """Impairments the Intermediate applies, the same in both directions except reordering.
+
+    Every flow gets its own Link per direction with its own loss model state and trace position. The
+    bandwidth cap is a bottleneck shared by all flows: one TokenBucket per direction, made by make_bucket.
+    """
+    def __init__(self, loss_prob=0.0, reorder_prob=0.0, corrupt_prob=0.0, delay=0.0, jitter=0.0, rate=None,
+                 burst=DEFAULT_BURST, queue_limit=DEFAULT_QUEUE_LIMIT, gilbert=None, trace=None,
+                 reorder_delay=DEFAULT_REORDER_DELAY):
+        """Describe the link.
+
+        :param loss_prob: Probability that a packet is lost, ignored with gilbert or trace.
+        :param reorder_prob: Probability that a data packet is held back by reorder_delay.
+        :param corrupt_prob: Probability that a packet has bytes flipped.
+        :param delay: One-way propagation delay in seconds.
+        :param jitter: Largest deviation from the delay in seconds, drawn uniformly.
+        :param rate: Bandwidth cap in bytes per second, None for no cap.
+        :param burst: Token bucket size in bytes.
+        :param queue_limit: Packets that may wait for the bottleneck before tail drop.
+        :param gilbert: Tuple (p, r, loss_good, loss_bad) of Gilbert-Elliott bursty loss.
+        :param trace: Loss and delay trace as returned by load_trace, replayed in a loop. Replaces loss_prob,
+            gilbert, delay and jitter.
+        :param reorder_delay: Extra delay in seconds of reordered packets.
+        """
+        self.loss_prob = loss_prob
+        self.reorder_prob = reorder_prob
+        self.corrupt_prob = corrupt_prob
+        self.delay = delay
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.queue_limit = queue_limit
+        self.gilbert = gilbert
+        self.trace = trace
+        self.reorder_delay = reorder_delay
+
+    def make_loss_model(self):
+        """Create the loss model of one link.
+
+        :return: GilbertElliott or BernoulliLoss, or None if packets are never lost at random.
+        """
+        if self.gilbert is not None:
+            return GilbertElliott(*self.gilbert)
+        if self.loss_prob:
+            return BernoulliLoss(self.loss_prob)
+        return None
+
+    def make_bucket(self):
+        """Create the bottleneck of one direction.
+
+        :return: TokenBucket, or None without a bandwidth cap.
+        """
+        if self.rate is None:
+            return None
+        return TokenBucket(self.rate, self.burst, self.queue_limit)
@@ -0,0 +1,336 @@
+import os
+import socket
+import struct
+import zlib
+
+# Constants
+HEADER = struct.Struct('!BQH')  # Packet type, sequence number and checksum
+HEADER_SIZE = HEADER.size
+TYPE_SEQ = struct.Struct('!BQ')  # Packet type and sequence number, the part of the header the checksum covers
+SETUP = struct.Struct('!IBQIHBQ')  # Setup: payload size, flags, data size, session ID, window, FEC group, data version
+SACK = struct.Struct('!Q')  # Selective ACK payload: next expected sequence number, followed by a bitmap
+MAX_DATAGRAM_SIZE = 65507  # Largest UDP payload over IPv4
+MAX_PAYLOAD_SIZE = MAX_DATAGRAM_SIZE - HEADER_SIZE
+DEFAULT_PAYLOAD_SIZE = 1400  # Keeps datagrams inside a 1500 byte Ethernet MTU
+BUFFER_SIZE = HEADER_SIZE + MAX_PAYLOAD_SIZE
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # Kernel socket buffers large enough for a window of big datagrams
+TYPE_DATA = 0  # Data packet, numbered from 0
+TYPE_SETUP = 1  # Session setup, sequence number 0
+TYPE_EOT = 2  # End of transmission, numbered after the last data packet
+TYPE_ACK = 3  # Cumulative ACK of the data packet it numbers, or of the EOT packet
+TYPE_SACK = 4  # Selective ACK, numbered like the packet that triggered it
+TYPE_PARITY = 5  # Parity packet, numbered like its FEC group
+MAX_SACK_BITS = 8 * 1024  # Largest selective ACK bitmap, in packets after the next expected one
+MAX_SETUP_WINDOW = 0xFFFF  # Largest window a setup packet announces
+FLAG_SELECTIVE_REPEAT = 0x01  # Receiver buffers out-of-order packets and answers with selective ACKs
+FLAG_QUERY = 0x02  # Sent by a receiver asking the server to send the named file
+FLAG_NOT_FOUND = 0x04  # Answer of the server to a query for a file it cannot send
+FLAG_BLOCK_HASHES = 0x08  # The sender's setup carries a hash of every block of its data after the name
+FLAG_HAVE_BLOCKS = 0x10  # The receiver's answer carries a bitmap of the blocks it already has
+FLAG_ZLIB = 0x20  # The data is zlib compressed, or a query asks for it to be
+FLAG_LZMA = 0x40  # The data is lzma compressed, or a query asks for it to be
+FLAG_BATCH = 0x80  # The data is a stream of files, see batch.py, or a query names glob patterns
+SUPPORTED_FLAGS = FLAG_SELECTIVE_REPEAT
+CHECKSUM_INET = "inet"
+CHECKSUM_CRC32 = "crc32"
+CHECKSUM_MODES = (CHECKSUM_INET, CHECKSUM_CRC32)
+
+
+def ones_complement_sum(data):
+    """Compute the 16 bit ones' complement sum of the given data, zero padded to an even length.
+
+    Because 2**16 is congruent to 1 modulo 0xFFFF, the sum of the big-endian 16 bit words equals the
+    whole buffer read as one big-endian integer modulo 0xFFFF, which int.from_bytes computes in C
+    without padding or slicing the data.
+
+    :param data: bytes-like object to sum.
+    :return: Ones' complement sum in the range [0, 0xFFFE].
+    """
+    value = int.from_bytes(data, 'big')
+    if len(data) % 2:
+        value <<= 8
+    return value % 0xFFFF
+
+
+def calculate_checksum(data, mode=CHECKSUM_CRC32):
+    """Compute the checksum of the given data
+
+    :param data: data to compute the checksum
+    :param mode: CHECKSUM_INET for the internet checksum or CHECKSUM_CRC32 for a CRC32 folded to 16 bits
+    :return checksum:
+    """
+    if mode == CHECKSUM_CRC32:
+        crc = zlib.crc32(data)
+        return (crc >> 16) ^ (crc & 0xFFFF)
+    return ~ones_complement_sum(data) & 0xFFFF
+
+
+class PacketCodec:
+    """Encodes and decodes packets of the form [type | sequence number | checksum | payload].
+
+    The type byte tells data, setup, EOT, ACK, selective ACK and parity packets apart, so every type numbers
+    its packets from 0 in a 64 bit sequence space that no transfer can exhaust. The checksum covers the type
+    and the sequence number as well as the payload so a corrupted header is detected. Packets are packed into
+    a reusable buffer and payloads are returned as memoryview slices, so neither direction copies the payload.
+
+    Selective ACKs are always protected by CRC32, whatever the checksum mode: a corrupted selective ACK that
+    passes its checksum tells the sender that packets arrived which the receiver never got, and they are then
+    never retransmitted. The ones' complement sum misses common corruptions, such as a pair of bytes flipped
+    from 0x00 to 0xFF, which adds 0xFFFF to the sum.
+    """
+    def __init__(self, payload_size=DEFAULT_PAYLOAD_SIZE, checksum_mode=CHECKSUM_CRC32):
+        """Initialize the codec.
+
+        :param payload_size: Largest payload that will be encoded.
+        :param checksum_mode: One of CHECKSUM_MODES, both ends of a transfer must use the same mode.
+        """
+        if checksum_mode not in CHECKSUM_MODES:
+            raise ValueError(f"Unknown checksum mode {checksum_mode!r}")
+        self.payload_size = payload_size
+        self.checksum_mode = checksum_mode
+        self.buffer = bytearray(HEADER_SIZE + payload_size)
+        self.view = memoryview(self.buffer)
+        self.ack_buffer = bytearray(HEADER_SIZE)
+        self.sack_buffer = bytearray(HEADER_SIZE + SACK.size + MAX_SACK_BITS // 8)
+
+    def checksum(self, packet_type, seq_num, payload):
+        """Compute the checksum of a packet.
+
+        :param packet_type: One of the TYPE_* constants.
+        :param seq_num: Sequence number of the packet.
+        :param payload: Payload of the packet.
+        :return: 16 bit checksum covering all three.
+        """
+        return self.finish_checksum(packet_type, seq_num, self.payload_sum(payload))
+
+    def payload_sum(self, payload):
+        """Compute the part of the checksum that only depends on the payload, which is the expensive part.
+
+        A payload sent again under the same type and sequence number, e.g. by every download of a cached file, can
+        reuse it through finish_checksum.
+
+        :param payload: Payload of the packet.
+        :return: Ones' complement sum of the payload, or its CRC32 in CHECKSUM_CRC32 mode.
+        """
+        if self.checksum_mode == CHECKSUM_CRC32:
+            return zlib.crc32(payload)
+        return ones_complement_sum(payload)
+
+    def finish_checksum(self, packet_type, seq_num, payload_sum):
+        """Compute the checksum of a packet from the sum of its payload.
+
+        The sequence number is a multiple of 2**16 away from the sum of its 16 bit words, so in CHECKSUM_INET
+        mode it is added to the sum whole, like the type.
+
+        :param packet_type: One of the TYPE_* constants.
+        :param seq_num: Sequence number of the packet.
+        :param payload_sum: Sum of the payload, as returned by payload_sum.
+        :return: The same checksum as checksum(packet_type, seq_num, payload).
+        """
+        if self.checksum_mode == CHECKSUM_CRC32:
+            crc = zlib.crc32(TYPE_SEQ.pack(packet_type, seq_num), payload_sum)
+            return (crc >> 16) ^ (crc & 0xFFFF)
+        return ~((payload_sum + packet_type + seq_num) % 0xFFFF) & 0xFFFF
+
+    def encode(self, seq_num, payload, payload_sum=None, packet_type=TYPE_DATA):
+        """Pack a data, EOT or parity packet into the codec's buffer.
+
+        :param seq_num: Sequence number of the packet.
+        :param payload: Payload of the packet, at most payload_size bytes.
+        :param payload_sum: Sum of the payload as returned by payload_sum, computed here if not given.
+        :param packet_type: TYPE_DATA, TYPE_EOT or TYPE_PARITY.
+        :return: memoryview of the encoded packet, only valid until the next call to encode.
+        """
+        end = HEADER_SIZE + len(payload)
+        if payload_sum is None:
+            payload_sum = self.payload_sum(payload)
+        HEADER.pack_into(self.buffer, 0, packet_type, seq_num, self.finish_checksum(packet_type, seq_num, payload_sum))
+        self.view[HEADER_SIZE:end] = payload
+        return self.view[:end]
+
+    def encode_ack(self, seq_num):
+        """Pack an ACK packet for the given sequence number.
+
+        :param seq_num: Sequence number being acknowledged.
+        :return: The encoded ACK packet.
+        """
+        HEADER.pack_into(self.ack_buffer, 0, TYPE_ACK, seq_num, self.finish_checksum(TYPE_ACK, seq_num, 0))
+        return bytes(self.ack_buffer)
+
+    def encode_sack(self, seq_num, next_expected, bitmap):
+        """Pack a selective ACK.
+
+        :param seq_num: Sequence number of the packet whose arrival triggered this ACK.
+        :param next_expected: Every packet below this sequence number has been received.
+        :param bitmap: Bit i is set if packet next_expected + 1 + i has been received, at most MAX_SACK_BITS bits.
+        :return: The encoded selective ACK.
+        """
+        bitmap_size = (bitmap.bit_length() + 7) // 8
+        end = HEADER_SIZE + SACK.size + bitmap_size
+        SACK.pack_into(self.sack_buffer, HEADER_SIZE, next_expected)
+        self.sack_buffer[HEADER_SIZE + SACK.size:end] = bitmap.to_bytes(bitmap_size, 'big')
+        checksum = sack_checksum(seq_num, memoryview(self.sack_buffer)[HEADER_SIZE:end])
+        HEADER.pack_into(self.sack_buffer, 0, TYPE_SACK, seq_num, checksum)
+        return bytes(self.sack_buffer[:end])
+
+    def decode_sack(self, packet):
+        """Unpack and verify a selective ACK.
+
+        :param packet: Raw datagram.
+        :return: Tuple (seq_num, next_expected, bitmap, valid), seq_num is None if the packet is too short.
+        """
+        if len(packet) < HEADER_SIZE + SACK.size:
+            return None, None, 0, False
+        packet_type, seq_num, checksum = HEADER.unpack_from(packet)
+        payload = memoryview(packet)[HEADER_SIZE:]
+        valid = packet_type == TYPE_SACK and sack_checksum(seq_num, payload) == checksum
+        next_expected = SACK.unpack_from(payload)[0]
+        bitmap = int.from_bytes(payload[SACK.size:], 'big')
+        return seq_num, next_expected, bitmap, valid
+
+    def encode_setup(self, payload_size, flags=0, total_size=0, session_id=0, name="", window=0, fec_group=0,
+                     blocks=b"", version=0):
+        """Pack a session setup packet, sent by the sender to propose a payload size and options and by
+        the receiver to answer with what it accepted. The first setup of a session also names the file, so
+        a transfer to or from the Server is a single session.
+
+        :param payload_size: Proposed or accepted payload size.
+        :param flags: Proposed or accepted FLAG_* options.
+        :param total_size: Number of bytes the sender will send, lets the receiver preallocate.
+        :param session_id: ID chosen by the side opening the session and echoed by the other, tells a new
+            session apart from a late duplicate of a finished one.
+        :param name: Name of the file to send or to query.
+        :param window: Most packets the sender keeps in flight, capped at MAX_SETUP_WINDOW. The receiver never
+            holds back the ACK of more packets than that. 0 when unknown.
+        :param fec_group: Data packets per parity packet, proposed or accepted, 0 without forward error correction.
+        :param blocks: Block hashes of the sender with FLAG_BLOCK_HASHES, or the block bitmap of the receiver with
+            FLAG_HAVE_BLOCKS, see checkpoint.py. They follow the name after a NUL byte.
+        :param version: Identifies the version of the sender's data, such as the modification time of its file in
+            ns, so a resuming receiver only trusts the checkpoint of the same version. 0 when unknown.
+        :return: The encoded setup packet.
+        :raises ValueError: If the name and blocks do not fit in a datagram.
+        """
+        payload = SETUP.pack(payload_size, flags, total_size, session_id, min(window, MAX_SETUP_WINDOW), fec_group,
+                             version)
+        payload += name.encode('utf-8')
+        if blocks:
+            payload += b"\0" + blocks
+        if len(payload) > MAX_PAYLOAD_SIZE:
+            raise ValueError(f"Name of {len(name)} characters does not fit in a setup packet")
+        return HEADER.pack(TYPE_SETUP, 0, self.checksum(TYPE_SETUP, 0, payload)) + payload
+
+    def decode(self, packet):
+        """Unpack and verify a packet of any type.
+
+        :param packet: Raw datagram.
+        :return: Tuple (packet_type, seq_num, payload, valid), packet_type and seq_num are None if the packet
+            is shorter than a header.
+        """
+        if len(packet) < HEADER_SIZE:
+            return None, None, None, False
+        packet_type, seq_num, checksum = HEADER.unpack_from(packet)
+        payload = memoryview(packet)[HEADER_SIZE:]
+        return packet_type, seq_num, payload, self.checksum(packet_type, seq_num, payload) == checksum
+
+    def decode_ack(self, packet):
+        """Unpack and verify an ACK packet.
+
+        :param packet: Raw datagram.
+        :return: Tuple (seq_num, valid), seq_num is None if the packet is shorter than a header. A packet of
+            another type is not valid.
+        """
+        if len(packet) < HEADER_SIZE:
+            return None, False
+        packet_type, seq_num, checksum = HEADER.unpack_from(packet)
+        return seq_num, packet_type == TYPE_ACK and self.finish_checksum(TYPE_ACK, seq_num, 0) == checksum
+
+
+def sack_checksum(seq_num, payload):
+    """Compute the checksum of a selective ACK, a CRC32 of its type, sequence number and payload folded to 16 bits.
+
+    :param seq_num: Sequence number of the selective ACK.
+    :param payload: Its payload, the next expected sequence number and the bitmap.
+    :return: 16 bit checksum.
+    """
+    crc = zlib.crc32(payload, zlib.crc32(TYPE_SEQ.pack(TYPE_SACK, seq_num)))
+    return (crc >> 16) ^ (crc & 0xFFFF)
+
+
+def peek_type(packet):
+    """Read the type of a packet without verifying it.
+
+    :param packet: Raw datagram.
+    :return: One of the TYPE_* constants, or None if the packet is shorter than a header.
+    """
+    if len(packet) < HEADER_SIZE:
+        return None
+    return packet[0]
+
+
+def peek_seq(packet):
+    """Read the sequence number of a packet without verifying it.
+
+    :param packet: Raw datagram.
+    :return: The sequence number, or None if the packet is shorter than a header.
+    """
+    if len(packet) < HEADER_SIZE:
+        return None
+    return TYPE_SEQ.unpack_from(packet)[1]
+
+
+def decode_setup(payload):
+    """Read the fields, the name and the blocks carried by a session setup packet.
+
+    :param payload: Payload of a verified setup packet.
+    :return: Tuple (payload_size, flags, total_size, session_id, window, fec_group, version, name, blocks), or
+        None if the payload is malformed.
+    """
+    if len(payload) < SETUP.size:
+        return None
+    name, _, blocks = bytes(payload[SETUP.size:]).partition(b"\0")
+    try:
+        name = name.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return SETUP.unpack_from(payload) + (name, blocks)
+
+
+def new_session_id():
+    """Pick the ID of a new session.
+
+    :return: Random 32 bit integer.
+    """
+    return int.from_bytes(os.urandom(4), 'big')
+
+
+def receive_buffer_size(payload_size):
+    """Size of a receive buffer that holds any packet of a session with the given payload size.
+
+    :param payload_size: Negotiated payload size.
+    :return: Buffer size in bytes, large enough for data packets and selective ACKs.
+    """
+    return HEADER_SIZE + max(payload_size, SACK.size + MAX_SACK_BITS // 8)
+
+
+def clamp_payload_size(payload_size):
+    """Clamp a payload size to what a single UDP datagram can carry.
+
+    :param payload_size: Requested payload size.
+    :return: Payload size between 1 and MAX_PAYLOAD_SIZE.
+    """
+    return max(1, min(payload_size, MAX_PAYLOAD_SIZE))
+
+
+def enlarge_socket_buffers(sock, size=SOCKET_BUFFER_SIZE):
+    """Ask the kernel for larger send and receive buffers so a window of large datagrams is not dropped.
+
+    The kernel silently caps the request at its configured maximum.
+
+    :param sock: UDP socket to configure.
+    :param size: Requested buffer size in bytes.
+    """
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, size)
+        except OSError:
+            pass
@@ -1,44 +1,96 @@
 import socket
-import struct
 import argparse
+import logging
 import time
+from stream import MemorySink, FileSink
+from fec import ParityDecoder
+from checkpoint import Checkpoint
+from compress import DecompressingSink, compression_flags, compression_from_flags, COMPRESSION_NONE
+from batch import BatchSink
+from metrics import TransferMetrics, configure_logging, LOG_LEVELS
+from recorder import (TraceRecorder, NODE_RECEIVER, EVENT_SEND, EVENT_RECEIVE, EVENT_CORRUPT, EVENT_DUPLICATE,
+                      EVENT_RECOVER)
+from rto import INITIAL_RTO, MAX_RTO
+from packet import (PacketCodec, enlarge_socket_buffers, decode_setup, clamp_payload_size, receive_buffer_size,
+                    new_session_id, BUFFER_SIZE, MAX_PAYLOAD_SIZE, MAX_SACK_BITS, TYPE_DATA, TYPE_SETUP, TYPE_EOT, TYPE_ACK,
+                    TYPE_SACK, TYPE_PARITY, FLAG_SELECTIVE_REPEAT, FLAG_QUERY, FLAG_NOT_FOUND, FLAG_BLOCK_HASHES,
+                    FLAG_HAVE_BLOCKS, FLAG_BATCH, CHECKSUM_CRC32, CHECKSUM_MODES)
 
 # Constants
-BUFFER_SIZE = 2048
-END_OF_TRANSMISSION = 0xFFFFFF  # Define EOT constant here
 SOCKET_TIMEOUT = 10
+RECEIVE_TIMEOUT = 2  # Seconds recvfrom waits before checking for an idle sender
+HANDSHAKE_TIMEOUT = 30  # Seconds to keep retrying a query before giving up
+ACK_EVERY = 2  # In-order packets acknowledged by one ACK, as in TCP (RFC 5681 section 4.2)
+ACK_DELAY = 0.005  # Seconds an ACK of fewer packets is held back, well below the sender's minimum RTO
 
-def calculate_checksum(data):
-    """Compute the checksum of the given data
-    
-    :param data: data to compute the checksum
-    :return checksum:
-    """
-    if len(data) % 2:
-        data += b'\x00' 
-    checksum = sum((data[i] << 8) + data[i + 1] for i in range(0, len(data), 2))
-    checksum = (checksum >> 16) + (checksum & 0xFFFF)
-    checksum = ~checksum & 0xFFFF
-    return checksum
+logger = logging.getLogger(__name__)
 
 class Receiver:
-    """Go-Back-N Receiver.
+    """Go-Back-N and Selective Repeat Receiver.
 
     This class listens for incoming packets, verifies their integrity using checksums, 
-    acknowledges received packets, and handles packet loss and reordering.
+    acknowledges received packets, and handles packet loss and reordering. The sender
+    chooses the mode during session setup.
     """
-    def __init__(self, listen_port, receiver_ip):
+    def __init__(self, listen_port, receiver_ip, checksum_mode=CHECKSUM_CRC32, max_payload_size=MAX_PAYLOAD_SIZE,
+                 sink=None, sock=None, metrics_path=None, clock=time.monotonic, ack_every=ACK_EVERY,
+                 ack_delay=ACK_DELAY, resume=False, record_path=None):
         """Initialize the receiver.
 
         :param listen_port: Port number to listen on.
         :param receiver_ip: IP address of the receiver.
+        :param checksum_mode: Checksum algorithm, must match the sender's.
+        :param max_payload_size: Largest payload size this receiver accepts during session setup.
+        :param sink: Where payloads are written as they arrive, e.g. a stream.FileSink. Defaults to a
+            stream.MemorySink read back with reassemble_data.
+        :param sock: Socket shared with other sessions, e.g. by the Server. The owner of the socket then passes
+            every datagram from the sender to handle_packet, instead of calling start_receiving.
+        :param metrics_path: Write the transfer's metrics as JSON to this file when it is closed.
+        :param clock: Function returning the current time in seconds, a simnet.SimClock in simulations.
+        :param ack_every: In-order packets acknowledged together, 1 acknowledges every packet.
+        :param ack_delay: Seconds the ACK of fewer than ack_every in-order packets is held back.
+        :param resume: Keep a checkpoint.Checkpoint next to the file of the sink, a stream.FileSink opened with
+            keep=True, and tell the sender which blocks of the file are already there, from an interrupted
+            transfer or, when the sender announces its block hashes, because they are unchanged.
+        :param record_path: Record every packet received and ACK sent in a recorder.TraceRecorder ring file at
+            this path, for analyze.py.
         """
         self.listen_port = listen_port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind((receiver_ip, listen_port))
-        self.sock.settimeout(2)
+        self.codec = PacketCodec(0, checksum_mode)
+        self.max_payload_size = clamp_payload_size(max_payload_size)
+        self.payload_size = None
+        self.buffer_size = BUFFER_SIZE  # Until the setup, which may carry the block hashes of a large file
+        self.owns_socket = sock is None
+        if self.owns_socket:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((receiver_ip, listen_port))
+            enlarge_socket_buffers(sock)
+            sock.settimeout(RECEIVE_TIMEOUT)
+        self.sock = sock
         self.expected_seq_num = 0
-        self.received_data = {}
+        self.sink = sink if sink is not None else MemorySink()
+        self.total_size = 0
+        self.total_packets = 0
+        self.session_id = None
+        self.name = None
+        self.out_of_order = set()
+        self.selective_repeat = False
+        self.fec = None
+        self.compression = COMPRESSION_NONE
+        self.batch = False
+        self.resume = resume
+        self.checkpoint = None
+        self.have = None
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.unacked = 0
+        self.last_in_order = None
+        self.ack_deadline = None
+        self.clock = clock
+        self.metrics = TransferMetrics("receiver", clock)
+        self.metrics_path = metrics_path
+        self.log_packets = logger.isEnabledFor(logging.DEBUG)
+        self.recorder = None if record_path is None else TraceRecorder(record_path, NODE_RECEIVER, clock=clock)
         self.sender_address = None
         self.shutoff = -1
 
@@ -47,70 +99,402 @@ class Receiver:
 
         This method continuously listens for packets, processes them in sequence,
         and acknowledges correctly received packets. It also handles out-of-order 
-        packets and retransmission scenarios.
+        packets and retransmission scenarios. While an ACK is held back, recvfrom only waits for ack_delay,
+        so the socket timeout is only changed when a delayed ACK is armed or sent.
+
+        The session ends without an EOT once no packet has advanced it for SOCKET_TIMEOUT seconds, whether
+        packets still arrive or the sender has gone silent, e.g. after giving up on a lost EOT.
         """
-        print(f"Receiver listening on port {self.listen_port}...")
+        logger.info("Receiver listening on port %d...", self.listen_port)
 
+        timeout = RECEIVE_TIMEOUT
         while True:
+            wanted = RECEIVE_TIMEOUT if self.ack_deadline is None else self.ack_delay
+            if wanted != timeout:
+                self.sock.settimeout(wanted)
+                timeout = wanted
             try:
-                packet, sender_address = self.sock.recvfrom(BUFFER_SIZE)
-                if time.time() > self.shutoff and self.shutoff != -1:
-                    print(f"No proper packet received for {SOCKET_TIMEOUT} seconds, ending transmission...")
-                    self.sock.close()
-                    return
-                self.sender_address = sender_address
-                seq_num, checksum = struct.unpack('!IH', packet[:6])
-
-                if calculate_checksum(packet[6:]) != checksum:
-                    print(f"Received packet {seq_num} with incorrect checksum, ignoring...")
-                    continue
-
-                checksum = calculate_checksum(packet[6:])
-                
-                if seq_num == END_OF_TRANSMISSION:
-                    print("Received last packet, sending final ACK...")
-                    checksum = calculate_checksum("ACK".encode())
-                    self.sock.sendto(struct.pack('!I', END_OF_TRANSMISSION) + struct.pack('!H', checksum), sender_address)
-                    self.sock.close()
+                packet, sender_address = self.sock.recvfrom(self.buffer_size)
+                if not self.handle_packet(packet, sender_address):
+                    self.close()
                     break
 
-                if seq_num == self.expected_seq_num:
-                    print(f"Received packet {seq_num}, sending ACK...")
-                    checksum = calculate_checksum("ACK".encode())
-                    self.sock.sendto(struct.pack('!I', seq_num) + struct.pack('!H', checksum), sender_address)
-                    self.expected_seq_num += 1
-                    self.received_data[seq_num] = packet[6:] 
-                    self.shutoff = time.time() + SOCKET_TIMEOUT
-
-                elif seq_num > self.expected_seq_num:
-                    print(f"Received out-of-order packet {seq_num}, expected {self.expected_seq_num}")
-                    self.received_data[seq_num] = packet[6:]
-                
-                elif seq_num < self.expected_seq_num:
-                    print(f"Received out-of-order packet {seq_num}, expected {self.expected_seq_num}, resending {seq_num}")
-                    checksum = calculate_checksum("ACK".encode())
-                    self.sock.sendto(struct.pack('!I', seq_num) + struct.pack('!H', checksum), sender_address)
-
             except socket.timeout:
                 pass
+            if self.clock() > self.shutoff and self.shutoff != -1:
+                logger.warning("No proper packet received for %d seconds, ending transmission...", SOCKET_TIMEOUT)
+                self.close()
+                return
+            self.step()
+
+    def step(self):
+        """Send the delayed ACK once ack_delay has passed since the first packet it acknowledges arrived."""
+        if self.ack_deadline is not None and self.clock() >= self.ack_deadline:
+            self.send_ack(self.last_in_order, self.expected_seq_num - 1, self.sender_address)
+
+    def next_deadline(self):
+        """Return when step next has to run even if no datagram arrives.
+
+        :return: Time the delayed ACK is due, or None if no ACK is held back.
+        """
+        return self.ack_deadline
+
+    def request(self, server_address, name, compression=COMPRESSION_NONE, batch=False):
+        """Ask a Server to send a file, opening the session of a download.
+
+        The query is a setup packet carrying the name, this receiver's largest payload size and a new session
+        ID. It is retransmitted with exponential backoff until the Server's Sender answers with its own setup
+        packet for the same session, which is accepted before this returns. The socket is bound before the
+        query is sent, so the Server's first packet cannot arrive before anyone listens.
+
+        :param server_address: Address of the Server.
+        :param name: Name of the file to download.
+        :param compression: Compression the Server may use, one of compress.COMPRESSION_MODES. It decides
+            whether the file is worth compressing.
+        :param batch: Ask for every file matching the glob patterns in name, one per line, as a batch stream
+            for a batch.BatchSink.
+        :raises FileNotFoundError: If the Server cannot send the file.
+        :raises ConnectionError: If the Server does not answer within HANDSHAKE_TIMEOUT seconds.
+        """
+        self.session_id = new_session_id()
+        flags = FLAG_QUERY | compression_flags(compression) | (FLAG_BATCH if batch else 0)
+        query = self.codec.encode_setup(self.max_payload_size, flags, 0, self.session_id, name)
+        timeout = INITIAL_RTO
+        give_up = self.clock() + HANDSHAKE_TIMEOUT
+        try:
+            while self.payload_size is None:
+                if self.clock() > give_up:
+                    raise ConnectionError(f"No answer to the query for {name} from {server_address}")
+                self.sock.sendto(query, server_address)
+                self.sock.settimeout(timeout)
+                timeout = min(2 * timeout, MAX_RTO)
+                try:
+                    while self.payload_size is None:
+                        packet, address = self.sock.recvfrom(self.buffer_size)
+                        packet_type, _, payload, valid = self.codec.decode(packet)
+                        if packet_type == TYPE_SETUP and valid:
+                            setup = decode_setup(payload)
+                            if setup is not None and setup[3] == self.session_id and setup[1] & FLAG_NOT_FOUND:
+                                raise FileNotFoundError(f"{server_address} cannot send {name}")
+                        self.handle_packet(packet, address)
+                except socket.timeout:
+                    pass
+        finally:
+            self.sock.settimeout(RECEIVE_TIMEOUT)
+
+    def handle_packet(self, packet, sender_address):
+        """Process a single datagram and send the acknowledgment it calls for.
+
+        Every payload is written to the sink at its offset as soon as it arrives, so packets that arrive
+        ahead of a gap are not held in memory. When the gap is filled, the cumulative ACK jumps past every
+        packet that arrived early.
+
+        In-order packets are acknowledged ack_every at a time, or ack_delay after the first of them arrived.
+        Anything the sender has to react to quickly is acknowledged at once: a packet that fills a gap or
+        completes the data, a packet ahead of a gap, which also flushes a held-back cumulative ACK, and a
+        duplicate, which means an ACK was lost. In Go-Back-N mode the ACK of a packet ahead of a gap repeats the
+        cumulative ACK, unless no packet has arrived in order yet and there is nothing to acknowledge.
+
+        An EOT packet, numbered after the last data packet, only ends the session once every data packet has
+        arrived, which is always the case for the sender's EOT, so a late EOT of an earlier session from the
+        same address is ignored. Parity packets go to the fec.ParityDecoder, and a packet it rebuilds is
+        handled as if it had arrived. Data packets numbered past the end of the data and packets of any other
+        type are ignored.
+
+        :param packet: Raw datagram.
+        :param sender_address: Address the datagram came from.
+        :return: False once the end of transmission has been acknowledged, True otherwise.
+        """
+        self.sender_address = sender_address
+        packet_type, seq_num, payload, valid = self.codec.decode(packet)
+        if packet_type is None:
+            return True
+        self.metrics.packets_received += 1
+
+        if not valid:
+            self.metrics.checksum_failures += 1
+            if self.log_packets:
+                logger.debug("Received packet %d with incorrect checksum, ignoring...", seq_num)
+            if self.recorder is not None:
+                self.recorder.record(EVENT_CORRUPT, packet_type, seq_num, len(payload))
+            return True
+
+        if self.recorder is not None and packet_type != TYPE_DATA:
+            self.recorder.record(EVENT_RECEIVE, packet_type, seq_num, len(payload), self.expected_seq_num,
+                                 len(self.out_of_order))
+
+        if packet_type == TYPE_SETUP:
+            self.accept_session(payload, sender_address)
+            return True
+
+        if self.payload_size is None:
+            return True
+
+        if packet_type == TYPE_EOT:
+            if seq_num != self.total_packets or self.expected_seq_num < self.total_packets:
+                return True
+            logger.info("Received last packet, sending final ACK...")
+            if self.recorder is not None:
+                self.recorder.record(EVENT_SEND, TYPE_ACK, seq_num, 0, self.expected_seq_num, len(self.out_of_order))
+            self.sock.sendto(self.codec.encode_ack(seq_num), sender_address)
+            self.metrics.acks_sent += 1
+            self.metrics.finish()
+            return False
+
+        if packet_type == TYPE_PARITY:
+            self.metrics.parity_packets += 1
+            if self.fec is not None:
+                self.handle_recovered(self.fec.add_parity(seq_num, payload), sender_address)
+            return True
+
+        if packet_type == TYPE_DATA and seq_num < self.total_packets:
+            self.handle_data(seq_num, payload, sender_address)
+        return True
+
+    def handle_data(self, seq_num, payload, sender_address):
+        """Store a data packet and send the acknowledgment it calls for.
+
+        :param seq_num: Sequence number of the packet.
+        :param payload: Its payload.
+        :param sender_address: Address of the sender.
+        """
+        if self.recorder is not None:
+            duplicate = seq_num < self.expected_seq_num or seq_num in self.out_of_order
+            self.recorder.record(EVENT_DUPLICATE if duplicate else EVENT_RECEIVE, TYPE_DATA, seq_num, len(payload),
+                                 self.expected_seq_num, len(self.out_of_order))
+        if seq_num == self.expected_seq_num:
+            if self.log_packets:
+                logger.debug("Received packet %d, sending ACK...", seq_num)
+            self.sink.write(seq_num * self.payload_size, payload)
+            delivered = self.expected_seq_num * self.payload_size
+            self.expected_seq_num += 1
+            self.advance()
+            now = self.clock()
+            if self.checkpoint is not None:
+                self.checkpoint.add(seq_num * self.payload_size, len(payload), now)
+            self.metrics.deliver(min(self.expected_seq_num * self.payload_size, self.total_size) - delivered, now)
+            self.shutoff = now + SOCKET_TIMEOUT
+            self.last_in_order = seq_num
+            self.unacked += 1
+            if (self.unacked >= self.ack_every or self.expected_seq_num > seq_num + 1
+                    or self.expected_seq_num >= self.total_packets):
+                self.send_ack(seq_num, self.expected_seq_num - 1, sender_address)
+            elif self.ack_deadline is None:
+                self.ack_deadline = now + self.ack_delay
+            if self.fec is not None:
+                self.fec.release(self.expected_seq_num)
+                self.handle_recovered(self.fec.add(seq_num, payload), sender_address)
+
+        elif seq_num > self.expected_seq_num:
+            if self.log_packets:
+                logger.debug("Received out-of-order packet %d, expected %d", seq_num, self.expected_seq_num)
+            duplicate = seq_num in self.out_of_order
+            if duplicate:
+                self.metrics.duplicates += 1
+            else:
+                self.metrics.out_of_order += 1
+                self.sink.write(seq_num * self.payload_size, payload)
+                self.out_of_order.add(seq_num)
+                if self.checkpoint is not None:
+                    self.checkpoint.add(seq_num * self.payload_size, len(payload), self.clock())
+            if self.selective_repeat or self.expected_seq_num:
+                self.send_ack(seq_num, self.expected_seq_num - 1, sender_address)
+            if self.fec is not None and not duplicate:
+                self.handle_recovered(self.fec.add(seq_num, payload), sender_address)
+        
+        elif seq_num < self.expected_seq_num:
+            self.metrics.duplicates += 1
+            if self.log_packets:
+                logger.debug("Received duplicate packet %d, expected %d, resending the ACK", seq_num,
+                             self.expected_seq_num)
+            self.send_ack(seq_num, self.expected_seq_num - 1, sender_address)
+
+    def advance(self):
+        """Move the next expected sequence number past the packets that arrived early and the packets the
+        sender skips because they lie in blocks this receiver already has."""
+        have = self.have
+        while self.expected_seq_num < self.total_packets:
+            if self.expected_seq_num in self.out_of_order:
+                self.out_of_order.discard(self.expected_seq_num)
+            elif have is None or not have.covers(self.expected_seq_num * self.payload_size,
+                                                 min(self.payload_size,
+                                                     self.total_size - self.expected_seq_num * self.payload_size)):
+                break
+            self.expected_seq_num += 1
+
+    def handle_recovered(self, recovered, sender_address):
+        """Handle a packet rebuilt from parity like a packet that arrived.
+
+        :param recovered: Tuple (sequence number, payload) returned by the fec.ParityDecoder, or None.
+        :param sender_address: Address of the sender.
+        """
+        if recovered is None:
+            return
+        seq_num, payload = recovered
+        self.metrics.recovered += 1
+        if self.log_packets:
+            logger.debug("Rebuilt lost packet %d from parity", seq_num)
+        if self.recorder is not None:
+            self.recorder.record(EVENT_RECOVER, TYPE_DATA, seq_num, len(payload), self.expected_seq_num,
+                                 len(self.out_of_order))
+        self.handle_data(seq_num, payload, sender_address)
+
+    def send_ack(self, seq_num, cumulative, sender_address):
+        """Acknowledge a packet.
+
+        In Go-Back-N mode this is a plain ACK of the highest in-order sequence number. In Selective Repeat
+        mode it is a selective ACK carrying the next expected sequence number and a bitmap of the
+        out-of-order packets buffered after it.
+
+        :param seq_num: Sequence number of the packet that triggered the acknowledgment.
+        :param cumulative: Highest sequence number up to which everything has been received.
+        :param sender_address: Address of the sender.
+        """
+        self.metrics.acks_sent += 1
+        self.unacked = 0
+        self.ack_deadline = None
+        if not self.selective_repeat:
+            if self.recorder is not None:
+                self.recorder.record(EVENT_SEND, TYPE_ACK, cumulative, 0, self.expected_seq_num, len(self.out_of_order))
+            self.sock.sendto(self.codec.encode_ack(cumulative), sender_address)
+            return
+        next_expected = self.expected_seq_num
+        bitmap = 0
+        for buffered in self.out_of_order:
+            offset = buffered - next_expected - 1
+            if 0 <= offset < MAX_SACK_BITS:
+                bitmap |= 1 << offset
+        if self.recorder is not None:
+            self.recorder.record(EVENT_SEND, TYPE_SACK, next_expected, 0, next_expected, len(self.out_of_order))
+        self.sock.sendto(self.codec.encode_sack(seq_num, next_expected, bitmap), sender_address)
+
+    def accept_session(self, payload, sender_address):
+        """Answer a session setup with the payload size and options this receiver accepts.
+
+        The first setup fixes the session ID, the payload size and the file name, shrinks the receive buffer
+        to match the payload size and lets the sink preallocate the announced data size. ACKs are coalesced
+        over at most the sender's window, so a stop-and-wait sender is acknowledged at once. Retransmitted setups
+        are answered with the same values, setups of other sessions and queries are ignored.
+
+        A resuming receiver loads the checkpoint of its file if the sender announced the same version of the
+        data, checks every block against the hashes the sender announced, if any, and answers with the bitmap of
+        the blocks it has. The sender then skips the packets
+        in them. Forward error correction is declined in that case, since parity groups would span skipped
+        packets.
+
+        Compressed data is decompressed by a compress.DecompressingSink in front of the sink, and the
+        compression is confirmed in the answer. A compressed session does not resume, since its packets do
+        not map to blocks of the file. A batch of files is confirmed if the sink is a batch.BatchSink, and does
+        not resume either.
+
+        :param payload: Payload of the setup packet.
+        :param sender_address: Address of the sender.
+        """
+        setup = decode_setup(payload)
+        if setup is None:
+            return
+        requested, flags, total_size, session_id, window, fec_group, version, name, blocks = setup
+        if flags & FLAG_QUERY or self.session_id not in (None, session_id):
+            return
+        if self.payload_size is None:
+            self.session_id = session_id
+            self.name = name
+            self.shutoff = self.clock() + SOCKET_TIMEOUT
+            self.payload_size = clamp_payload_size(min(requested, self.max_payload_size))
+            self.buffer_size = receive_buffer_size(self.payload_size)
+            self.selective_repeat = bool(flags & FLAG_SELECTIVE_REPEAT)
+            self.total_size = total_size
+            self.total_packets = (total_size + self.payload_size - 1) // self.payload_size
+            self.compression = compression_from_flags(flags)
+            self.batch = bool(flags & FLAG_BATCH) and isinstance(self.sink, BatchSink)
+            if self.compression != COMPRESSION_NONE:
+                self.sink = DecompressingSink(self.sink, self.compression)
+            elif self.resume and not self.batch:
+                self.load_checkpoint(flags, blocks, version)
+            if blocks:
+                self.buffer_size = BUFFER_SIZE
+            self.sink.preallocate(total_size)
+            if window:
+                self.ack_every = max(1, min(self.ack_every, window))
+            if fec_group and self.have is None:
+                self.fec = ParityDecoder(fec_group, self.payload_size, total_size)
+            mode = "Selective Repeat" if self.selective_repeat else "Go-Back-N"
+            if self.compression != COMPRESSION_NONE:
+                mode += f", {self.compression} compressed"
+            if self.batch:
+                mode += ", batch of files"
+            logger.info("Session setup from %s, using %d byte payloads (%s)", sender_address, self.payload_size, mode)
+        accepted = FLAG_SELECTIVE_REPEAT if self.selective_repeat else 0
+        accepted |= compression_flags(self.compression)
+        if self.batch:
+            accepted |= FLAG_BATCH
+        fec_group = self.fec.group_size if self.fec is not None else 0
+        have = b""
+        if self.have is not None:
+            accepted |= FLAG_HAVE_BLOCKS
+            have = self.have.to_bytes()
+        self.sock.sendto(self.codec.encode_setup(self.payload_size, accepted, 0, self.session_id, fec_group=fec_group,
+                                                 blocks=have), sender_address)
+
+    def load_checkpoint(self, flags, hashes, version):
+        """Find the blocks of the file this receiver already has.
+
+        :param flags: Flags of the sender's setup.
+        :param hashes: Block hashes announced by the sender with FLAG_BLOCK_HASHES.
+        :param version: Version of the data announced by the sender.
+        """
+        self.checkpoint = Checkpoint(self.sink.path, self.total_size, version)
+        blocks = self.checkpoint.blocks
+        resumed = blocks.count()
+        matched = dropped = 0
+        if flags & FLAG_BLOCK_HASHES:
+            matched, dropped = self.checkpoint.match(hashes)
+        if dropped:
+            logger.warning("Dropped %d blocks of the checkpoint of %s that do not match the sender's hashes", dropped,
+                           self.sink.path)
+            resumed -= dropped
+        if not resumed and not matched:
+            return
+        logger.info("Already have %d of %d blocks of %s (%d from the checkpoint, %d unchanged)", resumed + matched,
+                    blocks.block_count, self.sink.path, resumed, matched)
+        self.have = blocks
+        self.advance()
+
+    def complete(self):
+        """Check whether every data packet of the session has arrived.
+
+        :return: True once the session is set up and nothing is missing.
+        """
+        return self.payload_size is not None and self.expected_seq_num >= self.total_packets
+
+    def close(self):
+        """Close the socket unless it is shared, flush the sink, export the metrics and close the packet trace.
+
+        The checkpoint is removed once every packet has arrived, and saved otherwise so the transfer can resume.
+        """
+        if self.owns_socket:
+            self.sock.close()
+        if self.checkpoint is not None:
+            if self.complete():
+                self.checkpoint.remove()
+            else:
+                self.checkpoint.save(self.clock())
+        self.sink.close()
+        self.metrics.finish()
+        if self.metrics_path:
+            self.metrics.dump_json(self.metrics_path)
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def reassemble_data(self):
         """Reassemble received packets into a complete data sequence for files.
 
-        :return: The complete data reconstructed from received packets.
-        """
-        complete_data = b''
-        for i in range(0, len(self.received_data)):
-            complete_data += self.received_data[i]
-        return complete_data 
-    
-    def return_filename(self):
-        """Retrieve the filename from the received data.
+        Only available with the default in-memory sink, a FileSink has already written the data.
 
-        :return: The filename extracted from the first received packet.
+        :return: The complete data reconstructed from received packets.
         """
-        print(self.received_data[0].decode('utf-8'))
-        return self.received_data[0].decode('utf-8')
+        return self.sink.getvalue()
 
 
 def main():
@@ -118,11 +502,29 @@ def main():
     parser = argparse.ArgumentParser(description="UDP Go-Back-N Receiver")
     parser.add_argument("--listen-port", type=int, required=True, help="Port to listen on")
     parser.add_argument("--receiver-ip", type=str, default="127.0.0.1", help="IP address of the receiver")
+    parser.add_argument("--checksum", choices=CHECKSUM_MODES, default=CHECKSUM_CRC32, help="Checksum algorithm")
+    parser.add_argument("--max-payload-size", type=int, default=MAX_PAYLOAD_SIZE, help="Largest payload size to accept")
+    parser.add_argument("--output", type=str, default=None, help="Write the received data to this file as it arrives")
+    parser.add_argument("--metrics", type=str, default=None, help="Write the transfer metrics to this JSON file")
+    parser.add_argument("--resume", action="store_true",
+                        help="Keep a checkpoint next to --output and resume an interrupted transfer into it")
+    parser.add_argument("--ack-every", type=int, default=ACK_EVERY, help="In-order packets acknowledged together")
+    parser.add_argument("--ack-delay", type=float, default=ACK_DELAY * 1000,
+                        help="Milliseconds an ACK of fewer packets is held back")
+    parser.add_argument("--record", type=str, default=None, help="Record packet events to this ring file")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="DEBUG logs every packet")
     
     args = parser.parse_args()
+    configure_logging(args.log_level)
 
-    receiver = Receiver(args.listen_port, args.receiver_ip)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+    sink = FileSink(args.output, keep=args.resume) if args.output else None
+    receiver = Receiver(args.listen_port, args.receiver_ip, args.checksum, args.max_payload_size, sink,
+                        metrics_path=args.metrics, ack_every=args.ack_every, ack_delay=args.ack_delay / 1000,
+                        resume=args.resume, record_path=args.record)
     receiver.start_receiving()
+    logger.info("Transfer complete: %s", receiver.metrics.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+import mmap
+import struct
+import time
+
+# Constants
+MAGIC = b"RDTREC01"
+FILE_HEADER = struct.Struct('<8sIIQdd16s8x')  # Magic, record size, capacity, records written, start times, node
+COUNT = struct.Struct('<Q')  # Records written, updated in place after every record
+COUNT_OFFSET = 16  # Offset of the count in the file header
+RECORD = struct.Struct('<dBBHIQqq')  # Time, event, packet type, flow, size, sequence number, two event values
+DEFAULT_CAPACITY = 1 << 20  # Records kept by a ring file before the oldest are overwritten, 40 MiB
+
+NODE_SENDER = "sender"
+NODE_RECEIVER = "receiver"
+NODE_INTERMEDIATE = "intermediate"
+
+# Events, see the table in the docstring of TraceRecorder
+EVENT_SEND = 0
+EVENT_RETRANSMIT = 1
+EVENT_RECEIVE = 2
+EVENT_CORRUPT = 3
+EVENT_DUPLICATE = 4
+EVENT_RTT = 5
+EVENT_TIMEOUT = 6
+EVENT_RECOVER = 7
+EVENT_FORWARD = 8
+EVENT_DROP = 9
+EVENT_REORDER = 10
+EVENT_NAMES = ("send", "retransmit", "receive", "corrupt", "duplicate", "rtt", "timeout", "recover", "forward",
+               "drop", "reorder")
+
+# Reasons of EVENT_DROP
+DROP_LOSS = 0  # Lost on the link
+DROP_QUEUE = 1  # Tail dropped at the full bottleneck queue
+DROP_SOCKET = 2  # The socket buffer of the next hop was full
+DROP_REASONS = ("loss", "queue", "socket")
+
+# Direction of a packet through the Intermediate
+TOWARDS_SENDER = 0
+TOWARDS_RECEIVER = 1
+
+
+class TraceRecorder:
+    """Records the packet events of one node in a binary ring file, mapped into memory.
+
+    The file starts with a FILE_HEADER naming the node, the capacity of the ring and the wall-clock and node
+    clock times of its creation, which align the traces of several nodes. Every event is a fixed RECORD of 40
+    bytes written straight into the mapping, followed by the count of records written in the header, so
+    recording costs two struct.pack_into calls and no system call, and the trace survives the process being
+    killed. Once the ring is full the oldest records are overwritten.
+
+    The two values of a record depend on its event:
+
+    ============  ==============  ======================================  ================================
+    Event         Node            Value a                                 Value b
+    ============  ==============  ======================================  ================================
+    send          sender          Packets in flight after it              Congestion window
+    retransmit    sender          Packets in flight after it              Congestion window
+    receive       sender          Packets in flight after the ACK         Congestion window
+    rtt           sender          RTT sample in µs                        RTO in µs
+    timeout       sender          Number of timers expired                RTO in µs before the backoff
+    send          receiver        Next expected sequence number           Packets buffered out of order
+    receive       receiver        Next expected when the packet arrived   Packets buffered out of order
+    duplicate     receiver        Next expected when the packet arrived   Packets buffered out of order
+    recover       receiver        Next expected when it was rebuilt       Packets buffered out of order
+    corrupt       sender/receiv.  0                                       0
+    forward       intermediate    Delay in µs until it is released        Direction, TOWARDS_*
+    reorder       intermediate    Delay in µs, including the hold-back    Direction
+    corrupt       intermediate    0                                       Direction
+    drop          intermediate    One of the DROP_* reasons               Direction
+    ============  ==============  ======================================  ================================
+
+    The sequence number of an ACK is the one it acknowledges, and that of a selective ACK the next expected
+    one. The Intermediate sets the flow to the number of the packet's flow, the other nodes leave it 0. A
+    packet the Intermediate corrupts or reorders gets a corrupt or reorder record before its forward record,
+    which is written when the packet arrives; one the socket then has no room for gets a drop record too. A
+    packet the receiver rebuilds from parity gets a recover record, then a receive record like one that arrived.
+    """
+    def __init__(self, path, node, capacity=DEFAULT_CAPACITY, clock=time.monotonic):
+        """Create the ring file, replacing any file at the path.
+
+        :param path: Path of the file.
+        :param node: One of the NODE_* names, recorded in the header.
+        :param capacity: Number of records the ring holds.
+        :param clock: Function returning the current time in seconds, the node's clock.
+        """
+        self.capacity = capacity
+        self.clock = clock
+        self.count = 0
+        self.file = open(path, "w+b")
+        self.file.truncate(FILE_HEADER.size + capacity * RECORD.size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        FILE_HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, capacity, 0, time.time(), clock(), node.encode())
+
+    def record(self, event, packet_type, seq_num, size=0, a=0, b=0, flow=0):
+        """Append an event, overwriting the oldest one if the ring is full.
+
+        :param event: One of the EVENT_* numbers.
+        :param packet_type: Type of the packet, see packet.TYPE_*.
+        :param seq_num: Sequence number of the packet.
+        :param size: Payload bytes of the packet.
+        :param a: First value of the event.
+        :param b: Second value of the event.
+        :param flow: Flow of the packet at the Intermediate.
+        """
+        RECORD.pack_into(self.map, FILE_HEADER.size + self.count % self.capacity * RECORD.size, self.clock(), event,
+                         packet_type, flow, size, seq_num, a, b)
+        self.count += 1
+        COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+
+    def close(self):
+        """Unmap and close the file, the kernel writes the mapped pages back."""
+        self.map.close()
+        self.file.close()
+
+
+class Trace:
+    """The records of a ring file read back in the order they were written."""
+    def __init__(self, path):
+        """Read a ring file.
+
+        :param path: Path of the file.
+        :raises ValueError: If the file is not a trace.
+        """
+        with open(path, "rb") as f:
+            header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                raise ValueError(f"{path} is not a packet trace")
+            magic, record_size, capacity, count, wall_start, clock_start, node = FILE_HEADER.unpack(header)
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f"{path} is not a packet trace")
+            content = f.read(min(count, capacity) * RECORD.size)
+        self.path = path
+        self.node = node.rstrip(b"\0").decode()
+        self.capacity = capacity
+        self.count = count
+        self.overwritten = max(0, count - capacity)
+        self.wall_start = wall_start
+        self.clock_start = clock_start
+        first = count % capacity if count > capacity else 0
+        records = list(RECORD.iter_unpack(content[:len(content) - len(content) % RECORD.size]))
+        self.records = records[first:] + records[:first]
+
+    def offset(self, origin):
+        """Offset that turns the times of the records into seconds since a wall-clock origin.
+
+        :param origin: Wall-clock time, e.g. the earliest wall_start of the traces analysed together.
+        :return: Seconds to add to the time of a record.
+        """
+        return self.wall_start - self.clock_start - origin
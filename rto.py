@@ -0,0 +1,113 @@
+import heapq
+
+# Constants
+INITIAL_RTO = 1.0  # Seconds, RFC 6298 section 2.1
+MIN_RTO = 0.02  # Seconds, low enough for loopback yet above scheduler jitter
+MAX_RTO = 60.0  # Seconds
+CLOCK_GRANULARITY = 0.001  # Seconds
+ALPHA = 1 / 8
+BETA = 1 / 4
+
+
+class RttEstimator:
+    """Retransmission timeout estimator following RFC 6298.
+
+    Keeps a smoothed RTT and RTT variance from ACK samples and doubles the timeout on every
+    retransmission timeout. Callers apply Karn's rule by only sampling packets that were never
+    retransmitted, and clear the backoff once an ACK shows forward progress, so that under heavy loss
+    the timeout does not keep doubling while every sample is ambiguous.
+    """
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        """Initialize the estimator.
+
+        :param initial_rto: Timeout used before the first RTT sample.
+        :param min_rto: Lower bound of the timeout.
+        :param max_rto: Upper bound of the timeout, also caps exponential backoff.
+        """
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.base_rto = initial_rto
+        self.rto = initial_rto
+        self.backoffs = 0
+
+    def sample(self, rtt):
+        """Update the estimate with a new RTT measurement and clear any backoff.
+
+        :param rtt: Measured round-trip time in seconds.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.base_rto = min(self.max_rto, max(self.min_rto, self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)))
+        self.reset_backoff()
+
+    def backoff(self):
+        """Double the timeout after a retransmission timeout."""
+        self.backoffs += 1
+        self.rto = min(self.max_rto, self.base_rto * 2 ** self.backoffs)
+
+    def reset_backoff(self):
+        """Return to the estimated timeout, called when an ACK acknowledges new data."""
+        self.backoffs = 0
+        self.rto = self.base_rto
+
+
+class TimerHeap:
+    """Per-packet retransmission timers kept in a binary heap.
+
+    Cancelled or rescheduled timers stay in the heap and are skipped lazily when they reach the top,
+    so scheduling and cancelling are O(log n) and O(1).
+    """
+    def __init__(self):
+        """Initialize an empty set of timers."""
+        self.heap = []
+        self.deadlines = {}
+
+    def schedule(self, key, deadline):
+        """Arm or re-arm the timer of a packet.
+
+        :param key: Sequence number the timer belongs to.
+        :param deadline: Monotonic time at which the timer expires.
+        """
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+
+    def cancel(self, key):
+        """Disarm the timer of a packet, if it is armed.
+
+        :param key: Sequence number the timer belongs to.
+        """
+        self.deadlines.pop(key, None)
+
+    def next_deadline(self):
+        """Return the earliest armed deadline.
+
+        :return: Monotonic time of the next expiry, or None if no timer is armed.
+        """
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_expired(self, now):
+        """Disarm and return every timer that expired.
+
+        :param now: Current monotonic time.
+        :return: Keys of the expired timers in deadline order.
+        """
+        expired = []
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return expired
+            _, key = heapq.heappop(self.heap)
+            del self.deadlines[key]
+            expired.append(key)
+
+    def __len__(self):
+        return len(self.deadlines)
@@ -1,160 +1,721 @@
 import socket
-import struct
 import argparse
+import logging
+import selectors
 import time
+from rto import RttEstimator, TimerHeap
+from stream import open_source, FileSource
+from metrics import TransferMetrics, configure_logging, LOG_LEVELS
+from recorder import (TraceRecorder, NODE_SENDER, EVENT_SEND, EVENT_RETRANSMIT, EVENT_RECEIVE, EVENT_CORRUPT, EVENT_RTT,
+                      EVENT_TIMEOUT)
+from fec import xor_payloads, MAX_FEC_GROUP
+from checkpoint import BlockMap, block_hashes
+from cache import UNKNOWN_SUM
+from compress import CompressedSource, compression_flags, COMPRESSION_NONE, COMPRESSION_MODES
+from congestion import make_congestion_control, write_trace, CONGESTION_AIMD, CONGESTION_FIXED, CONGESTION_MODES, MAX_WINDOW
+from packet import (PacketCodec, enlarge_socket_buffers, decode_setup, clamp_payload_size, peek_type, new_session_id,
+                    BUFFER_SIZE, DEFAULT_PAYLOAD_SIZE, TYPE_DATA, TYPE_SETUP, TYPE_EOT, TYPE_ACK, TYPE_SACK,
+                    TYPE_PARITY, FLAG_SELECTIVE_REPEAT, FLAG_QUERY, FLAG_BLOCK_HASHES, FLAG_HAVE_BLOCKS, FLAG_BATCH,
+                    CHECKSUM_CRC32, CHECKSUM_MODES)
 
 # Constants
-PACKET_SIZE = 50  # Adjust the size of your packets as needed
-BUFFER_SIZE = 2048
-TIMEOUT = 2  # Timeout for receiving ACKs (in seconds)
-MAX_PAYLOAD_SIZE = PACKET_SIZE - 6  # Reserve 6 bytes for the sequence number and checksum
-END_OF_TRANSMISSION = 0xFFFFFF  # Define EOT constant here
-
-def calculate_checksum(data):
-    """Compute the checksum of the given data
-    
-    :param data: data to compute the checksum
-    :return checksum:
-    """
-    if len(data) % 2:
-        data += b'\x00' 
-    checksum = sum((data[i] << 8) + data[i + 1] for i in range(0, len(data), 2))
-    checksum = (checksum >> 16) + (checksum & 0xFFFF)
-    checksum = ~checksum & 0xFFFF
-    return checksum
+WINDOW_SIZE = 5  # Number of unacknowledged packets allowed in flight without congestion control
+EOT_RETRIES = 3  # Retransmissions of the EOT packet before giving up, every data packet is acknowledged by then
+HANDSHAKE_TIMEOUT = 30  # Seconds to keep retrying the session setup before giving up
+FAST_RETRANSMIT_THRESHOLD = 3  # Selectively acknowledged packets above a hole before it is resent early
+SETUP_KEY = -1  # Timer key of the setup packet, below every sequence number
+
+logger = logging.getLogger(__name__)
 
 class Sender:
-    def __init__(self, receiver_ip, receiver_port, listening_port, data):
+    def __init__(self, receiver_ip, receiver_port, listening_port, data, window_size=None,
+                 checksum_mode=CHECKSUM_CRC32, payload_size=DEFAULT_PAYLOAD_SIZE, selective_repeat=False,
+                 congestion_control=CONGESTION_AIMD, trace_cwnd=False, sock=None, metrics_path=None,
+                 clock=time.monotonic, name="", session_id=None, fec_group=0, dedup=False,
+                 compression=COMPRESSION_NONE, batch=False, record_path=None):
         """
-        Represents a Go-Back-N sender for reliable data transmission.
+        Represents a Go-Back-N or Selective Repeat sender for reliable data transmission.
         
         :param receiver_ip: IP address of the receiver to send to
         :param receiver_port: Port number of the receiver to send to
         :param listening_port: Port number to listen for ACKs
-        :param data: Data to be sent
+        :param data: Data to be sent, bytes or str held in memory or a source such as stream.FileSource. A source
+            with payload_sums, such as cache.CachedSource, shares the checksums of its payloads between transfers
+        :param window_size: Fixed window without congestion control (default WINDOW_SIZE), otherwise the cap of
+            the congestion window (default MAX_WINDOW)
+        :param checksum_mode: Checksum algorithm, must match the receiver's
+        :param payload_size: Payload size to propose to the receiver, the receiver may lower it
+        :param selective_repeat: Propose Selective Repeat, falls back to Go-Back-N if the receiver declines
+        :param congestion_control: One of CONGESTION_MODES, sizes the window from ACKs and losses
+        :param trace_cwnd: Record every change of the congestion window in congestion.trace
+        :param sock: Socket shared with other sessions, e.g. by the Server. The owner of the socket then passes
+            every datagram from the receiver to handle_ack and calls step, instead of calling send_data.
+        :param metrics_path: Write the transfer's metrics as JSON to this file when it finishes.
+        :param clock: Function returning the current time in seconds for timers, RTT samples and metrics. A
+            simnet.SimClock runs the transfer in virtual time on a simnet.SimSocket.
+        :param name: Name of the file, carried by the setup packet so the Server learns it in the same session.
+        :param session_id: ID of the session, by default a new one. The Server answers a query with the ID of
+            the query.
+        :param fec_group: Propose forward error correction with one XOR parity packet after every fec_group data
+            packets, so the receiver can rebuild one lost packet per group without a retransmission. 0 disables
+            it, the receiver may decline.
+        :param dedup: Announce the hash of every block of the data in the setup packet, so a receiver that
+            resumes into an older copy of the file answers with the blocks it already has and only the others
+            are sent. Packets in blocks the receiver has are skipped whether or not this is set.
+        :param compression: One of compress.COMPRESSION_MODES. The data is compressed before the session is set
+            up, unless the source is already compressed that way, and the setup packet announces the compression
+            so the receiver decompresses it as it arrives.
+        :param batch: The data is a batch.BatchSource, announced in the setup packet so the receiver unpacks
+            its files. A batch is not deduplicated.
+        :param record_path: Record every packet sent, ACK received, RTT sample and timeout in a
+            recorder.TraceRecorder ring file at this path, for analyze.py.
         
-        The object will be initialized with the given parameters and the necessary data structures will be set up
+        The object will be initialized with the given parameters and the necessary data structures will be set up.
+        The socket is non-blocking and driven by a selector so the whole window can be kept in flight while
+        ACKs are processed as they arrive. Every packet in flight has its own retransmission timer whose
+        timeout is estimated from the measured RTT. In Selective Repeat mode only the packets the receiver
+        reports missing are retransmitted. The number of packets in flight is limited by the congestion
+        window, which grows with ACKs and shrinks on losses. Counters, RTT samples and goodput are kept in
+        metrics. Per-packet events are logged at DEBUG, and whether DEBUG is enabled is checked once here.
         """
         self.receiver_ip = receiver_ip
         self.receiver_port = receiver_port
-        if not isinstance(data, bytes):
-            self.data = bytes(data, 'utf-8')
-        else:
-            self.data = data
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(TIMEOUT) 
-        self.sock.bind(("127.0.0.1", listening_port))
+        self.name = name
+        self.session_id = new_session_id() if session_id is None else session_id
+        self.source = open_source(data)
+        self.compression = compression
+        self.batch = batch
+        if compression != COMPRESSION_NONE and getattr(self.source, "compression", COMPRESSION_NONE) != compression:
+            original_size = self.source.size
+            self.source = CompressedSource(self.source, compression)
+            logger.info("Compressed %d bytes to %d with %s", original_size, self.source.size, compression)
+        self.checksum_mode = checksum_mode
+        self.payload_size = clamp_payload_size(payload_size)
+        self.codec = PacketCodec(self.payload_size, checksum_mode)
+        self.owns_socket = sock is None
+        self.selector = None
+        if self.owns_socket:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            enlarge_socket_buffers(sock)
+            sock.bind(("127.0.0.1", listening_port))
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(sock, selectors.EVENT_READ)
+        self.sock = sock
         self.seq_num = 0  
-        self.window_size = 5  
-        self.acks = [False] * self.window_size 
+        self.next_new_seq_num = 0
+        if window_size is None:
+            window_size = WINDOW_SIZE if congestion_control == CONGESTION_FIXED else MAX_WINDOW
+        self.window_size = window_size
+        self.clock = clock
+        self.congestion = make_congestion_control(congestion_control, window_size, trace_cwnd, clock)
         self.window_start = 0 
+        self.total_packets = 0
+        self.session_open = False
+        self.setup_packet = None
+        self.selective_repeat = selective_repeat
+        self.fec_group = min(fec_group, MAX_FEC_GROUP)
+        self.dedup = dedup
+        self.have = None
+        self.sums = None
+        self.sacked = set()
+        self.fast_retransmitted = set()
+        self.metrics = TransferMetrics("sender", clock)
+        self.metrics_path = metrics_path
+        self.log_packets = logger.isEnabledFor(logging.DEBUG)
+        self.recorder = None if record_path is None else TraceRecorder(record_path, NODE_SENDER, clock=clock)
+        self.rtt = RttEstimator()
+        self.timers = TimerHeap()
+        self.send_times = {}
+        self.retransmitted = set()
         self.eot_sent = False
-        self.shutoff = 0
+        self.eot_acked = False
+        self.eot_retries = 0
+        self.give_up = 0
+        self.finished = False
 
     def send_data(self):
-        """Handles the transmission of data packets and manages acknowledgments."""
-        print("Sender started.")
-        total_packets = (len(self.data) + MAX_PAYLOAD_SIZE - 1) // MAX_PAYLOAD_SIZE
-        
-        while self.seq_num < total_packets:
-            if self.seq_num < self.window_start + self.window_size:
-                packet_data = self.data[self.seq_num * MAX_PAYLOAD_SIZE: (self.seq_num + 1) * MAX_PAYLOAD_SIZE]
-                self.send_packet(self.seq_num, packet_data)
-            
-            self.handle_acks()
-        
-        self.send_packet(END_OF_TRANSMISSION, b"")
+        """Handles the transmission of data packets and manages acknowledgments.
 
-        self.eot_sent = True
-        self.shutoff = time.time() + 15
+        Keeps up to a congestion window of packets in flight, drains ACKs whenever the socket becomes readable
+        and retransmits packets whose timers expire.
 
+        :raises ConnectionError: If the receiver does not answer the session setup within HANDSHAKE_TIMEOUT seconds.
+        """
+        logger.info("Sender started")
+        self.start()
         try:
-            self.handle_acks()
-        except socket.timeout:
-            print("No ACK received for EOT packet, ending transmission anyway.")
+            while not self.finished:
+                self.wait_for_acks()
+                self.step()
+        finally:
+            self.close()
+        logger.info("Data transmission complete: %s", self.metrics.summary())
+
+    def start(self, hashes=None):
+        """Proposes a payload size and options to the receiver, and names the file, its size and its version.
+
+        The setup packet is retransmitted with exponential backoff until the receiver answers, and its
+        round trip gives the first RTT sample. With dedup, the setup also carries the block hashes of the data.
+
+        :param hashes: Block hashes of the data as returned by checkpoint.block_hashes, if announces_hashes. They
+            are computed here if not given, which reads the whole data.
+        """
+        flags = FLAG_SELECTIVE_REPEAT if self.selective_repeat else 0
+        flags |= compression_flags(self.compression)
+        if self.batch:
+            flags |= FLAG_BATCH
+        if self.announces_hashes():
+            flags |= FLAG_BLOCK_HASHES
+            if hashes is None:
+                hashes = block_hashes(self.source)
+        else:
+            hashes = b""
+        self.setup_packet = self.codec.encode_setup(self.payload_size, flags, self.source.size, self.session_id,
+                                                    self.name, self.window_size, self.fec_group, hashes,
+                                                    getattr(self.source, "version", 0))
+        self.give_up = self.clock() + HANDSHAKE_TIMEOUT
+        self.transmit(SETUP_KEY)
+
+    def announces_hashes(self):
+        """Checks whether the setup packet carries the block hashes of the data.
+
+        :return: True with dedup, unless the data is empty, compressed or a batch.
+        """
+        return bool(self.dedup and self.source.size and self.compression == COMPRESSION_NONE and not self.batch)
+
+    def step(self):
+        """Advances the transfer after ACKs were handled or a timer may have expired.
+
+        Retransmits packets whose timers expired, refills the window, and sends the EOT packet once every
+        data packet is acknowledged. Sets finished once the EOT packet is acknowledged or has been
+        retransmitted EOT_RETRIES times without an answer. Since every data packet was acknowledged before,
+        giving up only means the receiver may not have seen the end of the session, and a receiver that
+        already closed its session is not waited for.
+
+        :raises ConnectionError: If the receiver does not answer the session setup within HANDSHAKE_TIMEOUT seconds.
+        """
+        self.handle_timeouts()
+        if self.finished:
+            return
+        now = self.clock()
+        if not self.session_open:
+            if now > self.give_up:
+                raise ConnectionError("No answer to session setup from the receiver")
+        elif self.window_start < self.total_packets:
+            self.fill_window()
+        elif not self.eot_sent:
+            self.eot_sent = True
+            self.transmit(self.total_packets)
+        elif self.eot_acked:
+            self.finish()
+
+    def finish(self):
+        """Marks the transfer as finished and exports its metrics."""
+        self.finished = True
+        self.metrics.finish()
+        if self.metrics_path:
+            self.metrics.dump_json(self.metrics_path)
+
+    def next_deadline(self):
+        """Returns when step next has to run even if no datagram arrives.
+
+        :return: Monotonic time of the earliest retransmission timer, or None if none is armed.
+        """
+        return self.timers.next_deadline()
+
+    def handle_setup_reply(self, packet):
+        """Applies the payload size and options accepted by the receiver.
+
+        Setup packets of other sessions, and the query a downloading receiver keeps retransmitting until
+        this Sender's setup reaches it, are ignored. When the receiver answers with the blocks it already
+        has, the window starts at the first packet outside them.
+
+        :param packet: A datagram received while the session is being set up.
+        """
+        packet_type, _, payload, valid = self.codec.decode(packet)
+        if packet_type != TYPE_SETUP or not valid:
+            return
+        setup = decode_setup(payload)
+        if setup is None:
+            return
+        accepted, flags, _, session_id, _, fec_group, _, _, blocks = setup
+        if session_id != self.session_id or flags & FLAG_QUERY:
+            return
+        self.payload_size = clamp_payload_size(min(self.payload_size, accepted))
+        self.selective_repeat = self.selective_repeat and bool(flags & FLAG_SELECTIVE_REPEAT)
+        self.fec_group = min(self.fec_group, fec_group)
+        self.codec = PacketCodec(self.payload_size, self.checksum_mode)
+        payload_sums = getattr(self.source, "payload_sums", None)
+        if payload_sums is not None:
+            self.sums = payload_sums(self.payload_size, self.checksum_mode)
+        self.acknowledge(SETUP_KEY, self.clock())
+        self.total_packets = (self.source.size + self.payload_size - 1) // self.payload_size
+        self.session_open = True
+        if self.recorder is not None:
+            self.recorder.record(EVENT_RECEIVE, TYPE_SETUP, 0, 0, len(self.send_times), self.congestion.window())
+        mode = "Selective Repeat" if self.selective_repeat else "Go-Back-N"
+        if self.fec_group:
+            mode += f", a parity packet every {self.fec_group} packets"
+        if self.compression != COMPRESSION_NONE:
+            mode += f", {self.compression} compressed"
+        if self.batch:
+            mode += ", batch of files"
+        logger.info("Session open with %d byte payloads (%s)", self.payload_size, mode)
+        if self.compression != COMPRESSION_NONE and not flags & compression_flags(self.compression):
+            logger.warning("Receiver did not confirm %s compression, it may store the data compressed",
+                           self.compression)
+        if self.batch and not flags & FLAG_BATCH:
+            logger.warning("Receiver did not confirm the batch, it may store the files as one stream")
+        if flags & FLAG_HAVE_BLOCKS:
+            self.have = BlockMap(self.source.size, blocks)
+            while self.window_start < self.total_packets and self.skipped(self.window_start):
+                self.window_start += 1
+            self.seq_num = self.next_new_seq_num = self.window_start
+            logger.info("Receiver already has %d of %d blocks, skipping them", self.have.count(),
+                        self.have.block_count)
+
+    def skipped(self, seq_num):
+        """Checks whether a packet lies in blocks the receiver already has.
+
+        :param seq_num: Sequence number of the packet.
+        :return: True if the packet is not sent.
+        """
+        return self.have is not None and self.have.covers(seq_num * self.payload_size, self.packet_length(seq_num))
+
+    def fill_window(self):
+        """Sends every packet that fits in the congestion window but has not been sent yet, or has to be sent
+        again after Go-Back-N rewound the window.
+
+        Packets in blocks the receiver already has are counted as selectively acknowledged instead of being
+        sent, and take no room in the window."""
+        window_end = self.window_start + self.congestion.window()
+        while self.seq_num < self.total_packets and self.seq_num < window_end:
+            if self.have is not None and self.skipped(self.seq_num):
+                self.sacked.add(self.seq_num)
+                window_end += 1
+            elif self.seq_num < self.next_new_seq_num:
+                self.retransmit(self.seq_num)
+            else:
+                self.transmit(self.seq_num)
+                if self.fec_group and ((self.seq_num + 1) % self.fec_group == 0
+                                       or self.seq_num + 1 == self.total_packets):
+                    self.send_parity(self.seq_num // self.fec_group)
+            self.seq_num += 1
+        self.next_new_seq_num = max(self.next_new_seq_num, self.seq_num)
+
+    def transmit(self, seq_num, retransmission=False):
+        """Sends a data, setup or EOT packet and arms its retransmission timer.
+
+        :param seq_num: Sequence number of the packet, total_packets for the EOT packet and SETUP_KEY for the
+            setup packet.
+        :param retransmission: Whether the packet was sent before, which excludes it from RTT sampling.
+        """
+        if self.recorder is not None:
+            self.record(EVENT_RETRANSMIT if retransmission else EVENT_SEND, seq_num,
+                        len(self.send_times) + (seq_num not in self.send_times), self.congestion.window())
+        if seq_num == SETUP_KEY:
+            self.send_raw(self.setup_packet, seq_num)
+        elif seq_num == self.total_packets:
+            self.send_packet(seq_num, b"", TYPE_EOT)
+        elif self.sums is None:
+            self.send_packet(seq_num, self.get_payload(seq_num))
+        else:
+            self.send_summed(seq_num)
+        self.metrics.packets_sent += 1
+        if retransmission:
+            self.retransmitted.add(seq_num)
+        now = self.clock()
+        self.send_times[seq_num] = now
+        self.timers.schedule(seq_num, now + self.rtt.rto)
+
+    def record(self, event, seq_num, a, b):
+        """Records an event of a packet in the packet trace.
+
+        :param event: One of the recorder.EVENT_* numbers.
+        :param seq_num: Sequence number of the packet, total_packets for the EOT packet and SETUP_KEY for the
+            setup packet.
+        :param a: First value of the event.
+        :param b: Second value of the event.
+        """
+        if seq_num == SETUP_KEY:
+            self.recorder.record(event, TYPE_SETUP, 0, 0, a, b)
+        elif seq_num == self.total_packets:
+            self.recorder.record(event, TYPE_EOT, seq_num, 0, a, b)
+        else:
+            self.recorder.record(event, TYPE_DATA, seq_num, self.packet_length(seq_num), a, b)
+
+    def acknowledge(self, seq_num, now, sample=True):
+        """Disarms the timer of an acknowledged packet and samples the RTT.
+
+        Karn's rule: packets that were retransmitted give ambiguous samples and are skipped.
+
+        :param seq_num: Sequence number of the acknowledged packet.
+        :param now: Time the acknowledgment arrived.
+        :param sample: Whether this acknowledgment may be used as an RTT sample.
+        """
+        self.timers.cancel(seq_num)
+        sent = self.send_times.pop(seq_num, None)
+        if seq_num in self.retransmitted:
+            self.retransmitted.discard(seq_num)
+        elif sample and sent is not None:
+            self.rtt.sample(now - sent)
+            self.metrics.rtt.record(now - sent)
+            if self.recorder is not None:
+                self.record(EVENT_RTT, seq_num, int((now - sent) * 1e6), int(self.rtt.rto * 1e6))
+
+    def send_parity(self, group):
+        """Sends the parity packet of a group, once its last data packet has been sent for the first time.
+
+        The parity packet has no timer and is never retransmitted: it only saves a retransmission when it
+        arrives, and the lost packet is retransmitted as usual when it does not.
+
+        :param group: Group number.
+        """
+        start = group * self.fec_group
+        end = min(start + self.fec_group, self.total_packets)
+        parity = xor_payloads(self.get_payload(seq_num) for seq_num in range(start, end))
+        length = min(self.payload_size, self.source.size - start * self.payload_size)
+        if self.recorder is not None:
+            self.recorder.record(EVENT_SEND, TYPE_PARITY, group, length, len(self.send_times), self.congestion.window())
+        self.send_packet(group, parity.to_bytes(length, 'little'), TYPE_PARITY)
+        self.metrics.parity_packets += 1
+
+    def get_payload(self, seq_num):
+        """Returns the payload carried by the packet with the given sequence number.
 
-        print("Data transmission complete.")
-    
+        :param seq_num: Sequence number of the packet.
+        :return: The part of the data carried by that packet, read from the source on demand.
+        """
+        return self.source.read(seq_num * self.payload_size, self.payload_size)
 
-    def send_packet(self, seq_num, data):
+    def send_packet(self, seq_num, data, packet_type=TYPE_DATA):
         """Sends a single packet with a sequence number and checksum.
         
         :param seq_num: Sequence number of the packet.
         :param data: Payload data to be sent.
+        :param packet_type: Type of the packet, see packet.TYPE_*.
+        """
+        self.send_raw(self.codec.encode(seq_num, data, packet_type=packet_type), seq_num)
+
+    def send_summed(self, seq_num):
+        """Sends a data packet whose payload sum is kept by the source, summing the payload only the first time
+        any transfer of the source sends it.
+
+        :param seq_num: Sequence number of the packet.
+        """
+        payload = self.get_payload(seq_num)
+        payload_sum = self.sums[seq_num]
+        if payload_sum == UNKNOWN_SUM:
+            payload_sum = self.sums[seq_num] = self.codec.payload_sum(payload)
+        self.send_raw(self.codec.encode(seq_num, payload, payload_sum), seq_num)
+
+    def send_raw(self, packet, seq_num):
+        """Sends an already encoded packet to the receiver.
+
+        :param packet: Encoded packet.
+        :param seq_num: Sequence number of the packet, for the log.
         """
-        checksum = calculate_checksum(data)
-        packet = struct.pack('!I', seq_num) + struct.pack('!H', checksum) + data
         try:
             self.sock.sendto(packet, (self.receiver_ip, self.receiver_port))
-            print(f"Sent packet {seq_num}")
-        except socket.error as e:
-            print(f"Failed to send packet {seq_num}: {e}, retrying...")
+            if self.log_packets:
+                logger.debug("Sent packet %d", seq_num)
+        except (BlockingIOError, socket.error) as e:
+            logger.warning("Failed to send packet %d: %s, retrying...", seq_num, e)
+
+    def wait_for_acks(self):
+        """Waits until the socket is readable or the earliest retransmission timer expires, then handles ACKs."""
+        deadline = self.timers.next_deadline()
+        timeout = None if deadline is None else max(0.0, deadline - self.clock())
+        if self.selector.select(timeout):
+            self.handle_acks()
+
+    def handle_timeouts(self):
+        """Handles expired retransmission timers.
+
+        Go-Back-N: the receiver only accepts the oldest outstanding packet, so when its timer expires the
+        timeout is backed off once, the congestion window collapses and the window is rewound so that
+        fill_window resends the outstanding packets as the new window allows. Timers of later packets
+        that expire first are simply re-armed, since resending them before the gap is filled is wasted.
+
+        Selective Repeat: the receiver buffers out-of-order packets, so only the expired packets are
+        retransmitted. Selectively acknowledged packets have no armed timer and never expire. The timeout
+        is backed off and the congestion window collapses when the oldest outstanding packet expires,
+        while the expiry of a later packet counts as a loss.
+        """
+        now = self.clock()
+        expired = self.timers.pop_expired(now)
+        if not expired:
+            return
+        self.metrics.timeouts += 1
+        if self.recorder is not None:
+            self.record(EVENT_TIMEOUT, expired[0], len(expired), int(self.rtt.rto * 1e6))
+        if self.eot_sent:
+            if self.eot_retries == EOT_RETRIES:
+                logger.warning("No ACK received for EOT packet, ending transmission anyway")
+                self.finish()
+                return
+            self.eot_retries += 1
+        if not self.session_open or self.eot_sent:
+            self.rtt.backoff()
+            for seq_num in expired:
+                self.retransmit(seq_num)
+            return
+        if self.selective_repeat:
+            if self.window_start in expired:
+                self.rtt.backoff()
+                self.congestion.timeout(self.seq_num, now)
+            else:
+                self.congestion.loss(expired[0], self.seq_num, now)
+            for seq_num in expired:
+                self.retransmit(seq_num)
+            return
+        if self.window_start not in expired:
+            for seq_num in expired:
+                self.timers.schedule(seq_num, now + self.rtt.rto)
+            return
+        self.rtt.backoff()
+        self.congestion.timeout(self.seq_num, now)
+        for seq_num in range(self.window_start, self.seq_num):
+            self.timers.cancel(seq_num)
+        self.seq_num = self.window_start
+
+    def retransmit(self, seq_num):
+        """Resends a packet that timed out.
+
+        :param seq_num: Sequence number of the packet.
+        """
+        if self.log_packets:
+            logger.debug("Retransmitting packet %d (RTO %.3f s)", seq_num, self.rtt.rto)
+        self.metrics.retransmissions += 1
+        self.transmit(seq_num, retransmission=True)
 
     def handle_acks(self):
-        """Handles acknowledgment reception and manages the sliding window."""
+        """Drains every ACK currently queued on the socket and slides the window accordingly."""
         while True:
             try:
-                if time.time() > self.shutoff and self.eot_sent:
-                    self.sock.close()
-                    return
-                
                 ack_data, _ = self.sock.recvfrom(BUFFER_SIZE)
-                ack_seq_num, checksum = struct.unpack('!IH', ack_data[:6])
-                if checksum != calculate_checksum(bytes("ACK", 'utf-8')):
-                    print(f"Received ACK {ack_seq_num} with incorrect checksum, ignoring...")
-                    continue
-
-                print(f"Received ACK {ack_seq_num} for packet {ack_seq_num}")
-
-                if self.eot_sent:
-                    self.sock.close()
-                    return
-                
-                self.update_window(ack_seq_num)
-                break  
-            except (socket.timeout, BlockingIOError, IOError):
-                self.retransmit_next_packet()
-
-    def retransmit_next_packet(self):
-        """Retransmits the next unacknowledged packet in the window."""
-        for i in range(self.window_size):
-            packet_index = self.window_start + i
-            if not self.acks[i]:  
-                time.sleep(1)
-                packet_data = self.data[packet_index * MAX_PAYLOAD_SIZE: (packet_index + 1) * MAX_PAYLOAD_SIZE]
-                self.send_packet(packet_index, packet_data)
-                print(f"Retransmitting packet {packet_index}")
-                break 
-
-
-    def update_window(self, ack_seq_num):
+            except (BlockingIOError, ConnectionResetError):
+                return
+            self.handle_ack(ack_data)
+
+    def handle_ack(self, ack_data):
+        """Handles a single datagram from the receiver: a setup reply, an ACK or a selective ACK.
+
+        :param ack_data: Raw datagram.
+        """
+        if not self.session_open:
+            self.handle_setup_reply(ack_data)
+            return
+        packet_type = peek_type(ack_data)
+        if packet_type == TYPE_SACK:
+            self.handle_sack(ack_data)
+            return
+        if packet_type == TYPE_SETUP:
+            return
+        ack_seq_num, valid = self.codec.decode_ack(ack_data)
+        if ack_seq_num is None:
+            return
+        if not valid:
+            self.metrics.checksum_failures += 1
+            if self.log_packets:
+                logger.debug("Received ACK %d with incorrect checksum, ignoring...", ack_seq_num)
+            if self.recorder is not None:
+                self.recorder.record(EVENT_CORRUPT, TYPE_ACK, ack_seq_num)
+            return
+
+        self.metrics.acks_received += 1
+        if self.log_packets:
+            logger.debug("Received ACK %d", ack_seq_num)
+
+        if not self.eot_sent:
+            if self.beyond_sent(ack_seq_num + 1):
+                self.discard_ack(TYPE_ACK, ack_seq_num)
+                return
+            self.update_window(ack_seq_num)
+        elif ack_seq_num == self.total_packets and not self.eot_acked:
+            self.acknowledge(ack_seq_num, self.clock())
+            self.eot_acked = True
+        if self.recorder is not None:
+            self.recorder.record(EVENT_RECEIVE, TYPE_ACK, ack_seq_num, 0, len(self.send_times),
+                                 self.congestion.window())
+
+    def packet_length(self, seq_num):
+        """Returns the number of data bytes carried by a packet, fewer than payload_size for the last one.
+
+        :param seq_num: Sequence number of the packet.
+        :return: Payload length in bytes.
+        """
+        return min(self.payload_size, self.source.size - seq_num * self.payload_size)
+
+    def beyond_sent(self, end):
+        """Checks whether an acknowledgment of every packet below a sequence number covers a packet that was
+        never sent, which only a corrupted acknowledgment does.
+
+        Packets in blocks the receiver already has count as sent, since the receiver skips them too.
+
+        :param end: Sequence number after the last acknowledged packet.
+        :return: True if the acknowledgment has to be discarded.
+        """
+        start = self.next_new_seq_num
+        if end <= start:
+            return False
+        length = min(end * self.payload_size, self.source.size) - start * self.payload_size
+        return self.have is None or length <= 0 or not self.have.covers(start * self.payload_size, length)
+
+    def discard_ack(self, packet_type, seq_num):
+        """Counts an acknowledgment of packets that were never sent as corrupted.
+
+        :param packet_type: TYPE_ACK or TYPE_SACK.
+        :param seq_num: Highest packet it acknowledges.
+        """
+        self.metrics.checksum_failures += 1
+        if self.log_packets:
+            logger.debug("Received ACK of unsent packet %d, ignoring...", seq_num)
+        if self.recorder is not None:
+            self.recorder.record(EVENT_CORRUPT, packet_type, seq_num)
+
+    def handle_sack(self, packet):
+        """Applies a selective ACK: slides the window up to the receiver's next expected packet, disarms the
+        timers of the packets buffered after it and fast-retransmits holes the receiver has skipped over.
+
+        A selective ACK of a packet that was never sent is corrupted and discarded whole, since a corruption
+        its checksum missed may have set any bit. Buffered packets at or below the start of the window are
+        ignored, so a stale selective ACK never disarms the timer of the oldest outstanding packet, the one
+        the transfer waits for.
+
+        :param packet: Raw selective ACK.
+        """
+        seq_num, next_expected, bitmap, valid = self.codec.decode_sack(packet)
+        if seq_num is None:
+            return
+        if not valid:
+            self.metrics.checksum_failures += 1
+            if self.log_packets:
+                logger.debug("Received SACK %d with incorrect checksum, ignoring...", seq_num)
+            if self.recorder is not None:
+                self.recorder.record(EVENT_CORRUPT, TYPE_SACK, seq_num)
+            return
+        if (self.beyond_sent(next_expected)
+                or bitmap and next_expected + bitmap.bit_length() >= self.next_new_seq_num):
+            self.discard_ack(TYPE_SACK, next_expected)
+            return
+        self.metrics.acks_received += 1
+        if self.log_packets:
+            logger.debug("Received SACK %d, next expected %d", seq_num, next_expected)
+
+        self.update_window(min(next_expected, self.total_packets) - 1, seq_num)
+        now = self.clock()
+        newly_sacked = 0
+        while bitmap:
+            lowest = bitmap & -bitmap
+            bitmap ^= lowest
+            sacked = next_expected + lowest.bit_length()
+            if sacked > self.window_start and sacked not in self.sacked:
+                self.sacked.add(sacked)
+                self.acknowledge(sacked, now, sacked == seq_num)
+                self.metrics.deliver(self.packet_length(sacked), now)
+                newly_sacked += 1
+        if newly_sacked:
+            self.congestion.ack(newly_sacked, now, self.rtt.srtt)
+            self.fast_retransmit()
+        if self.recorder is not None:
+            self.recorder.record(EVENT_RECEIVE, TYPE_SACK, next_expected, 0, len(self.send_times),
+                                 self.congestion.window())
+
+    def fast_retransmit(self):
+        """Retransmits, once each, the holes with at least FAST_RETRANSMIT_THRESHOLD packets selectively
+        acknowledged above them, without waiting for their timers."""
+        above = 0
+        for seq_num in range(self.seq_num - 1, self.window_start - 1, -1):
+            if seq_num in self.sacked:
+                above += 1
+            elif above >= FAST_RETRANSMIT_THRESHOLD and seq_num not in self.fast_retransmitted:
+                self.fast_retransmitted.add(seq_num)
+                self.congestion.loss(seq_num, self.seq_num, self.clock())
+                if self.log_packets:
+                    logger.debug("Fast retransmitting packet %d", seq_num)
+                self.metrics.retransmissions += 1
+                self.metrics.fast_retransmissions += 1
+                self.transmit(seq_num, retransmission=True)
+
+    def update_window(self, ack_seq_num, sample_seq_num=None):
         """Shifts the sliding window based on received acknowledgments.
         
         :param ack_seq_num: Sequence number of the received acknowledgment.
+        :param sample_seq_num: Packet whose arrival triggered the acknowledgment, the only one used as an
+            RTT sample. Defaults to ack_seq_num, unless a packet it covers was retransmitted: the
+            retransmission may have filled a hole and triggered the ACK, so the RTT of ack_seq_num, sent
+            before the loss was detected, would be inflated by the recovery time.
         """
+        if ack_seq_num >= self.total_packets:
+            return
+        if sample_seq_num is None and self.retransmitted.isdisjoint(range(self.window_start, ack_seq_num + 1)):
+            sample_seq_num = ack_seq_num
         shift = ack_seq_num - self.window_start + 1  
         if shift > 0:
-            self.acks = [False] * self.window_size 
+            now = self.clock()
+            acked = shift
+            for seq_num in range(self.window_start, ack_seq_num + 1):
+                self.acknowledge(seq_num, now, seq_num == sample_seq_num)
+                if seq_num in self.sacked:
+                    self.sacked.discard(seq_num)
+                    acked -= 1
+                else:
+                    self.metrics.deliver(self.packet_length(seq_num), now)
+                self.fast_retransmitted.discard(seq_num)
+            self.rtt.reset_backoff()
+            self.congestion.ack(acked, now, self.rtt.srtt)
             self.window_start += shift  
-            self.seq_num = self.window_start 
+            self.seq_num = max(self.seq_num, self.window_start)
 
-            # Stop if all packets are acknowledged
-            if self.window_start >= len(self.data):
-                self.sock.close()
-                return
+    def close(self):
+        """Releases the selector, the socket unless it is shared, the data source and the packet trace."""
+        if self.owns_socket:
+            self.selector.close()
+            self.sock.close()
+        self.source.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
 def main():
     """Parses command-line arguments and initializes the sender."""    
-    parser = argparse.ArgumentParser(description="UDP Go-Back-N Sender")
+    parser = argparse.ArgumentParser(description="UDP Go-Back-N / Selective Repeat Sender")
     parser.add_argument("--receiver-port", type=int, required=True, help="Receiver's port number")
     parser.add_argument("--receiver-ip", type=str, default="127.0.0.1", help="IP address of the receiver")
     parser.add_argument("--listening-port", type=int, required=True, help="This sender's port number")
-    parser.add_argument("--data", type=str, required=True, help="Data to send")
+    data_group = parser.add_mutually_exclusive_group(required=True)
+    data_group.add_argument("--data", type=str, help="Data to send")
+    data_group.add_argument("--file", type=str, help="File to send, streamed from disk")
+    parser.add_argument("--window-size", type=int, default=None,
+                        help=f"Fixed window size (default {WINDOW_SIZE}), or the cap of the congestion window (default {MAX_WINDOW})")
+    parser.add_argument("--checksum", choices=CHECKSUM_MODES, default=CHECKSUM_CRC32, help="Checksum algorithm")
+    parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE, help="Payload bytes per packet to propose")
+    parser.add_argument("--congestion", choices=CONGESTION_MODES, default=CONGESTION_AIMD,
+                        help="Congestion control, 'fixed' keeps the window at --window-size")
+    parser.add_argument("--cwnd-trace", type=str, default=None, help="Write the congestion window trace to this CSV file")
+    parser.add_argument("--selective-repeat", action="store_true", help="Retransmit only lost packets, using selective ACKs")
+    parser.add_argument("--fec", type=int, default=0, help="Data packets per XOR parity packet, 0 disables FEC")
+    parser.add_argument("--compress", choices=COMPRESSION_MODES, default=COMPRESSION_NONE,
+                        help="Compress the data before sending it")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Announce block hashes so a resuming receiver is only sent the blocks it lacks")
+    parser.add_argument("--metrics", type=str, default=None, help="Write the transfer metrics to this JSON file")
+    parser.add_argument("--record", type=str, default=None, help="Record packet events to this ring file")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="DEBUG logs every packet")
 
     args = parser.parse_args()
+    configure_logging(args.log_level)
 
-    sender = Sender(args.receiver_ip, args.receiver_port, args.listening_port, args.data)
+    data = args.data if args.file is None else FileSource(args.file)
+    sender = Sender(args.receiver_ip, args.receiver_port, args.listening_port, data, args.window_size,
+                    args.checksum, args.payload_size, args.selective_repeat, args.congestion, args.cwnd_trace is not None,
+                    metrics_path=args.metrics, fec_group=args.fec, dedup=args.dedup,
+                    compression=args.compress, record_path=args.record)
     sender.send_data()
+    if args.cwnd_trace:
+        write_trace(sender.congestion.trace, args.cwnd_trace)
 
 if __name__ == "__main__":
     main()
@@ -1,55 +1,606 @@
 import argparse
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import selectors
+import socket
+import time
 from sender import Sender
-from receiver import Receiver
+from receiver import Receiver, ACK_EVERY, ACK_DELAY
+from stream import FileSource, FileSink, parse_range_filename, range_staging_path, commit_range
+from cache import PacketCache, CACHE_SIZE
+from checkpoint import block_hashes
+from compress import CompressedSource, should_compress, compression_from_flags, COMPRESSION_NONE
+from batch import BatchSource, BatchSink, expand_paths, safe_name
+from metrics import configure_logging, LOG_LEVELS
+from packet import (PacketCodec, enlarge_socket_buffers, decode_setup, peek_type, BUFFER_SIZE, MAX_PAYLOAD_SIZE,
+                    TYPE_SETUP, TYPE_EOT, FLAG_QUERY, FLAG_NOT_FOUND, FLAG_BATCH)
+
+# Constants
+FILES_DIRECTORY = "Server_files"
+SESSION_TIMEOUT = 30  # Seconds without a datagram from a client before its session is dropped
+POLL_INTERVAL = 1  # Seconds between checks for idle sessions and for stop()
+TIME_WAIT = 30  # Seconds a finished session's ID is remembered, so late duplicates of its setup are ignored
+PREPARE_THREADS = 2  # Threads preparing downloads off the event loop, compressing them or hashing their blocks
+PREPARE_POLL = 0.01  # Seconds between checks of the event loop for a download being prepared
+
+logger = logging.getLogger(__name__)
+
+
+class ServerSession:
+    """The state of one transfer of a client of the Server, identified by the client's address.
+
+    A session is opened by a setup packet that carries the filename, the size of the data and the options. A
+    setup with FLAG_QUERY asks for a download, which the session streams back with a Sender whose own setup
+    packet answers the query, compressed if the query asks for it and the file is worth it; any other setup
+    announces an upload, which the session receives with a Receiver writing to a staging file, and the
+    Receiver answers it. Both share the Server's socket. A
+    filename built by stream.range_filename announces one byte range of a parallel upload, which is written
+    at its offset in a staging file shared by the ranges of the upload. A whole-file upload to a Server with
+    resume keeps a checkpoint next to its staging file and continues from it when the client uploads the same
+    file again.
+
+    Uploads never write to the file they upload: the staging file replaces it once the upload is complete, so
+    a download still sending the old file keeps reading it whole, and the cache.PacketCache can keep files
+    mapped.
+
+    With FLAG_BATCH, an upload is a stream of files unpacked by a batch.BatchSink into the Server's directory,
+    and a query names glob patterns, one per line, whose matches in the directory are sent as a
+    batch.BatchSource, all in one session.
+
+    Whatever reads a whole file before a download can start runs in the Server's thread pool, and the download
+    starts once it is done, so the event loop keeps serving the other sessions meanwhile: compressing the file,
+    unless the Server's cache holds it compressed, or the batch, and hashing the blocks of a file whose Sender
+    announces them.
+    """
+    def __init__(self, server, address, packet, setup):
+        """Open the session and answer its setup packet.
+
+        :param server: Server the session belongs to.
+        :param address: Address of the client.
+        :param packet: The setup packet.
+        :param setup: The setup as returned by packet.decode_setup.
+        """
+        self.server = server
+        self.address = address
+        payload_size, flags, _, self.session_id, _, _, _, name, _ = setup
+        self.filename = os.path.basename(name)
+        self.batch = bool(flags & FLAG_BATCH)
+        self.batch_sink = None
+        self.byte_range = None
+        self.upload = None
+        self.receiver = None
+        self.sender = None
+        self.path = None
+        self.payload_size = payload_size
+        self.compression = compression_from_flags(flags)
+        self.preparing = None  # Future of the thread pool job the download waits for
+        self.preparing_source = None  # Source the job reads
+        self.prepared = None  # Called with the result of the job
+        self.finished = False
+        self.last_activity = time.monotonic()
+        if flags & FLAG_QUERY and self.batch:
+            self.start_batch_download(name)
+        elif flags & FLAG_QUERY:
+            self.start_download()
+        elif self.batch:
+            self.batch_sink = BatchSink(self.server.directory, self.server.invalidate)
+            self.receiver = self.server.make_receiver(self.batch_sink)
+            self.receiver.handle_packet(packet, self.address)
+        else:
+            self.start_upload(name, packet)
+
+    def start_download(self):
+        """Stream the queried file back to the client, or tell it the file cannot be sent.
+
+        The compression the client asked for is only used if compress.should_compress agrees.
+        """
+        self.path = os.path.join(self.server.directory, self.filename)
+        try:
+            if not should_compress(self.path, self.compression):
+                self.compression = COMPRESSION_NONE
+            source = self.server.open_file(self.path, self.compression)
+            if source is None:
+                source = FileSource(self.path)
+        except OSError as e:
+            logger.warning("Cannot send %s to %s: %s", self.filename, self.address, e)
+            self.server.refuse(self.address, self.session_id)
+            self.finished = True
+            return
+        if self.compression != COMPRESSION_NONE and getattr(source, "compression", None) != self.compression:
+            self.prepare(self.compress, source, self.compressed)
+        else:
+            self.start_sender(source)
+
+    def start_batch_download(self, patterns):
+        """Stream every file matching the queried glob patterns back to the client as one batch, or tell it
+        nothing can be sent.
+
+        :param patterns: Glob patterns relative to the Server's directory, one per line.
+        """
+        patterns = [safe_name(pattern) for pattern in patterns.split("\n")]
+        try:
+            if None in patterns:
+                raise FileNotFoundError("Patterns must stay inside the directory")
+            source = BatchSource(expand_paths(patterns, self.server.directory))
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot send a batch to %s: %s", self.address, e)
+            self.server.refuse(self.address, self.session_id)
+            self.finished = True
+            return
+        self.filename = f"{source.file_count} files"
+        if self.compression != COMPRESSION_NONE:
+            self.prepare(self.compress, source, self.start_sender)
+        else:
+            self.start_sender(source)
+
+    def prepare(self, function, source, then):
+        """Run a job that reads a whole source in the Server's thread pool, step calls then with its result.
+
+        :param function: Function of the source, run in a thread.
+        :param source: The source.
+        :param then: Function of the result, called by step on the event loop.
+        """
+        self.preparing = self.server.pool.submit(function, source)
+        self.preparing_source = source
+        self.prepared = then
+
+    def compress(self, source):
+        """Compress the source of a download, in a thread of the pool.
+
+        :param source: The file or batch, closed once compressed.
+        :return: A compress.CompressedSource.
+        """
+        return CompressedSource(source, self.compression)
+
+    def compressed(self, source):
+        """Cache the compressed file of a download and start sending it.
+
+        :param source: The compress.CompressedSource.
+        """
+        logger.info("Compressed %s from %d to %d bytes with %s", self.filename, source.original_size, source.size,
+                    self.compression)
+        self.start_sender(self.server.add_compressed(self.path, source, self.compression))
+
+    def start_sender(self, source):
+        """Create the Sender of a download and start it, or hand the hashing of its blocks to the thread pool
+        first.
+
+        :param source: Data to send, already compressed if the download is.
+        """
+        self.sender = self.server.make_sender(self.address, source, self.payload_size, self.session_id,
+                                              self.compression, self.batch)
+        if self.sender.announces_hashes():
+            self.prepare(block_hashes, self.sender.source, self.sender.start)
+        else:
+            self.sender.start()
+
+    def start_upload(self, name, packet):
+        """Create the Receiver writing the uploaded file and let it answer the setup packet.
+
+        :param name: Filename announced by the client, possibly with a byte range.
+        :param packet: The setup packet.
+        """
+        byte_range = parse_range_filename(name)
+        resume = self.server.resume and byte_range is None
+        if byte_range is None:
+            self.path = os.path.join(self.server.directory, self.filename)
+            self.upload = FileSink(self.path, keep=resume, replace=True)
+        else:
+            filename, offset, length, total_size, upload_id = byte_range
+            self.filename = os.path.basename(filename)
+            self.byte_range = (offset, length)
+            self.upload_id, self.total_size = upload_id, total_size
+            self.path = os.path.join(self.server.directory, self.filename)
+            staging = range_staging_path(self.path, upload_id)
+            self.upload = FileSink(staging, offset, truncate=False)
+            os.truncate(staging, total_size)
+        self.receiver = self.server.make_receiver(self.upload, resume)
+        self.receiver.handle_packet(packet, self.address)
+
+    def finish_upload(self):
+        """Replace the uploaded file once the Receiver has closed, if the upload is complete, or delete what
+        a failed upload wrote."""
+        if self.upload is None:
+            return
+        if not self.receiver.complete():
+            self.upload.discard()
+        elif self.byte_range is None:
+            self.upload.commit()
+            self.server.invalidate(self.path)
+        elif commit_range(self.path, self.upload_id, *self.byte_range, self.total_size):
+            logger.info("Received every range of %s", self.filename)
+            self.server.invalidate(self.path)
+        self.upload = None
+
+    def handle_datagram(self, packet):
+        """Pass a datagram from the client to the Receiver or Sender of the session.
+
+        :param packet: Raw datagram.
+        """
+        self.last_activity = time.monotonic()
+        if self.sender is not None:
+            self.sender.handle_ack(packet)
+        elif self.receiver is not None and not self.receiver.handle_packet(packet, self.address):
+            self.receiver.close()
+            self.finish_upload()
+            part = "" if self.byte_range is None else f" bytes {self.byte_range[0]}-{sum(self.byte_range) - 1}"
+            if self.batch_sink is not None:
+                self.filename = f"{len(self.batch_sink.files)} files"
+            logger.info("Received %s%s from %s: %s", self.filename, part, self.address,
+                        self.receiver.metrics.summary())
+            self.receiver = None
+            self.finished = True
+
+    def step(self):
+        """Advance the Sender of a download, or send the delayed ACK of an upload, after datagrams were handled
+        or a timer may have expired."""
+        if self.finished:
+            return
+        if self.receiver is not None:
+            self.receiver.step()
+        if self.preparing is not None:
+            if not self.preparing.done():
+                return
+            preparing, then = self.preparing, self.prepared
+            self.preparing = self.preparing_source = self.prepared = None
+            try:
+                result = preparing.result()
+            except OSError as e:
+                logger.warning("Cannot prepare %s for %s: %s", self.filename, self.address, e)
+                self.finished = True
+                return
+            then(result)
+            if self.preparing is not None:
+                return
+        if self.sender is None:
+            return
+        try:
+            self.sender.step()
+        except ConnectionError as e:
+            logger.warning("Giving up on %s: %s", self.address, e)
+            self.finished = True
+            return
+        if self.sender.finished:
+            logger.info("Sent %s to %s: %s", self.filename, self.address, self.sender.metrics.summary())
+            self.finished = True
+
+    def next_deadline(self):
+        """Return when step next has to run even if no datagram arrives.
+
+        :return: Monotonic time, or None if the session only reacts to datagrams.
+        """
+        if self.finished:
+            return None
+        if self.receiver is not None:
+            return self.receiver.next_deadline()
+        if self.preparing is not None:
+            return time.monotonic() + PREPARE_POLL
+        return self.sender.next_deadline()
+
+    def close(self):
+        """Release the file of the current stage, once the thread pool no longer reads it."""
+        if self.preparing is not None:
+            if self.preparing.cancel():
+                if self.sender is None:
+                    self.preparing_source.close()
+            else:
+                concurrent.futures.wait([self.preparing])
+                if self.sender is None and self.preparing.exception() is None:
+                    self.preparing.result().close()
+        if self.sender is not None:
+            self.sender.close()
+        if self.receiver is not None:
+            self.receiver.close()
+            self.finish_upload()
+
 
 class Server:
-    """A server that can receive files from a client or respond to file queries."""
-    def __init__(self, server_port, server_ip):
+    """A server that receives files from clients and responds to file queries.
+
+    One event loop on a single UDP port serves any number of clients at once. Datagrams are demultiplexed
+    into a ServerSession per client address, and each session drives its own Receiver or Sender on the
+    shared socket. With several workers, each worker process binds its own socket to the same port with
+    SO_REUSEPORT and the kernel spreads clients across them by address.
+
+    Once a session finishes, its address is in TIME_WAIT: retransmitted EOT packets are acknowledged again
+    and a late duplicate of its setup packet does not open a new session, while a setup with a new session
+    ID does, so a client can reuse its port right away.
+
+    Downloads are sent from a cache.PacketCache, which keeps popular files mapped along with the checksums of
+    their payloads. Every worker process has its own cache.
+    """
+    def __init__(self, server_port, server_ip, max_payload_size=MAX_PAYLOAD_SIZE, selective_repeat=False,
+                 directory=FILES_DIRECTORY, workers=1, ack_every=ACK_EVERY, ack_delay=ACK_DELAY, fec_group=0,
+                 resume=False, dedup=False, cache_size=CACHE_SIZE):
         """
         Initialize the server with the specified parameters.
 
         :param server_port: Port number to listen on.
         :param server_ip: IP address of the server.
+        :param max_payload_size: Largest payload size accepted for uploads and proposed for downloads,
+            the client may lower it during session setup.
+        :param selective_repeat: Propose Selective Repeat for downloads.
+        :param directory: Directory uploads are written to and downloads are read from.
+        :param workers: Number of worker processes sharing the port with SO_REUSEPORT.
+        :param ack_every: In-order packets of an upload acknowledged together.
+        :param ack_delay: Seconds the ACK of fewer than ack_every packets of an upload is held back.
+        :param fec_group: Data packets per parity packet proposed for downloads, 0 without forward error
+            correction. Uploads use what the client proposes.
+        :param resume: Keep a checkpoint of every upload so an interrupted upload resumes, and skip the blocks of
+            a file that are unchanged when the client announces its block hashes.
+        :param dedup: Announce the block hashes of downloads, so a client resuming into an older copy of the file
+            is only sent the blocks that changed.
+        :param cache_size: Bytes of files and checksums the download cache holds, 0 disables it.
         """
         self.server_port = server_port
         self.server_ip = server_ip
-        self.filename = ""
-        self.reassembled_data = b''
-        self.sender_address = None
-
+        self.max_payload_size = max_payload_size
+        self.selective_repeat = selective_repeat
+        self.directory = directory
+        self.workers = workers
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.fec_group = fec_group
+        self.resume = resume
+        self.dedup = dedup
+        self.cache = PacketCache(cache_size) if cache_size > 0 else None
+        self.codec = PacketCodec(0)
+        self.sock = None
+        self.pool = None
+        self.sessions = {}
+        self.time_wait = {}  # Address to (session ID, expiry), in order of expiry
+        self.running = False
 
     def run(self):
+        """Serve clients until interrupted, in this process or in worker processes."""
+        if self.workers <= 1:
+            self.serve()
+            return
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("SO_REUSEPORT is not supported on this platform, run a single worker")
+        processes = [multiprocessing.Process(target=self.serve, args=(True,)) for _ in range(self.workers)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+    def serve(self, reuse_port=False):
+        """Run the event loop until stop is called.
+
+        :param reuse_port: Bind with SO_REUSEPORT so several workers can share the port.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.setblocking(False)
+        enlarge_socket_buffers(self.sock)
+        self.sock.bind((self.server_ip, self.server_port))
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        self.pool = concurrent.futures.ThreadPoolExecutor(PREPARE_THREADS)
+        logger.info("Server listening on port %d...", self.server_port)
+
+        self.running = True
+        try:
+            while self.running:
+                if selector.select(self.poll_timeout()):
+                    self.handle_datagrams()
+                self.step_sessions()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+            self.pool.shutdown()
+            if self.cache is not None:
+                logger.info("Download cache: %s", self.cache.stats())
+                self.cache.clear()
+            selector.close()
+            self.sock.close()
+
+    def stop(self):
+        """Ask the event loop to exit, it does so within POLL_INTERVAL seconds."""
+        self.running = False
+
+    def poll_timeout(self):
+        """Return how long the event loop may wait for a datagram.
+
+        :return: Seconds until the earliest retransmission timer of any session, at most POLL_INTERVAL.
         """
-        Receive a file from a client or respond to a file query.
+        deadlines = [deadline for deadline in (session.next_deadline() for session in self.sessions.values())
+                     if deadline is not None]
+        if not deadlines:
+            return POLL_INTERVAL
+        return min(POLL_INTERVAL, max(0.0, min(deadlines) - time.monotonic()))
+
+    def handle_datagrams(self):
+        """Drain the socket and dispatch every datagram to the session of its sender."""
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(BUFFER_SIZE)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            session = self.sessions.get(address)
+            packet_type = peek_type(packet)
+            if packet_type == TYPE_SETUP:
+                _, _, payload, valid = self.codec.decode(packet)
+                setup = decode_setup(payload) if valid else None
+                if setup is None:
+                    continue
+                if session is not None and session.session_id != setup[3]:
+                    self.retire(address, time.monotonic())
+                    session = None
+                if session is None:
+                    self.open_session(packet, address, setup)
+                    continue
+            if session is not None:
+                session.handle_datagram(packet)
+            elif packet_type == TYPE_EOT:
+                eot_seq_num = self.eot_seq_num(packet)
+                if eot_seq_num is not None:
+                    self.acknowledge_eot(address, eot_seq_num)
 
-        If the server is receiving a file, it writes the received data to a local file.
-        If the server is responding to a file query, it sends the file data to the client.
+    def open_session(self, packet, address, setup):
+        """Open a session for a setup packet, unless it is a late duplicate of a session in TIME_WAIT.
+
+        :param packet: Raw setup packet.
+        :param address: Address of the client.
+        :param setup: The setup as returned by packet.decode_setup.
         """
-        receiver = Receiver(self.server_port, self.server_ip)
-        receiver.start_receiving()
-        self.filename = receiver.return_filename()
+        finished = self.time_wait.get(address)
+        if finished is not None and finished[0] == setup[3]:
+            return
+        logger.info("New session from %s for %s", address, setup[7])
+        self.sessions[address] = ServerSession(self, address, packet, setup)
 
-        if self.filename.endswith("QUERY"):
-            with open("Server_files/" + self.filename.removesuffix("QUERY"), "rb") as f:
-                data = f.read()
-            self.sender_address = receiver.sender_address
-            sender = Sender(self.sender_address[0], self.sender_address[1], self.server_port, data)
-            sender.send_data()
+    def retire(self, address, now):
+        """Close the session of an address and put the address in TIME_WAIT.
+
+        A client only opens a new session from an address once its previous session ended on its side, so
+        a setup with a new session ID retires the previous session even if the Server has not seen its end.
+
+        :param address: Address of the client.
+        :param now: Monotonic time.
+        """
+        session = self.sessions.pop(address)
+        if not session.finished:
+            logger.info("Session of %s superseded by a new session", address)
+        session.close()
+        self.time_wait.pop(address, None)
+        self.time_wait[address] = (session.session_id, now + TIME_WAIT)
+
+    def step_sessions(self):
+        """Advance every session and drop the ones that finished or went idle."""
+        now = time.monotonic()
+        for address, session in list(self.sessions.items()):
+            session.step()
+            if not session.finished and now - session.last_activity > SESSION_TIMEOUT:
+                logger.warning("No packet from %s for %d seconds, dropping its session", address, SESSION_TIMEOUT)
+                session.finished = True
+            if session.finished:
+                self.retire(address, now)
+        while self.time_wait:
+            address, (_, expiry) = next(iter(self.time_wait.items()))
+            if expiry > now:
+                break
+            del self.time_wait[address]
+
+    def open_file(self, path, compression=COMPRESSION_NONE):
+        """Open a file to download, through the cache if there is one.
+
+        :param path: Path of the file.
+        :param compression: One of compress.COMPRESSION_MODES.
+        :return: The source to send, compressed if the cache holds the file compressed. None if it is to be
+            compressed but the cache does not hold it compressed.
+        :raises OSError: If the file cannot be opened.
+        """
+        if self.cache is None:
+            return None if compression != COMPRESSION_NONE else FileSource(path)
+        source = self.cache.open(path, compression)
+        logger.debug("Download cache after opening %s: %s", path, self.cache.stats())
+        return source
+
+    def add_compressed(self, path, source, compression):
+        """Add a compressed file to the cache if there is one.
+
+        :param path: Path of the file.
+        :param source: The compress.CompressedSource of the file.
+        :param compression: Its compression.
+        :return: The source to send.
+        """
+        if self.cache is None:
+            return source
+        return self.cache.add(path, (source.version, source.original_size, source.inode), source, compression)
+
+    def invalidate(self, path):
+        """Drop a file that an upload replaced from the download cache.
+
+        :param path: Path of the file.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(path)
+
+    def make_receiver(self, sink, resume=False):
+        """Create a Receiver on the shared socket.
+
+        :param sink: Where the Receiver writes the data.
+        :param resume: Resume from the checkpoint of the file, the sink keeps its content.
+        :return: The Receiver.
+        """
+        return Receiver(self.server_port, self.server_ip, max_payload_size=self.max_payload_size, sink=sink,
+                        sock=self.sock, ack_every=self.ack_every, ack_delay=self.ack_delay, resume=resume)
+
+    def make_sender(self, address, source, payload_size, session_id, compression=COMPRESSION_NONE, batch=False):
+        """Create a Sender on the shared socket.
+
+        :param address: Address of the client.
+        :param source: Data to send.
+        :param payload_size: Largest payload size the client accepts.
+        :param session_id: ID of the client's query, the Sender's setup packet answers it.
+        :param compression: One of compress.COMPRESSION_MODES.
+        :param batch: The source is a batch.BatchSource.
+        :return: The Sender.
+        """
+        return Sender(address[0], address[1], self.server_port, source,
+                      payload_size=min(payload_size, self.max_payload_size), selective_repeat=self.selective_repeat,
+                      sock=self.sock, session_id=session_id, fec_group=self.fec_group, dedup=self.dedup,
+                      compression=compression, batch=batch)
+
+    def eot_seq_num(self, packet):
+        """Verify an EOT packet from a sender.
+
+        :param packet: Raw datagram.
+        :return: Sequence number of a valid EOT packet, None for anything else.
+        """
+        packet_type, seq_num, _, valid = self.codec.decode(packet)
+        return seq_num if packet_type == TYPE_EOT and valid else None
+
+    def refuse(self, address, session_id):
+        """Answer a query for a file that cannot be sent.
+
+        :param address: Address of the client.
+        :param session_id: ID of the query.
+        """
+        self.sock.sendto(self.codec.encode_setup(0, FLAG_NOT_FOUND, 0, session_id), address)
+
+    def acknowledge_eot(self, address, seq_num):
+        """Acknowledge an EOT packet again.
+
+        :param address: Address of the client.
+        :param seq_num: Sequence number of the EOT packet.
+        """
+        self.sock.sendto(self.codec.encode_ack(seq_num), address)
 
-        else:
-            receiver = Receiver(self.server_port, self.server_ip)
-            receiver.start_receiving()
-            self.reassembled_data = receiver.reassemble_data()
-            with open("Server_files/" + server.filename, "wb") as f:
-                f.write(server.reassembled_data)
 
 if __name__ == "__main__":
     """Parse command-line arguments and start the Server."""
     parser = argparse.ArgumentParser(description="Server")
     parser.add_argument("--server-port", type=int, required=True, help="Server's sending port")
     parser.add_argument("--server-ip", type=str, default="127.0.0.1", help="Client's listening port")
+    parser.add_argument("--max-payload-size", type=int, default=MAX_PAYLOAD_SIZE, help="Largest payload size to use")
+    parser.add_argument("--selective-repeat", action="store_true", help="Use Selective Repeat for downloads")
+    parser.add_argument("--directory", type=str, default=FILES_DIRECTORY, help="Directory to store and serve files")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port with SO_REUSEPORT")
+    parser.add_argument("--ack-every", type=int, default=ACK_EVERY, help="Upload packets acknowledged together")
+    parser.add_argument("--ack-delay", type=float, default=ACK_DELAY * 1000,
+                        help="Milliseconds an upload ACK of fewer packets is held back")
+    parser.add_argument("--fec", type=int, default=0, help="Download packets per XOR parity packet, 0 disables FEC")
+    parser.add_argument("--resume", action="store_true", help="Checkpoint uploads so interrupted ones resume")
+    parser.add_argument("--dedup", action="store_true", help="Only send the blocks of a download a client lacks")
+    parser.add_argument("--cache-size", type=float, default=CACHE_SIZE / (1024 * 1024),
+                        help="MiB of downloaded files and their checksums to cache, 0 disables the cache")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="DEBUG logs every packet")
     args = parser.parse_args()
+    configure_logging(args.log_level)
 
-    server = Server(args.server_port, args.server_ip)
+    server = Server(args.server_port, args.server_ip, args.max_payload_size, args.selective_repeat, args.directory,
+                    args.workers, args.ack_every, args.ack_delay / 1000, args.fec, args.resume, args.dedup,
+                    int(args.cache_size * 1024 * 1024))
     server.run()
-    
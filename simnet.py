@@ -0,0 +1,271 @@
+import heapq
+import multiprocessing
+import random
+from collections import deque
+from sender import Sender
+from receiver import Receiver
+from intermediate import Flow
+from netmodel import NetworkProfile
+from congestion import CONGESTION_AIMD
+from packet import DEFAULT_PAYLOAD_SIZE, TYPE_EOT, CHECKSUM_CRC32
+
+# Constants
+SENDER_ADDRESS = ("10.0.0.1", 5000)
+RECEIVER_ADDRESS = ("10.0.0.2", 6000)
+LATENCY = 0.0001  # Seconds every packet takes on top of the profile, about a loopback hop
+TIME_LIMIT = 3600  # Simulated seconds before a transfer that does not finish is abandoned
+
+
+class SimClock:
+    """Virtual time, advanced by SimNetwork from one event to the next instead of by waiting.
+
+    Called like time.monotonic, so it can be passed as the clock of a Sender, Receiver or TransferMetrics.
+    """
+    def __init__(self):
+        """Start at time zero."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current virtual time.
+
+        :return: Seconds since the start of the simulation.
+        """
+        return self.now
+
+
+class SimSocket:
+    """The part of a non-blocking UDP socket the Sender and Receiver use, on a SimNetwork.
+
+    sendto hands the datagram to the network, which delivers it to the inbox of the destination socket once
+    its release time is reached. recvfrom pops the inbox and raises BlockingIOError when it is empty.
+    """
+    def __init__(self, network, address):
+        """Attach the socket to the network.
+
+        :param network: SimNetwork the socket belongs to.
+        :param address: Address the socket is bound to.
+        """
+        self.network = network
+        self.address = address
+        self.inbox = deque()
+
+    def sendto(self, packet, address):
+        """Send a datagram.
+
+        :param packet: The datagram.
+        :param address: Destination address.
+        """
+        self.network.send(bytes(packet), self.address, address)
+
+    def recvfrom(self, buffer_size):
+        """Receive the oldest delivered datagram.
+
+        :param buffer_size: Largest datagram to receive, longer ones are truncated like on a real socket.
+        :return: Tuple (datagram, source address).
+        :raises BlockingIOError: If no datagram has been delivered.
+        """
+        if not self.inbox:
+            raise BlockingIOError
+        packet, address = self.inbox.popleft()
+        return packet[:buffer_size], address
+
+    def close(self):
+        """Nothing to release."""
+
+
+class SimNetwork:
+    """An in-memory network between senders and one receiver, running in virtual time.
+
+    It applies the same impairments as the Intermediate: every sender gets a Flow, numbered in the order the
+    senders first send, with its random generator seeded like the Intermediate's and a netmodel.Link per
+    direction, so a profile and seed impair the same packets in simulation and on real sockets. Instead of
+    holding packets back in real time, the network keeps every datagram in a heap until its release time
+    and the clock jumps straight to the next event, so timeouts and delays cost no wall-clock time.
+    """
+    def __init__(self, receiver_address=RECEIVER_ADDRESS, profile=None, seed=None, latency=LATENCY):
+        """Initialize an empty network.
+
+        :param receiver_address: Address of the receiver, packets to it take the data link of their flow and
+            packets from it the ACK link.
+        :param profile: netmodel.NetworkProfile with the impairments to apply, by default none.
+        :param seed: Seed of the random impairments.
+        :param latency: Seconds added to the delay of every packet.
+        """
+        self.receiver_address = receiver_address
+        self.profile = profile if profile is not None else NetworkProfile()
+        self.buckets = (self.profile.make_bucket(), self.profile.make_bucket())
+        self.seed = seed
+        self.latency = latency
+        self.clock = SimClock()
+        self.sockets = {}
+        self.flows = {}
+        self.events = []
+        self.event_count = 0
+
+    def socket(self, address):
+        """Create a socket bound to an address.
+
+        :param address: Address of the socket.
+        :return: The SimSocket.
+        """
+        sock = self.sockets[address] = SimSocket(self, address)
+        return sock
+
+    def flow(self, address):
+        """Return the flow of a sender, opening it on its first packet.
+
+        :param address: Address of the sender.
+        :return: The Flow.
+        """
+        flow = self.flows.get(address)
+        if flow is None:
+            flow = self.flows[address] = Flow(len(self.flows), address, None, self.seed, self.profile, self.buckets)
+        return flow
+
+    def send(self, packet, source, destination):
+        """Pass a datagram through the link of its flow and schedule its delivery.
+
+        :param packet: The datagram.
+        :param source: Address of the sending socket.
+        :param destination: Address of the receiving socket.
+        """
+        if destination == self.receiver_address:
+            link = self.flow(source).data_link
+        else:
+            link = self.flow(destination).ack_link
+        now = self.clock.now
+        result = link.transmit(packet, now)
+        if result is None:
+            return
+        release, packet = result
+        self.event_count += 1
+        heapq.heappush(self.events, (release + self.latency, self.event_count, destination, bytes(packet), source))
+
+    def next_delivery(self):
+        """Return when the next datagram arrives.
+
+        :return: Virtual time of the earliest delivery, or None if no datagram is in flight.
+        """
+        return self.events[0][0] if self.events else None
+
+    def deliver(self):
+        """Move every datagram released by the current time into the inbox of its destination socket."""
+        now = self.clock.now
+        while self.events and self.events[0][0] <= now:
+            _, _, destination, packet, source = heapq.heappop(self.events)
+            sock = self.sockets.get(destination)
+            if sock is not None:
+                sock.inbox.append((packet, source))
+
+    def advance(self, deadlines):
+        """Jump the clock to the next datagram delivery or timer and deliver the datagrams due by then.
+
+        :param deadlines: Timer deadlines of the nodes, None for nodes without an armed timer.
+        :return: False if nothing is left to happen.
+        """
+        pending = [deadline for deadline in deadlines if deadline is not None]
+        if self.events:
+            pending.append(self.events[0][0])
+        if not pending:
+            return False
+        self.clock.now = max(self.clock.now, min(pending))
+        self.deliver()
+        return True
+
+    def run_transfer(self, sender, receiver, time_limit=TIME_LIMIT):
+        """Drive a Sender and a Receiver on sockets of this network until the Sender finishes.
+
+        The nodes are driven like the Server drives its sessions: datagrams are passed to handle_packet and
+        handle_ack, and both nodes step after every event. An EOT retransmitted after the Receiver finished
+        is acknowledged again, as the Server does.
+
+        :param sender: Sender on a socket of this network, with the network's clock.
+        :param receiver: Receiver on a socket of this network, with the network's clock.
+        :param time_limit: Virtual seconds after which the transfer is abandoned.
+        :raises TimeoutError: If the transfer stalls or does not finish within time_limit.
+        """
+        receiver_socket = receiver.sock
+        receiving = True
+        sender.start()
+        while not sender.finished:
+            if not self.advance([sender.next_deadline(), receiver.next_deadline() if receiving else None]):
+                raise TimeoutError("Simulated transfer stalled with nothing in flight")
+            if self.clock.now > time_limit:
+                raise TimeoutError(f"Simulated transfer did not finish within {time_limit} s")
+            while receiver_socket.inbox:
+                packet, address = receiver_socket.inbox.popleft()
+                if receiving:
+                    receiving = receiver.handle_packet(packet, address)
+                    if not receiving:
+                        receiver.close()
+                else:
+                    packet_type, seq_num, _, valid = receiver.codec.decode(packet)
+                    if packet_type == TYPE_EOT and valid:
+                        receiver_socket.sendto(receiver.codec.encode_ack(seq_num), address)
+            if receiving:
+                receiver.step()
+            sender.handle_acks()
+            sender.step()
+        sender.close()
+        if receiving:
+            receiver.close()
+
+
+def simulate_transfer(size, window_size=None, payload_size=DEFAULT_PAYLOAD_SIZE, selective_repeat=False,
+                      congestion_control=CONGESTION_AIMD, profile=None, seed=None, checksum_mode=CHECKSUM_CRC32,
+                      latency=LATENCY, time_limit=TIME_LIMIT, fec_group=0):
+    """Transfer random data from a Sender to a Receiver over a SimNetwork.
+
+    The data is generated from the seed, so a simulation is fully determined by its arguments and can run in
+    any process.
+
+    :param size: Number of bytes to transfer.
+    :param window_size: Window size of the Sender.
+    :param payload_size: Payload size the Sender proposes.
+    :param selective_repeat: Use Selective Repeat.
+    :param congestion_control: Congestion control of the Sender.
+    :param profile: netmodel.NetworkProfile of the network.
+    :param seed: Seed of the data and of the impairments.
+    :param checksum_mode: Checksum algorithm of both nodes.
+    :param latency: Seconds added to the delay of every packet.
+    :param time_limit: Virtual seconds after which the transfer is abandoned.
+    :param fec_group: Data packets per parity packet, 0 without forward error correction.
+    :return: Dict with the virtual elapsed time, whether the data arrived intact, and the metrics of both
+        nodes as exported by TransferMetrics.to_dict.
+    """
+    data = random.Random(seed).randbytes(size)
+    network = SimNetwork(RECEIVER_ADDRESS, profile, seed, latency)
+    receiver = Receiver(RECEIVER_ADDRESS[1], RECEIVER_ADDRESS[0], checksum_mode,
+                        sock=network.socket(RECEIVER_ADDRESS), clock=network.clock)
+    sender = Sender(RECEIVER_ADDRESS[0], RECEIVER_ADDRESS[1], SENDER_ADDRESS[1], data, window_size, checksum_mode,
+                    payload_size, selective_repeat, congestion_control, sock=network.socket(SENDER_ADDRESS),
+                    clock=network.clock, fec_group=fec_group)
+    network.run_transfer(sender, receiver, time_limit)
+    return {
+        "elapsed": sender.metrics.elapsed(),
+        "intact": receiver.reassemble_data() == data,
+        "sender": sender.metrics.to_dict(),
+        "receiver": receiver.metrics.to_dict(),
+    }
+
+
+def simulate(kwargs):
+    """Run simulate_transfer with keyword arguments, for Pool.map.
+
+    :param kwargs: Dict of simulate_transfer arguments.
+    :return: The result of simulate_transfer.
+    """
+    return simulate_transfer(**kwargs)
+
+
+def sweep(runs, processes=None):
+    """Run many simulations in parallel across a process pool.
+
+    :param runs: List of dicts of simulate_transfer arguments.
+    :param processes: Worker processes, by default one per CPU. 1 runs every simulation in this process.
+    :return: List of simulate_transfer results, in the order of runs.
+    """
+    if processes == 1:
+        return [simulate(kwargs) for kwargs in runs]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(simulate, runs)
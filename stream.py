@@ -0,0 +1,311 @@
+import mmap
+import os
+import shutil
+try:
+    import fcntl
+except ImportError:  # Windows, where the Server cannot run several workers
+    fcntl = None
+
+# Constants
+PART_SUFFIX = ".part"  # Suffix of the file a resumable transfer writes before it replaces the target
+RANGES_SUFFIX = ".ranges"  # Suffix of the list of completed byte ranges next to the staging file of an upload
+
+
+class BytesSource:
+    """Data to send that is already in memory."""
+    def __init__(self, data):
+        """Initialize the source.
+
+        :param data: bytes-like object, or a str that is sent UTF-8 encoded.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.view = memoryview(data)
+        self.size = len(self.view)
+
+    def read(self, offset, length):
+        """Return part of the data.
+
+        :param offset: Byte offset to read from.
+        :param length: Number of bytes to read, fewer are returned at the end of the data.
+        :return: Zero-copy slice of the data.
+        """
+        return self.view[offset:offset + length]
+
+    def close(self):
+        """Nothing to release."""
+
+
+class FileSource:
+    """A file, or a byte range of it, to send, mapped into memory so pages are read lazily by the OS as
+    packets are sent.
+
+    Nothing is copied onto the Python heap, so memory use does not grow with the file size. Files that
+    cannot be mapped, such as empty files or pipes, are read with pread instead. The modification time of the
+    file in ns is its version, which a resuming receiver compares with its checkpoint. Its inode tells the file
+    apart from one that replaced it since, see cache.PacketCache.
+    """
+    def __init__(self, path, offset=0, length=None):
+        """Open the file.
+
+        :param path: Path of the file to send.
+        :param offset: First byte of the range to send.
+        :param length: Number of bytes to send, by default up to the end of the file.
+        """
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        file_size = stat.st_size
+        self.version = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        self.offset = min(offset, file_size)
+        self.size = file_size - self.offset if length is None else min(length, file_size - self.offset)
+        self.map = None
+        self.view = None
+        if self.size:
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.map)[self.offset:self.offset + self.size]
+            except (OSError, ValueError):
+                self.map = None
+
+    def read(self, offset, length):
+        """Return part of the file.
+
+        :param offset: Byte offset to read from.
+        :param length: Number of bytes to read, fewer are returned at the end of the file.
+        :return: Zero-copy slice of the mapping, or the bytes read with pread.
+        """
+        if self.view is not None:
+            return self.view[offset:offset + length]
+        length = max(0, min(length, self.size - offset))
+        return os.pread(self.file.fileno(), length, self.offset + offset)
+
+    def close(self):
+        """Unmap and close the file."""
+        if self.view is not None:
+            self.view.release()
+            self.map.close()
+        self.file.close()
+
+
+def open_source(data):
+    """Wrap data to send in a source, leaving existing sources unchanged.
+
+    :param data: A source, or a bytes-like object or str to send from memory.
+    :return: An object with size, read(offset, length) and close().
+    """
+    if isinstance(data, (bytes, bytearray, memoryview, str)):
+        return BytesSource(data)
+    return data
+
+
+class MemorySink:
+    """Collects received payloads in memory, the behaviour of the original Receiver."""
+    def __init__(self):
+        """Initialize an empty sink."""
+        self.chunks = {}
+
+    def preallocate(self, size):
+        """Nothing to reserve in memory.
+
+        :param size: Expected size of the data in bytes.
+        """
+
+    def write(self, offset, payload):
+        """Store a payload.
+
+        :param offset: Byte offset of the payload in the data.
+        :param payload: Payload of a data packet.
+        """
+        self.chunks[offset] = payload
+
+    def getvalue(self):
+        """Join the payloads in offset order.
+
+        :return: The received data.
+        """
+        return b"".join(self.chunks[offset] for offset in sorted(self.chunks))
+
+    def close(self):
+        """Nothing to release."""
+
+
+class FileSink:
+    """Writes received payloads straight to their offset in a file with pwrite.
+
+    Payloads are not buffered, so out-of-order packets cost no memory either. When the size of the
+    data is known in advance the file is preallocated, so the filesystem can lay it out contiguously and
+    a full disk is detected before the transfer starts. A sink that does not truncate writes one byte
+    range of the file and leaves the rest alone, so several transfers can fill in one file in parallel. A
+    sink that keeps the file writes over its existing content, which a resumed transfer only partly
+    replaces, and trims it to the size of the data.
+
+    A sink that replaces the file never writes to it: it writes a staging file in the same directory, and
+    commit moves the staging file over the target once the transfer is complete, so a reader that has the old
+    file open or mapped keeps its inode whole, and a failed transfer leaves the old file alone. A sink that
+    keeps the file stages in the target with PART_SUFFIX, which starts as a copy of the target and which a
+    resumed transfer finds again. Other sinks stage in a new temporary file, which discard deletes. The byte
+    ranges of a parallel upload share one staging file, see commit_range.
+    """
+    def __init__(self, path, offset=0, truncate=True, keep=False, replace=False):
+        """Create the file.
+
+        :param path: Path of the file to write.
+        :param offset: Offset in the file of the first byte of the data, the start of the range.
+        :param truncate: Truncate the file when it is opened and trim it to the data when it is closed. Sinks
+            of byte ranges do not.
+        :param keep: Keep the existing content when the file is opened, and trim it to the size passed to
+            preallocate when it is closed, for transfers resumed from a checkpoint.Checkpoint.
+        :param replace: Write a staging file that commit moves over path, instead of path itself.
+        """
+        self.target = path
+        self.offset = offset
+        self.truncate = truncate
+        self.keep = keep
+        self.replace = replace
+        self.created = True
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if self.truncate and not keep else 0)
+        if not replace:
+            self.path = path
+        elif keep:
+            self.path = path + PART_SUFFIX
+            self.created = not os.path.exists(self.path)
+            if self.created and os.path.exists(path):
+                shutil.copyfile(path, self.path)
+        else:
+            directory, name = os.path.split(path)
+            self.path = os.path.join(directory, f".{name}.{os.urandom(4).hex()}{PART_SUFFIX}")
+            flags |= os.O_EXCL
+        self.fd = os.open(self.path, flags, 0o644)
+        self.size = 0
+        self.expected_size = None
+
+    def preallocate(self, size):
+        """Reserve space for the data.
+
+        :param size: Size of the data in bytes.
+        """
+        self.expected_size = size
+        if size <= 0:
+            return
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, self.offset, size)
+                return
+            except OSError:
+                pass
+        if os.fstat(self.fd).st_size < self.offset + size:
+            os.ftruncate(self.fd, self.offset + size)
+
+    def write(self, offset, payload):
+        """Write a payload at its offset.
+
+        :param offset: Byte offset of the payload in the data.
+        :param payload: Payload of a data packet.
+        """
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, payload, self.offset + offset)
+        else:
+            os.lseek(self.fd, self.offset + offset, os.SEEK_SET)
+            os.write(self.fd, payload)
+        self.size = max(self.size, offset + len(payload))
+
+    def close(self):
+        """Trim any preallocated space past the received data, unless writing a range, and close the file."""
+        if self.fd is None:
+            return
+        if self.keep:
+            if self.expected_size is not None:
+                os.ftruncate(self.fd, self.expected_size)
+        elif self.truncate:
+            os.ftruncate(self.fd, self.size)
+        os.close(self.fd)
+        self.fd = None
+
+    def commit(self):
+        """Close the file and move the staging file of a complete transfer over the target."""
+        self.close()
+        if self.replace:
+            os.replace(self.path, self.target)
+
+    def discard(self):
+        """Close the file and delete the staging file of a failed transfer. The staging file of a transfer that
+        keeps the file is left for the transfer to resume, unless this sink created it and wrote nothing."""
+        self.close()
+        if self.replace and self.created and (not self.keep or not self.size) and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def range_filename(filename, offset, length, total_size, upload_id):
+    """Name announcing one byte range of a file in a parallel upload.
+
+    :param filename: Name of the file.
+    :param offset: First byte of the range.
+    :param length: Number of bytes in the range.
+    :param total_size: Size of the whole file.
+    :param upload_id: ID shared by the ranges of one upload, chosen by the client.
+    :return: The filename with the range appended.
+    """
+    return f"{filename}RANGE{offset}:{length}:{total_size}:{upload_id}"
+
+
+def parse_range_filename(name):
+    """Split a name built by range_filename.
+
+    :param name: Filename received by the server.
+    :return: Tuple (filename, offset, length, total_size, upload_id), or None if the name announces a whole
+        file.
+    """
+    filename, separator, byte_range = name.rpartition("RANGE")
+    if not separator:
+        return None
+    try:
+        offset, length, total_size, upload_id = (int(value) for value in byte_range.split(":"))
+    except ValueError:
+        return None
+    return filename, offset, length, total_size, upload_id
+
+
+def range_staging_path(path, upload_id):
+    """Path of the staging file the byte ranges of a parallel upload are written to.
+
+    :param path: Path of the file being uploaded.
+    :param upload_id: ID of the upload.
+    :return: Path of a hidden file in the same directory.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{upload_id}{PART_SUFFIX}")
+
+
+def commit_range(path, upload_id, offset, length, total_size):
+    """Record a complete byte range of a parallel upload, and move the staging file over the file once the
+    ranges cover all of it.
+
+    The ranges of an upload may be received by different worker processes of the Server, so the completed
+    ones are listed in a file next to the staging file, which each appends to and reads under an exclusive
+    lock; whichever range completes the file replaces it.
+
+    :param path: Path of the file being uploaded.
+    :param upload_id: ID of the upload.
+    :param offset: First byte of the range.
+    :param length: Number of bytes in the range.
+    :param total_size: Size of the whole file.
+    :return: True if this range completed the file and it was replaced.
+    """
+    staging = range_staging_path(path, upload_id)
+    with open(staging + RANGES_SUFFIX, 'a+') as ranges_file:
+        if fcntl is not None:
+            fcntl.flock(ranges_file, fcntl.LOCK_EX)
+        ranges_file.write(f"{offset} {length}\n")
+        ranges_file.flush()
+        ranges_file.seek(0)
+        covered = 0
+        for start, size in sorted(tuple(int(value) for value in line.split()) for line in ranges_file):
+            if start > covered:
+                break
+            covered = max(covered, start + size)
+        if covered < total_size or not os.path.exists(staging):
+            return False
+        os.replace(staging, path)
+        os.remove(staging + RANGES_SUFFIX)
+        return True
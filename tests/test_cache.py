@@ -0,0 +1,106 @@
+"""Checks that uploading a file while the Server sends it from its download cache replaces the file instead of
+truncating the mapping under the download, which would kill the Server with SIGBUS.
+
+Run from the repository root with python -m unittest discover tests, or python -m pytest tests.
+"""
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmark import free_port
+from client import Client
+
+# Constants
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+OLD_SIZE = 32 * 2 ** 20  # Bytes of the file the Server caches and sends
+NEW_SIZE = 2 ** 20  # Bytes of the file uploaded over it, smaller so the old mapping outlives the new file
+DOWNLOAD_PAYLOAD_SIZE = 1000  # Small payloads so the download is still running while the upload completes
+TIMEOUT = 30  # Seconds a transfer, or the Server replacing the file, may take before the test fails
+
+
+class ReplaceWhileDownloadingTest(unittest.TestCase):
+    """Runs server.py in its own process, so a crash shows as a dead process rather than a dead test run."""
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.directory = tempfile.TemporaryDirectory()
+        self.server_directory = os.path.join(self.directory.name, "server")
+        self.client_directory = os.path.join(self.directory.name, "client")
+        os.mkdir(self.server_directory)
+        os.mkdir(self.client_directory)
+        self.old = os.urandom(OLD_SIZE)
+        self.new = os.urandom(NEW_SIZE)
+        with open(os.path.join(self.server_directory, "file.bin"), "wb") as f:
+            f.write(self.old)
+        self.server_port = free_port()
+        self.server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--server-port", str(self.server_port),
+                                        "--directory", self.server_directory, "--log-level", "WARNING"],
+                                       stderr=subprocess.DEVNULL)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.wait()
+        self.directory.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def download(self, directory, payload_size=DOWNLOAD_PAYLOAD_SIZE):
+        """Download file.bin from the Server.
+
+        :param directory: Directory the file is written to.
+        :param payload_size: Largest payload size accepted.
+        :return: Content of the downloaded file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        Client(free_port(), self.server_port, "127.0.0.1", True, "file.bin", payload_size, directory=directory).run()
+        with open(os.path.join(directory, "file.bin"), "rb") as f:
+            return f.read()
+
+    def wait_for(self, condition, message):
+        """Poll a condition until it holds, failing after TIMEOUT seconds.
+
+        :param condition: Function returning True once the wait is over.
+        :param message: Failure message.
+        """
+        deadline = time.monotonic() + TIMEOUT
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail(message)
+            time.sleep(0.01)
+
+    def test_upload_replaces_file_sent_from_the_cache(self):
+        self.assertEqual(self.download(os.path.join(self.client_directory, "first")), self.old)
+
+        result = {}
+        second = os.path.join(self.client_directory, "second")
+        os.mkdir(second)
+        downloading = threading.Thread(target=lambda: result.update(data=self.download(second)), daemon=True)
+        downloading.start()
+        self.wait_for(lambda: any(os.path.getsize(os.path.join(second, name))
+                                  for name in os.listdir(second)), "the second download did not start")
+        upload = os.path.join(self.client_directory, "file.bin")
+        with open(upload, "wb") as f:
+            f.write(self.new)
+        # A Sender retransmits to a dead Server forever, so both transfers run in threads given up on after TIMEOUT
+        uploading = threading.Thread(target=Client(free_port(), self.server_port, "127.0.0.1", False, upload).run,
+                                     daemon=True)
+        uploading.start()
+        uploading.join(TIMEOUT)
+        overlapped = downloading.is_alive()
+        downloading.join(TIMEOUT)
+
+        self.assertIsNone(self.server.poll(), "the Server died while sending the file that was replaced")
+        self.assertFalse(uploading.is_alive() or downloading.is_alive(), "a transfer did not finish")
+        self.assertTrue(overlapped, "the download ended before the upload, so nothing was checked")
+        self.assertIn(result.get("data"), (self.old, self.new))
+        self.wait_for(lambda: os.path.getsize(os.path.join(self.server_directory, "file.bin")) == NEW_SIZE,
+                      "the upload did not replace the file")
+        self.assertEqual(self.download(os.path.join(self.client_directory, "third")), self.new)
+        self.assertEqual(sorted(os.listdir(self.server_directory)), ["file.bin"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Checks that streaming a file keeps memory flat, that sequence numbers use all 64 bits and that only the
+EOT packet that follows the data ends a transfer.
+
+Run from the repository root with python -m unittest discover tests, or python -m pytest tests.
+"""
+import logging
+import socket
+import unittest
+
+from benchmark import bench_large
+from packet import (PacketCodec, new_session_id, peek_type, TYPE_DATA, TYPE_EOT, TYPE_ACK, TYPE_SACK,
+                    FLAG_SELECTIVE_REPEAT)
+from receiver import Receiver
+
+# Constants
+TRANSFER_SIZE = 64 * 2 ** 20  # Bytes streamed by the memory check, a scaled-down benchmark.py large
+MEMORY_BOUND = 8 * 2 ** 20  # Bytes of memory the streaming transfer may grow by, an eighth of the data
+SAMPLE_INTERVAL = 0.05  # Seconds between memory samples
+PAYLOAD_SIZE = 100  # Payload size of the sessions fed to a Receiver packet by packet
+HIGH_SEQ_NUM = 2 ** 40 + 3  # Sequence number that does not fit in 32 bits
+
+
+class StreamingMemoryTest(unittest.TestCase):
+    """Streams a file through a Sender and a Receiver on loopback, as benchmark.py large does, and fails if
+    memory grows with the amount of data sent."""
+    def check_memory(self, selective_repeat):
+        """Stream TRANSFER_SIZE bytes and bound the memory sampled along the way. bench_large raises if the
+        received file differs from the one sent.
+
+        :param selective_repeat: Use Selective Repeat instead of Go-Back-N.
+        """
+        logging.disable(logging.INFO)
+        try:
+            _, _, samples = bench_large(TRANSFER_SIZE, 64, 60000, selective_repeat, SAMPLE_INTERVAL)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTrue(any(0 < received < TRANSFER_SIZE for _, received, _, _ in samples))
+        self.assertLess(max(traced for _, _, _, traced in samples), MEMORY_BOUND)
+        resident = [anonymous for _, _, anonymous, _ in samples if anonymous is not None]
+        if resident:
+            self.assertLess(max(resident) - resident[0], MEMORY_BOUND)
+
+    def test_selective_repeat(self):
+        self.check_memory(True)
+
+    def test_go_back_n(self):
+        self.check_memory(False)
+
+
+class ReceiverPacketTest(unittest.TestCase):
+    """Feeds a Receiver hand-made packets and reads the ACKs it answers with."""
+    def setUp(self):
+        self.codec = PacketCodec(PAYLOAD_SIZE)
+        self.peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.peer.bind(("127.0.0.1", 0))
+        self.peer.settimeout(1)
+        self.address = self.peer.getsockname()
+        self.receiver = Receiver(0, "127.0.0.1", ack_every=1)
+
+    def tearDown(self):
+        self.receiver.close()
+        self.peer.close()
+
+    def open_session(self, total_size, selective_repeat=False):
+        """Let the Receiver accept a session.
+
+        :param total_size: Size of the data announced.
+        :param selective_repeat: Announce Selective Repeat.
+        """
+        flags = FLAG_SELECTIVE_REPEAT if selective_repeat else 0
+        setup = self.codec.encode_setup(PAYLOAD_SIZE, flags, total_size, new_session_id())
+        self.assertTrue(self.receiver.handle_packet(setup, self.address))
+        self.peer.recv(PAYLOAD_SIZE * 2)
+        self.assertEqual(self.receiver.payload_size, PAYLOAD_SIZE)
+
+    def send(self, packet_type, seq_num, payload=b""):
+        """Hand the Receiver one packet.
+
+        :param packet_type: TYPE_DATA or TYPE_EOT.
+        :param seq_num: Sequence number of the packet.
+        :param payload: Its payload.
+        :return: What handle_packet returned.
+        """
+        return self.receiver.handle_packet(bytes(self.codec.encode(seq_num, payload, packet_type=packet_type)),
+                                           self.address)
+
+    def receive_ack(self):
+        """Read the next ACK the Receiver sent.
+
+        :return: Tuple (packet_type, seq_num).
+        """
+        packet = self.peer.recv(PAYLOAD_SIZE * 2)
+        packet_type = peek_type(packet)
+        if packet_type == TYPE_SACK:
+            seq_num, _, _, valid = self.codec.decode_sack(packet)
+        else:
+            packet_type, seq_num, _, valid = self.codec.decode(packet)
+        self.assertTrue(valid)
+        return packet_type, seq_num
+
+    def test_sequence_numbers_use_64_bits(self):
+        for seq_num in (2 ** 32, HIGH_SEQ_NUM, 2 ** 64 - 1):
+            packet_type, decoded, payload, valid = self.codec.decode(bytes(self.codec.encode(seq_num, b"abc")))
+            self.assertEqual((packet_type, decoded, bytes(payload), valid), (TYPE_DATA, seq_num, b"abc", True))
+            self.assertEqual(self.codec.decode(self.codec.encode_ack(seq_num))[:2], (TYPE_ACK, seq_num))
+
+    def test_packet_past_32_bits_is_buffered(self):
+        self.open_session((HIGH_SEQ_NUM + 1) * PAYLOAD_SIZE, selective_repeat=True)
+        self.assertTrue(self.send(TYPE_DATA, HIGH_SEQ_NUM, b"x" * PAYLOAD_SIZE))
+        self.assertEqual(self.receiver.out_of_order, {HIGH_SEQ_NUM})
+        self.assertEqual(self.receive_ack(), (TYPE_SACK, HIGH_SEQ_NUM))
+
+    def test_only_the_eot_after_the_data_ends_the_transfer(self):
+        data = bytes(range(250))
+        self.open_session(len(data))
+        self.assertTrue(self.send(TYPE_EOT, 3))
+        self.assertTrue(self.send(TYPE_DATA, 3, b"past the end"))
+        for seq_num in range(3):
+            self.assertTrue(self.send(TYPE_DATA, seq_num, data[seq_num * PAYLOAD_SIZE:(seq_num + 1) * PAYLOAD_SIZE]))
+            self.assertEqual(self.receive_ack(), (TYPE_ACK, seq_num))
+        self.assertTrue(self.send(TYPE_EOT, 2))
+        self.assertTrue(self.send(TYPE_EOT, 2 ** 32 + 3))
+        self.assertFalse(self.send(TYPE_EOT, 3))
+        self.assertEqual(self.receive_ack(), (TYPE_ACK, 3))
+        self.assertEqual(self.receiver.reassemble_data(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()